@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Run bootstrap, add-machine, terminate-machine and destroy-environment offline.
+
+Each environment size gets a fresh fake Scaleway API (benchmarks/fakeapi.py),
+with servers on loopback addresses whose ssh port answers once running, a
+scratch JUJU_HOME, and the fake juju and ssh clients of benchmarks/bin.
+With ``--juju-api``, the plugin also reaches the juju API stand-in of
+benchmarks/fakejuju.py, through websocket-client (the ``api`` extra).
+Reports, per command, the wall time, API calls, spawned subprocesses and
+juju API calls.
+
+Usage: python benchmarks/bench_e2e.py [--sizes 1,10,100] [--boot-delay 2]
+       [--juju-api] [-a add-machine=--async] ...
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from fakeapi import FakeAPI, FakeSSH
+from fakejuju import FakeJujuAPI
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BIN = os.path.join(HERE, 'bin')
+ENV_NAME = 'bench'
+
+
+class Sandbox(object):
+    """Scratch JUJU_HOME and process environment wired to the fakes.
+    """
+
+    def __init__(self, api, ssh, options):
+        self.api = api
+        self.juju_api = None
+        self.home = tempfile.mkdtemp(prefix='juju-scaleway-bench-')
+        self.log = os.path.join(self.home, 'spawns.log')
+        self.state = os.path.join(self.home, 'fake-juju-state.json')
+
+        with open(os.path.join(self.home, 'environments.yaml'), 'w') as fh:
+            yaml.safe_dump({'default': ENV_NAME, 'environments': {ENV_NAME: {
+                'type': 'manual',
+                'bootstrap-host': None,
+                'bootstrap-user': 'root'}}}, fh)
+
+        self.environ = dict(os.environ)
+        self.environ.update({
+            'JUJU_HOME': self.home,
+            'JUJU_ENV': ENV_NAME,
+            'PATH': os.pathsep.join([BIN, os.environ.get('PATH', '')]),
+            'PYTHONPATH': os.pathsep.join(
+                [ROOT, os.environ.get('PYTHONPATH', '')]),
+            'SCALEWAY_ACCESS_KEY': 'bench-access-key',
+            'SCALEWAY_SECRET_KEY': 'bench-secret-key',
+            'SCALEWAY_API_URL': api.url,
+            'JUJU_SCALEWAY_SSH': os.path.join(BIN, 'ssh'),
+            'JUJU_SCALEWAY_SSH_PORT': str(ssh.port),
+            'FAKE_JUJU_STATE': self.state,
+            'FAKE_JUJU_DELAY': str(options.juju_delay),
+            'FAKE_JUJU_FAIL_RATE': str(options.juju_fail_rate),
+            'FAKE_SSH_DELAY': str(options.ssh_delay),
+            'BENCH_LOG': self.log,
+        })
+
+    def use_juju_api(self, juju_api):
+        """Bootstrap environments served by the juju API stand-in.
+        """
+        self.juju_api = juju_api
+        self.environ.update({
+            'FAKE_JUJU_API': juju_api.address,
+            'FAKE_JUJU_API_CA': juju_api.ca_path,
+        })
+
+    def run(self, args):
+        self.api.reset_counters()
+        if self.juju_api is not None:
+            self.juju_api.reset_counters()
+        open(self.log, 'w').close()
+
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'juju_scaleway.cli'] + args,
+            env=self.environ, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        elapsed = time.time() - start
+
+        with open(self.log) as handle:
+            spawns = collections.Counter(
+                line.strip() for line in handle if line.strip())
+        if process.returncode:
+            sys.stderr.write(output.decode('utf-8', 'replace'))
+        juju_calls = {}
+        if self.juju_api is not None:
+            juju_calls = dict(self.juju_api.calls)
+        return {
+            'command': args[0],
+            'status': process.returncode,
+            'seconds': round(elapsed, 2),
+            'api_calls': self.api.total_calls,
+            'api_connections': self.api.connections,
+            'spawns': sum(spawns.values()),
+            'spawns_detail': dict(spawns),
+            'juju_api_calls': juju_calls,
+        }
+
+    def machines(self):
+        with open(self.state) as handle:
+            return sorted(json.load(handle)['machines'], key=int)
+
+    def cleanup(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+
+def scenario(size, options):
+    api = FakeAPI(
+        latency=options.latency, boot_delay=options.boot_delay,
+        per_page=options.per_page, error_rate=options.error_rate,
+        throttle_rate=options.throttle_rate, address_prefix='127.0').start()
+    ssh = FakeSSH(api).start()
+    sandbox = Sandbox(api, ssh, options)
+    juju_api = None
+    if options.juju_api:
+        juju_api = FakeJujuAPI(
+            sandbox.state, latency=options.juju_api_latency,
+            fail_rate=options.juju_fail_rate).start()
+        sandbox.use_juju_api(juju_api)
+    extra = collections.defaultdict(list)
+    for item in options.args:
+        command, _, arg = item.partition('=')
+        extra[command].append(arg)
+
+    try:
+        results = [sandbox.run(['bootstrap'] + extra['bootstrap'])]
+        results.append(sandbox.run(
+            ['add-machine', '-n', str(size)] + extra['add-machine']))
+        added = [m for m in sandbox.machines() if m != '0']
+        victims = added[:max(1, len(added) // 2)] if added else ['1']
+        results.append(sandbox.run(
+            ['terminate-machine'] + victims + extra['terminate-machine']))
+        results.append(sandbox.run(
+            ['destroy-environment'] + extra['destroy-environment']))
+    finally:
+        sandbox.cleanup()
+        ssh.close()
+        api.shutdown()
+        api.server_close()
+        if juju_api is not None:
+            juju_api.close()
+
+    for result in results:
+        result['size'] = size
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--sizes", default="1,10,100")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="API latency per request, in seconds")
+    parser.add_argument("--boot-delay", type=float, default=2.0,
+                        help="Seconds from poweron to running")
+    parser.add_argument("--per-page", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--juju-delay", type=float, default=0.5,
+                        help="Seconds spent per fake juju invocation")
+    parser.add_argument("--juju-fail-rate", type=float, default=0.0,
+                        help="Share of fake juju add-machine calls failing")
+    parser.add_argument("--juju-api", action="store_true",
+                        help="Serve the environment from a juju API "
+                        "stand-in, as well as the fake juju client")
+    parser.add_argument("--juju-api-latency", type=float, default=0.01,
+                        help="Seconds spent per juju API call")
+    parser.add_argument("--ssh-delay", type=float, default=0.2,
+                        help="Seconds spent per fake ssh invocation")
+    parser.add_argument("-a", "--args", action="append", default=[],
+                        metavar="COMMAND=ARG",
+                        help="Extra argument for one of the commands")
+    parser.add_argument("--json", action="store_true",
+                        help="Print results as JSON")
+    options = parser.parse_args()
+
+    results = []
+    for size in [int(size) for size in options.sizes.split(',')]:
+        results.extend(scenario(size, options))
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+
+    row = "{:>5} {:<20} {:>7} {:>9} {:>10} {:>7}  {}"
+    print(row.format(
+        "N", "Command", "Status", "Seconds", "API calls", "Spawns",
+        "Detail"))
+    for result in results:
+        print(row.format(
+            result['size'], result['command'], result['status'],
+            "%.2f" % result['seconds'], result['api_calls'],
+            result['spawns'], " ".join(
+                ["%s=%d" % item
+                 for item in sorted(result['spawns_detail'].items())] +
+                ["api %s=%d" % item
+                 for item in sorted(result['juju_api_calls'].items())])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Memory held by decoded servers: slotted entities against plain __dict__ ones.
+
+Builds a fixture of servers shaped like ``GET /servers`` items, with their
+volumes, tags, image and bootscript blobs, then measures with tracemalloc
+what a list of entities retains once the raw payload is released.
+
+Usage: python benchmarks/bench_entities.py [-n SERVERS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import time
+import tracemalloc
+import uuid
+
+from juju_scaleway.client import Server
+
+
+class DictServer(object):
+    """Entity model prior to slots, a copy of the payload in __dict__.
+    """
+
+    @classmethod
+    def from_dict(cls, data):
+        i = cls()
+        i.__dict__.update(data)
+        return i
+
+
+def server_fixture(index):
+    server_id = str(uuid.UUID(int=index))
+    return {
+        'id': server_id,
+        'name': 'bench-%s' % uuid.UUID(int=index).hex,
+        'state': 'running',
+        'state_detail': 'booted',
+        'creation_date': '2015-03-09T14:32:10.465418+00:00',
+        'modification_date': '2015-03-09T14:35:42.372291+00:00',
+        'public_ip': {
+            'id': str(uuid.UUID(int=index + 1)),
+            'address': '212.47.%d.%d' % (index // 256 % 256, index % 256),
+            'dynamic': False},
+        'private_ip': '10.1.%d.%d' % (index // 256 % 256, index % 256),
+        'dynamic_public_ip': False,
+        'organization': str(uuid.UUID(int=42)),
+        'tags': ['juju', 'bench', 'series:trusty'],
+        'hostname': 'bench-%d' % index,
+        'image': {
+            'id': str(uuid.UUID(int=7)),
+            'name': 'Ubuntu Trusty (14.04 LTS)',
+            'arch': 'arm',
+            'public': True,
+            'creation_date': '2015-01-15T17:49:07.263171+00:00',
+            'extra_volumes': '[]',
+            'root_volume': {
+                'id': str(uuid.UUID(int=8)),
+                'name': 'distrib-ubuntu-trusty-2015-01-15_15:57',
+                'size': 20000000000,
+                'volume_type': 'l_ssd'}},
+        'volumes': {
+            '0': {
+                'id': str(uuid.UUID(int=index + 2)),
+                'name': 'vol-bench-%d' % index,
+                'size': 50000000000,
+                'volume_type': 'l_ssd',
+                'export_uri': 'nbd://10.1.0.%d:4567' % (index % 256),
+                'creation_date': '2015-03-09T14:32:10.465418+00:00',
+                'organization': str(uuid.UUID(int=42)),
+                'server': {'id': server_id, 'name': 'bench-%d' % index}}},
+        'bootscript': {
+            'id': str(uuid.UUID(int=9)),
+            'title': 'Linux 3.19 (latest)',
+            'kernel': {'id': str(uuid.UUID(int=10)),
+                       'path': 'kernel/linux-3.19-latest',
+                       'title': 'Linux 3.19', 'dtb': 'dtb/pimouss.dtb'},
+            'initrd': {'id': str(uuid.UUID(int=11)),
+                       'path': 'initrd/uInitrd-Linux-armv7l-v3.0.0',
+                       'title': 'initrd armv7l'},
+            'bootcmdargs': {'id': str(uuid.UUID(int=12)),
+                            'value': 'ip=dhcp boot=local root=/dev/nbd0'},
+            'organization': str(uuid.UUID(int=42)),
+            'public': True},
+        'security_group': {
+            'id': str(uuid.UUID(int=13)), 'name': 'Default security group'},
+    }
+
+
+def measure(entity, payload):
+    tracemalloc.start()
+    start = time.time()
+    servers = [
+        entity.from_dict(data)
+        for data in json.loads(payload)['servers']]
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(servers) and servers[0].public_ip['address']
+    return elapsed, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("-n", "--servers", type=int, default=10000)
+    options = parser.parse_args()
+
+    payload = json.dumps({
+        'servers': [server_fixture(i) for i in range(options.servers)]})
+    print("Fixture: %d servers, %.1f MiB of JSON" % (
+        options.servers, len(payload) / 2.0 ** 20))
+
+    print("{:<10} {:>10} {:>14} {:>14}".format(
+        "Model", "Seconds", "Retained MiB", "Peak MiB"))
+    for name, entity in (('dict', DictServer), ('slots', Server)):
+        elapsed, current, peak = measure(entity, payload)
+        print("{:<10} {:>10.2f} {:>14.1f} {:>14.1f}".format(
+            name, elapsed, current / 2.0 ** 20, peak / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
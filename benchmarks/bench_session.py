@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Compare one-shot ``requests.get`` calls against the pooled ``Client`` session.
+
+The fake API of benchmarks/fakeapi.py answers ``GET /servers/<id>`` and counts
+accepted TCP connections, so every avoided connection is an avoided
+handshake (plus a TLS one against the real, https-only, API).
+
+Usage: python benchmarks/bench_session.py [-n REQUESTS] [-t THREADS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import threading
+import time
+
+import requests
+
+from fakeapi import FakeAPI
+from juju_scaleway.client import Client
+
+
+def hammer(func, requests_count, threads):
+    per_thread = requests_count // threads
+    workers = [
+        threading.Thread(
+            target=lambda: [func(i) for i in range(per_thread)])
+        for _ in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument(
+        "-t", "--threads", type=int, default=Client.DEFAULT_POOL_SIZE)
+    options = parser.parse_args()
+
+    api = FakeAPI().start()
+    client = Client('bench', 'bench', api_url=api.url)
+    # The rate limiter would dominate the measure.
+    client.rate_limiter.rate = client.rate_limiter.burst = 10 ** 6
+    server = client.create_server('bench-0', 'image')
+
+    def one_shot(_):
+        requests.get(
+            '%s/servers/%s' % (api.url, server.id),
+            headers={'X-Auth-Token': 'bench'}).json()
+
+    def pooled(_):
+        client.get_server(server.id)
+
+    print("{:<10} {:>10} {:>12} {:>10}".format(
+        "Mode", "Seconds", "Connections", "Req/s"))
+    for name, func in (('one-shot', one_shot), ('pooled', pooled)):
+        api.reset_counters()
+        elapsed = hammer(func, options.requests, options.threads)
+        print("{:<10} {:>10.2f} {:>12d} {:>10.0f}".format(
+            name, elapsed, api.connections, options.requests / elapsed))
+
+    client.close()
+    api.shutdown()
+
+
+if __name__ == '__main__':
+    main()
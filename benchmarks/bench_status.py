@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Reading the machines of a large ``juju status`` document.
+
+Builds a synthetic juju 1.x status, machines first then services with
+their units and relations, and times getting its machines: pure Python
+YAML, libyaml, a full JSON decode, and the JSON member extraction the
+plugin uses.
+
+Usage: python benchmarks/bench_status.py [--sizes 100,1000] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import time
+
+import yaml
+
+from juju_scaleway.status import status_machines
+
+
+def machine_fixture(index):
+    address = '10.%d.%d.%d' % (index // 65536, index // 256 % 256, index % 256)
+    return {
+        'agent-state': 'started',
+        'agent-version': '1.25.3',
+        'dns-name': address,
+        'instance-id': 'manual:%s' % address,
+        'series': 'trusty',
+        'hardware': 'arch=armhf cpu-cores=4 mem=2007M',
+        'state-server-member-status': 'no-vote' if index else 'has-vote',
+    }
+
+
+def service_fixture(index, machines, units):
+    name = 'service-%d' % index
+    return name, {
+        'charm': 'cs:trusty/%s-12' % name,
+        'exposed': False,
+        'service-status': {
+            'current': 'active', 'message': 'Ready',
+            'since': '09 Mar 2015 14:32:10Z'},
+        'relations': {
+            'cluster': [name],
+            'database': ['service-%d' % ((index + 1) % machines)]},
+        'units': dict(
+            ('%s/%d' % (name, unit), {
+                'workload-status': {
+                    'current': 'active', 'message': 'Unit is ready',
+                    'since': '09 Mar 2015 14:35:42Z'},
+                'agent-status': {
+                    'current': 'idle', 'since': '09 Mar 2015 14:35:42Z',
+                    'version': '1.25.3'},
+                'agent-state': 'started',
+                'agent-version': '1.25.3',
+                'machine': str((index * units + unit) % machines),
+                'open-ports': ['80/tcp', '443/tcp'],
+                'public-address': '10.0.0.%d' % (unit % 256),
+            }) for unit in range(units)),
+    }
+
+
+def status_fixture(machines, units=3):
+    """Status with one service per machine, each with ``units`` units.
+    """
+    return {
+        'environment': 'bench',
+        'machines': dict(
+            (str(index), machine_fixture(index))
+            for index in range(machines)),
+        'services': dict(
+            service_fixture(index, machines, units)
+            for index in range(machines)),
+    }
+
+
+def best(function, payload, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        machines = function(payload)
+        timings.append(time.time() - start)
+    assert machines['0']['dns-name']
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--sizes", default="100,1000")
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+
+    loaders = [
+        ('yaml', 'yaml', lambda text: yaml.load(
+            text, Loader=yaml.SafeLoader)['machines'])]
+    if hasattr(yaml, 'CSafeLoader'):
+        loaders.append(('libyaml', 'yaml', lambda text: yaml.load(
+            text, Loader=yaml.CSafeLoader)['machines']))
+    loaders.extend([
+        ('json', 'json', lambda text: json.loads(text)['machines']),
+        ('json member', 'json', status_machines),
+    ])
+
+    print("{:>9} {:>10} {:>12} {:>10}".format(
+        "Machines", "KiB", "Parser", "Seconds"))
+    for size in [int(size) for size in options.sizes.split(',')]:
+        status = status_fixture(size)
+        # Same layout as juju, members in struct order.
+        payloads = {
+            'yaml': yaml.safe_dump(status, default_flow_style=False),
+            'json': json.dumps(status, sort_keys=False),
+        }
+        for name, kind, function in loaders:
+            elapsed = best(function, payloads[kind], options.repeat)
+            print("{:>9} {:>10.0f} {:>12} {:>10.4f}".format(
+                size, len(payloads[kind]) / 1024.0, name, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Local stand-in of the Scaleway compute API.
+
+Serves the subset of the API used by the plugin, with configurable request
+latency, boot delays, page size and error injection, and counts requests per
+endpoint and accepted connections. Point the plugin at it with
+``SCALEWAY_API_URL``.
+
+Usage: python benchmarks/fakeapi.py [--port PORT] [--latency SECONDS] ...
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:  # Python3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+
+SERIES_IMAGES = (
+    ('Ubuntu Trusty (14.04 LTS)', 'trusty'),
+    ('Ubuntu Utopic (14.10)', 'utopic'),
+)
+
+
+class FakeAPI(ThreadingMixIn, HTTPServer):
+    """Threaded server holding the fake organization state.
+
+    :param latency: seconds added to every request.
+    :param boot_delay: seconds from poweron to the ``running`` state.
+    :param per_page: page size used when clients do not ask for one.
+    :param error_rate: share of requests answered with a 503.
+    :param throttle_rate: share of requests answered with a 429.
+    :param public_images: number of filler images in the public catalog.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, boot_delay=1.0,
+                 per_page=50, error_rate=0.0, throttle_rate=0.0,
+                 public_images=200, address_prefix='10.2'):
+        HTTPServer.__init__(self, (host, port), FakeAPIHandler)
+        self.latency = latency
+        self.boot_delay = boot_delay
+        self.per_page = per_page
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.address_prefix = address_prefix
+        self.lock = threading.Lock()
+        self.servers = {}
+        self.snapshots = {}
+        self.images = self._build_images(public_images)
+        self.calls = {}
+        self.connections = 0
+        self._addresses = 0
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def get_request(self):
+        with self.lock:
+            self.connections += 1
+        return HTTPServer.get_request(self)
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls = {}
+            self.connections = 0
+
+    @property
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def count(self, key):
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def _build_images(self, count):
+        images = []
+        for name, _ in SERIES_IMAGES:
+            images.append({
+                'id': str(uuid.uuid4()), 'name': name, 'arch': 'arm',
+                'public': True, 'organization': str(uuid.uuid4()),
+                'creation_date': '2015-01-15T17:49:07.263171+00:00'})
+        for index in range(count):
+            images.append({
+                'id': str(uuid.uuid4()), 'name': 'Filler image %d' % index,
+                'arch': 'arm', 'public': True,
+                'organization': str(uuid.uuid4()),
+                'creation_date': '2015-01-15T17:49:07.263171+00:00'})
+        return images
+
+    def create_server(self, data):
+        with self.lock:
+            self._addresses += 1
+            index = self._addresses
+        server = {
+            'id': str(uuid.uuid4()),
+            'name': data.get('name'),
+            'organization': data.get('organization'),
+            'image': {'id': data.get('image')},
+            'tags': data.get('tags', []),
+            'arch': 'arm',
+            'state': 'stopped',
+            'state_detail': '',
+            'public_ip': None,
+            'volumes': {'0': {'id': str(uuid.uuid4()), 'size': 20 * 10 ** 9}},
+            'creation_date': time.strftime(
+                '%Y-%m-%dT%H:%M:%S.000000+00:00', time.gmtime()),
+            '_address': '%s.%d.%d' % (
+                self.address_prefix, index // 256 % 256, index % 256),
+            '_booted_at': None,
+        }
+        with self.lock:
+            self.servers[server['id']] = server
+        return server
+
+    def refresh(self, server):
+        """Apply pending state transitions of a server.
+        """
+        booted_at = server['_booted_at']
+        if server['state'] == 'starting' and booted_at <= time.time():
+            server['state'] = 'running'
+            server['public_ip'] = {
+                'id': str(uuid.uuid4()), 'address': server['_address']}
+        return server
+
+    def create_snapshot(self, data):
+        snapshot = {
+            'id': str(uuid.uuid4()),
+            'name': data.get('name'),
+            'organization': data.get('organization'),
+            'base_volume': {'id': data.get('volume_id')},
+            'state': 'snapshotting',
+            '_available_at': time.time() + self.boot_delay,
+        }
+        with self.lock:
+            self.snapshots[snapshot['id']] = snapshot
+        return snapshot
+
+    def create_image(self, data):
+        image = {
+            'id': str(uuid.uuid4()), 'name': data.get('name'),
+            'arch': data.get('arch'), 'public': False,
+            'organization': data.get('organization'),
+            'root_volume': {'id': data.get('root_volume')},
+            'creation_date': time.strftime(
+                '%Y-%m-%dT%H:%M:%S.000000+00:00', time.gmtime())}
+        with self.lock:
+            self.images.append(image)
+        return image
+
+    def public(self, server):
+        return dict(
+            (key, value) for key, value in self.refresh(server).items()
+            if not key.startswith('_'))
+
+
+class FakeSSH(object):
+    """Ssh port of the fake servers: sends a banner on connections to the
+    address of a running server, and closes the others.
+
+    Listens on all addresses, fake servers get loopback addresses with an
+    ``address_prefix`` of ``127.0``.
+    """
+
+    BANNER = b'SSH-2.0-OpenSSH_6.6.1p1 Ubuntu-2ubuntu2\r\n'
+
+    def __init__(self, api, port=0):
+        self.api = api
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            address = conn.getsockname()[0]
+            with self.api.lock:
+                running = any(
+                    self.api.refresh(server)['state'] == 'running'
+                    for server in self.api.servers.values()
+                    if server['_address'] == address)
+            if running:
+                conn.sendall(self.BANNER)
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, avoid delayed-ack stalls.
+    disable_nagle_algorithm = True
+
+    routes = (
+        ('GET', re.compile(r'^/servers$'), 'list_servers'),
+        ('GET', re.compile(r'^/servers/([^/]+)$'), 'get_server'),
+        ('POST', re.compile(r'^/servers$'), 'create_server'),
+        ('PATCH', re.compile(r'^/servers/([^/]+)$'), 'update_server'),
+        ('POST', re.compile(r'^/servers/([^/]+)/action$'), 'server_action'),
+        ('DELETE', re.compile(r'^/servers/([^/]+)$'), 'delete_server'),
+        ('DELETE', re.compile(r'^/volumes/([^/]+)$'), 'delete_volume'),
+        ('GET', re.compile(r'^/images$'), 'list_images'),
+        ('POST', re.compile(r'^/images$'), 'create_image'),
+        ('POST', re.compile(r'^/snapshots$'), 'create_snapshot'),
+        ('GET', re.compile(r'^/snapshots/([^/]+)$'), 'get_snapshot'),
+    )
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def log_message(self, *args):
+        pass
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        self.query = dict(
+            (key, values[-1]) for key, values in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.body = json.loads(body.decode('utf-8')) if body else {}
+
+        api = self.server
+        if api.latency:
+            time.sleep(api.latency)
+
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                break
+        else:
+            api.count('%s %s' % (method, url.path))
+            return self.reply(404, {'message': 'Not found'})
+
+        key = '%s %s' % (method, pattern.pattern.strip('^$').replace(
+            '([^/]+)', '{id}'))
+        if method == 'POST' and name == 'server_action':
+            key = '%s:%s' % (key, self.body.get('action'))
+        api.count(key)
+
+        roll = random.random()
+        if roll < api.throttle_rate:
+            return self.reply(
+                429, {'message': 'Too many requests'},
+                headers={'Retry-After': '1'})
+        if roll < api.throttle_rate + api.error_rate:
+            return self.reply(503, {'message': 'Injected error'})
+
+        getattr(self, name)(*match.groups())
+
+    def reply(self, status, data=None, headers=None):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def paginate(self, target, key, items, etag=False):
+        """Reply a page of ``items``, with an ETag of the page when ``etag``
+        is set, honoring If-None-Match.
+        """
+        page = int(self.query.get('page', 1))
+        per_page = int(self.query.get('per_page', self.server.per_page))
+        start = (page - 1) * per_page
+        data = {key: items[start:start + per_page]}
+        headers = {'X-Total-Count': str(len(items))}
+        if start + per_page < len(items):
+            headers['Link'] = '<%s?page=%d&per_page=%d>; rel="next"' % (
+                target, page + 1, per_page)
+        if etag:
+            headers['ETag'] = '"%s"' % hashlib.md5(
+                json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                return self.reply(304, headers={'ETag': headers['ETag']})
+        self.reply(200, data, headers=headers)
+
+    def find_server(self, server_id):
+        server = self.server.servers.get(server_id)
+        if server is None:
+            self.reply(404, {'message': 'Unknown server %s' % server_id})
+        return server
+
+    def list_servers(self):
+        api = self.server
+        name = self.query.get('name')
+        state = self.query.get('state')
+        with api.lock:
+            servers = [api.public(server) for server in api.servers.values()]
+        servers = [
+            server for server in servers
+            if (not name or name in server['name']) and
+            (not state or server['state'] == state)]
+        servers.sort(key=lambda server: server['creation_date'])
+        self.paginate('/servers', 'servers', servers)
+
+    def get_server(self, server_id):
+        server = self.find_server(server_id)
+        if server is not None:
+            with self.server.lock:
+                self.reply(200, {'server': self.server.public(server)})
+
+    def create_server(self):
+        server = self.server.create_server(self.body)
+        with self.server.lock:
+            self.reply(201, {'server': self.server.public(server)})
+
+    def update_server(self, server_id):
+        server = self.find_server(server_id)
+        if server is not None:
+            with self.server.lock:
+                for key in ('name', 'tags'):
+                    if key in self.body:
+                        server[key] = self.body[key]
+                self.reply(200, {'server': self.server.public(server)})
+
+    def server_action(self, server_id):
+        server = self.find_server(server_id)
+        if server is None:
+            return
+        action = self.body.get('action')
+        with self.server.lock:
+            if action == 'poweron':
+                server['state'] = 'starting'
+                server['_booted_at'] = time.time() + self.server.boot_delay
+            elif action == 'poweroff':
+                server['state'] = 'stopped'
+            elif action == 'terminate':
+                self.server.servers.pop(server_id, None)
+            else:
+                return self.reply(
+                    400, {'message': 'Unknown action %s' % action})
+        self.reply(202, {'task': {
+            'id': str(uuid.uuid4()), 'description': action,
+            'status': 'pending'}})
+
+    def delete_server(self, server_id):
+        server = self.find_server(server_id)
+        if server is None:
+            return
+        if server['state'] != 'stopped':
+            return self.reply(400, {'message': 'Server must be stopped'})
+        with self.server.lock:
+            self.server.servers.pop(server_id, None)
+        self.reply(204)
+
+    def delete_volume(self, volume_id):
+        self.reply(204)
+
+    def create_snapshot(self):
+        snapshot = self.server.create_snapshot(self.body)
+        self.reply(201, {'snapshot': self.public_snapshot(snapshot)})
+
+    def get_snapshot(self, snapshot_id):
+        snapshot = self.server.snapshots.get(snapshot_id)
+        if snapshot is None:
+            return self.reply(
+                404, {'message': 'Unknown snapshot %s' % snapshot_id})
+        self.reply(200, {'snapshot': self.public_snapshot(snapshot)})
+
+    def public_snapshot(self, snapshot):
+        if snapshot['_available_at'] <= time.time():
+            snapshot['state'] = 'available'
+        return dict(
+            (key, value) for key, value in snapshot.items()
+            if not key.startswith('_'))
+
+    def create_image(self):
+        self.reply(201, {'image': self.server.create_image(self.body)})
+
+    def list_images(self):
+        self.paginate('/images', 'images', self.server.images, etag=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--boot-delay", type=float, default=1.0)
+    parser.add_argument("--per-page", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    options = parser.parse_args()
+
+    api = FakeAPI(
+        options.host, options.port, latency=options.latency,
+        boot_delay=options.boot_delay, per_page=options.per_page,
+        error_rate=options.error_rate, throttle_rate=options.throttle_rate)
+    print("Serving fake Scaleway API on %s" % api.url)
+    try:
+        api.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
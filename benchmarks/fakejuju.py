@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Local stand-in of the juju API server, and the environment state it shares
+with the fake juju client of benchmarks/bin.
+
+Serves the juju RPC calls made by the plugin over a TLS websocket, like
+the state server on port 17070: Admin.Login, then Client.AddMachines,
+ProvisioningScript, FullStatus, DestroyMachines and DestroyEnvironment.
+Machines live in the FAKE_JUJU_STATE file, so the juju CLI and the API
+see the same environment. Requires the ``openssl`` command to issue its
+certificate.
+
+Usage: python benchmarks/fakejuju.py [--port PORT] [--latency SECONDS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import collections
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import random
+import shutil
+import ssl
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    from SocketServer import StreamRequestHandler, TCPServer, ThreadingMixIn
+except ImportError:  # Python3
+    from socketserver import StreamRequestHandler, TCPServer, ThreadingMixIn
+
+
+# Appended to the client key, as of RFC 6455.
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xa
+
+
+@contextlib.contextmanager
+def state(path=None):
+    """Environment machines, locked against the other fakes meanwhile.
+    """
+    path = path or os.environ['FAKE_JUJU_STATE']
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        data = {'machines': {}, 'next': 0}
+        if os.path.exists(path):
+            with open(path) as handle:
+                data = json.load(handle)
+        yield data
+        with open(path, 'w') as handle:
+            json.dump(data, handle)
+
+
+def add(data, host, series='trusty'):
+    machine_id = str(data['next'])
+    data['next'] += 1
+    data['machines'][machine_id] = {
+        'agent-state': 'started',
+        'dns-name': host,
+        'instance-id': 'manual:%s' % host,
+        'series': series,
+        'hardware': 'arch=armhf cpu-cores=4 mem=2048M',
+    }
+    return machine_id
+
+
+class FakeJujuAPI(ThreadingMixIn, TCPServer):
+    """Threaded TLS websocket server answering juju RPC calls.
+
+    :param state_path: JSON file of the environment machines.
+    :param password: expected by Admin.Login.
+    :param latency: seconds added to every call.
+    :param fail_rate: share of machines AddMachines returns an error for.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, state_path, password='fake', latency=0.0,
+                 fail_rate=0.0, port=0):
+        TCPServer.__init__(self, ('127.0.0.1', port), FakeJujuHandler)
+        self.state_path = state_path
+        self.password = password
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.connections = 0
+        self.cert_dir = tempfile.mkdtemp(prefix='fake-juju-')
+        self.ca_cert = self._issue_cert()
+
+    @property
+    def address(self):
+        return '%s:%d' % self.server_address
+
+    def _issue_cert(self):
+        cert = os.path.join(self.cert_dir, 'cert.pem')
+        key = os.path.join(self.cert_dir, 'key.pem')
+        with open(os.devnull, 'wb') as devnull:
+            subprocess.check_call([
+                'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                '-days', '1', '-subj', '/CN=juju-apiserver',
+                '-keyout', key, '-out', cert], stdout=devnull, stderr=devnull)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        self.context.load_cert_chain(cert, key)
+        self.ca_path = cert
+        with open(cert) as handle:
+            return handle.read()
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        # Handshake on the handler thread, not the accepting one.
+        return self.context.wrap_socket(
+            sock, server_side=True, do_handshake_on_connect=False), address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.connections = 0
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.cert_dir, ignore_errors=True)
+
+    def dispatch(self, message, session):
+        """Response or error of one RPC message.
+        """
+        request = '%s.%s' % (message.get('Type'), message.get('Request'))
+        params = message.get('Params') or {}
+        with self.lock:
+            self.calls[request] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if request == 'Admin.Login':
+            if params.get('Password') != self.password:
+                return None, "invalid entity name or password"
+            session['user'] = params.get('AuthTag')
+            return {}, None
+        if 'user' not in session:
+            return None, "not logged in"
+        handler = getattr(self, 'call_%s' % message.get('Request'), None)
+        if message.get('Type') != 'Client' or handler is None:
+            return None, "unknown object type %r" % request
+        return handler(params)
+
+    def call_AddMachines(self, params):
+        results = []
+        with state(self.state_path) as data:
+            for machine in params.get('MachineParams') or []:
+                if random.random() < self.fail_rate:
+                    results.append({'Machine': '', 'Error': {
+                        'Message': "cannot add a new machine",
+                        'Code': ''}})
+                    continue
+                host = machine['Addrs'][0]['Value']
+                machine_id = add(data, host, machine.get('Series'))
+                data['machines'][machine_id]['instance-id'] = (
+                    machine.get('InstanceId'))
+                results.append({'Machine': machine_id, 'Error': None})
+        return {'Machines': results}, None
+
+    def call_ProvisioningScript(self, params):
+        return {'Script': "echo 'provisioning machine %s'\n" % (
+            params['MachineId'])}, None
+
+    def call_FullStatus(self, params):
+        with state(self.state_path) as data:
+            machines = dict(
+                (machine_id, {
+                    'Id': machine_id,
+                    'AgentState': machine.get('agent-state'),
+                    'DNSName': machine.get('dns-name'),
+                    'InstanceId': machine.get('instance-id'),
+                    'Series': machine.get('series'),
+                    'Hardware': machine.get('hardware'),
+                }) for machine_id, machine in data['machines'].items())
+        return {
+            'EnvironmentName': os.environ.get('JUJU_ENV', 'bench'),
+            'Machines': machines, 'Services': {}}, None
+
+    def call_DestroyMachines(self, params):
+        with state(self.state_path) as data:
+            missing = [
+                machine_id for machine_id in params.get('MachineNames', [])
+                if data['machines'].pop(machine_id, None) is None]
+        if missing:
+            return None, "no machines were destroyed: machine %s not found" % (
+                ", ".join(missing))
+        return {}, None
+
+    def call_DestroyEnvironment(self, params):
+        with state(self.state_path) as data:
+            data['machines'] = {}
+        return {}, None
+
+
+class FakeJujuHandler(StreamRequestHandler):
+    """Websocket upgrade, then one RPC reply per text frame.
+    """
+
+    def handle(self):
+        try:
+            self.connection.do_handshake()
+        except (ssl.SSLError, OSError):
+            return
+        if not self.upgrade():
+            return
+        with self.server.lock:
+            self.server.connections += 1
+        session = {}
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return
+            opcode, payload = frame
+            if opcode == OP_CLOSE:
+                self.write_frame(OP_CLOSE, payload[:2])
+                return
+            if opcode == OP_PING:
+                self.write_frame(OP_PONG, payload)
+                continue
+            if opcode != OP_TEXT:
+                continue
+            message = json.loads(payload.decode('utf-8'))
+            response, error = self.server.dispatch(message, session)
+            reply = {'RequestId': message.get('RequestId')}
+            if error is not None:
+                reply.update({'Error': error, 'ErrorCode': ''})
+            else:
+                reply['Response'] = response
+            self.write_frame(OP_TEXT, json.dumps(reply).encode('utf-8'))
+
+    def upgrade(self):
+        headers = {}
+        request_line = self.rfile.readline()
+        if not request_line.startswith(b'GET '):
+            return False
+        while True:
+            line = self.rfile.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if not key:
+            self.wfile.write(b'HTTP/1.1 400 Bad Request\r\n\r\n')
+            return False
+        accept = base64.b64encode(hashlib.sha1(
+            (key + WEBSOCKET_GUID).encode('ascii')).digest())
+        self.wfile.write(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        self.wfile.flush()
+        return True
+
+    def read_exactly(self, size):
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise EOFError()
+        return bytearray(data)
+
+    def read_frame(self):
+        """Opcode and payload of the next message, None once closed.
+        """
+        opcode = None
+        payload = bytearray()
+        try:
+            while True:
+                first, second = self.read_exactly(2)
+                if opcode is None or first & 0x0f != OP_CONTINUATION:
+                    opcode = first & 0x0f
+                length = second & 0x7f
+                if length == 126:
+                    length = struct.unpack('!H', self.read_exactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack('!Q', self.read_exactly(8))[0]
+                mask = self.read_exactly(4) if second & 0x80 else None
+                data = self.read_exactly(length)
+                if mask is not None:
+                    data = bytearray(
+                        byte ^ mask[index % 4]
+                        for index, byte in enumerate(data))
+                payload.extend(data)
+                if first & 0x80:
+                    return opcode, bytes(payload)
+        except (EOFError, ssl.SSLError, OSError):
+            return None
+
+    def write_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        try:
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+        except (ssl.SSLError, OSError):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--port", type=int, default=17070)
+    parser.add_argument("--state", default="fake-juju-state.json",
+                        help="JSON file of the environment machines")
+    parser.add_argument("--password", default="fake")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    options = parser.parse_args()
+
+    server = FakeJujuAPI(
+        os.path.abspath(options.state), password=options.password,
+        latency=options.latency, fail_rate=options.fail_rate,
+        port=options.port)
+    print("Fake juju API on wss://%s" % server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Asyncio based client and provider, for bulk ops driven from one event loop.
+
+Python 3.6+ only, requires the optional aiohttp dependency.
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+
+try:
+    import aiohttp
+except ImportError:  # Optional dependency
+    aiohttp = None
+
+from urllib.parse import urljoin, urlparse
+
+from juju_scaleway.client import Client, CreateResult, Server, Image
+from juju_scaleway.exceptions import (
+    ConfigError, ProviderAPIError, ProviderError)
+from juju_scaleway.polling import NullHistory, PollPolicy
+from juju_scaleway.ratelimit import HIGH, LOW, RateLimiter, parse_retry_after
+from juju_scaleway.stats import endpoint, stats
+
+
+logger = logging.getLogger("juju.scaleway")
+
+
+def validate():
+    if aiohttp is None:
+        raise ConfigError("The async engine requires aiohttp")
+
+
+def factory(provider):
+    """Async counterpart of a configured sync provider, sharing its rate
+    limiter and wait history.
+    """
+    return AsyncScaleway(
+        provider.config, history=provider.history,
+        rate_limiter=provider.client.rate_limiter)
+
+
+def run(coroutine):
+    """Run a coroutine to completion on a fresh event loop.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AsyncClient(object):
+
+    DEFAULT_POOL_SIZE = 32
+    MAX_RETRIES = Client.MAX_RETRIES
+    BACKOFF_FACTOR = Client.BACKOFF_FACTOR
+    RETRY_STATUSES = Client.RETRY_STATUSES
+    DEFAULT_PER_PAGE = Client.DEFAULT_PER_PAGE
+
+    def __init__(self, access_key, secret_key, pool_size=None, api_url=None,
+                 rate_limiter=None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.api_url_base = api_url or 'https://api.scaleway.com'
+        self.pool_size = pool_size or self.DEFAULT_POOL_SIZE
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self._session = None
+
+    @property
+    def session(self):
+        """Keep-alive session, bound to the running event loop.
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                headers={
+                    'User-Agent': 'juju/client',
+                    'X-Auth-Token': self.secret_key})
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def get_url(self, target):
+        if target.startswith(('http://', 'https://')):
+            return target
+        return "%s%s" % (self.api_url_base, target)
+
+    async def get_images(self):
+        return [image async for image in self.iter_images()]
+
+    def iter_images(self):
+        return self.iter_collection('/images', 'images', Image)
+
+    async def get_servers(self, **filters):
+        return [server async for server in self.iter_servers(**filters)]
+
+    def iter_servers(self, name=None, state=None):
+        params = {}
+        if name:
+            params['name'] = name
+        if state:
+            params['state'] = state
+        return self.iter_collection(
+            '/servers', 'servers', Server, params=params)
+
+    async def get_server(self, server_id):
+        data = await self.request("/servers/%s" % (server_id))
+        return Server.from_dict(data.get('server', {}))
+
+    async def create_server(self, name, image, tags=None):
+        server = await self._create_server(name, image, tags)
+        await self.poweron_server(server.id)
+        return server
+
+    async def _create_server(self, name, image, tags=None):
+        params = dict(
+            name=name,
+            image=image,
+            organization=self.access_key)
+        if tags:
+            params['tags'] = list(tags)
+
+        data = await self.request('/servers', method='POST', params=params)
+        return Server.from_dict(data.get('server', {}))
+
+    async def poweron_server(self, server_id):
+        data = await self.request(
+            '/servers/%s/action' % (server_id),
+            method='POST', params={'action': 'poweron'})
+        return data.get('task')
+
+    async def destroy_server(self, server_id):
+        data = await self.request(
+            '/servers/%s/action' % (server_id),
+            method='POST', params={'action': 'terminate'})
+        return data.get('task')
+
+    async def iter_collection(self, target, key, entity, params=None):
+        """Yield entities of a collection as its pages arrive.
+
+        Same pagination rules as :meth:`Client.iter_pages`.
+        """
+        base_params = dict(params or {})
+        base_params.setdefault('per_page', self.DEFAULT_PER_PAGE)
+        page = base_params.setdefault('page', 1)
+        base_url = url = self.get_url(target)
+        params = base_params
+
+        while url:
+            data, response = await self._request(url, params=params)
+            for item in data.get(key, []):
+                yield entity.from_dict(item)
+
+            next_link = response.links.get('next', {}).get('url')
+            total = int(response.headers.get('X-Total-Count') or 0)
+            if next_link:
+                url, params = urljoin(base_url, str(next_link)), None
+            elif page * base_params['per_page'] < total:
+                url, params = base_url, dict(base_params, page=page + 1)
+            else:
+                url = None
+            page += 1
+
+    async def request(self, target, method='GET', params=None):
+        data, response = await self._request(
+            self.get_url(target), method=method, params=params)
+        if not data:
+            raise ProviderAPIError(response, 'No json result found')
+        return data
+
+    async def _request(self, url, method='GET', params=None):
+        params = dict(params or {})
+        if method == 'POST':
+            kwargs = {
+                'data': json.dumps(params),
+                'headers': {'Content-Type': "application/json"}}
+        else:
+            kwargs = {'params': params}
+
+        # Mirrors the retry policy of the sync client session.
+        start_time, status, size, delay = time.time(), None, 0, 0
+        priority = LOW if method == 'GET' else HIGH
+        try:
+            for attempt in range(self.MAX_RETRIES + 1):
+                if attempt:
+                    await asyncio.sleep(
+                        delay or self.BACKOFF_FACTOR * (2 ** (attempt - 1)))
+                    delay = 0
+                await self._acquire(priority)
+                try:
+                    async with self.session.request(
+                            method, url, **kwargs) as response:
+                        status = response.status
+                        self.rate_limiter.update(response.headers)
+                        if status == 429:
+                            stats.record_throttle()
+                        if attempt < self.MAX_RETRIES and (
+                                status == 429 or (
+                                    status in self.RETRY_STATUSES and
+                                    method != 'POST')):
+                            delay = parse_retry_after(
+                                response.headers.get('Retry-After'))
+                            if status == 429:
+                                # Threads of the sync client hold off too.
+                                self.rate_limiter.backoff(
+                                    delay or self.BACKOFF_FACTOR *
+                                    (2 ** attempt))
+                            continue
+                        body = await response.read()
+                        size = len(body)
+                        try:
+                            data = json.loads(body.decode('utf-8'))
+                        except ValueError:
+                            data = None
+                        result = _Response(
+                            status, response.headers, response.links)
+                        if status >= 400:
+                            raise ProviderAPIError(
+                                result, (data or {}).get('message'))
+                        return data or {}, result
+                except aiohttp.ClientConnectionError as exc:
+                    # A POST may have been processed unless we never
+                    # connected.
+                    if (attempt == self.MAX_RETRIES or (
+                            method == 'POST' and not isinstance(
+                                exc, aiohttp.ClientConnectorError))):
+                        raise
+        finally:
+            stats.record_request(
+                method,
+                endpoint(urlparse(url).path, params.get('action')),
+                time.time() - start_time,
+                status=status, retries=attempt, size=size)
+
+    async def _acquire(self, priority):
+        """Wait for a token of the rate limiter, without blocking the loop.
+        """
+        while True:
+            delay = self.rate_limiter.reserve(priority)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+
+class _Response(object):
+    """What is kept of a response once its body has been read.
+    """
+
+    def __init__(self, status_code, headers, links):
+        self.status_code = status_code
+        self.headers = headers
+        self.links = links
+
+
+class AsyncScaleway(object):
+    """Provider counterpart running every API call on one event loop.
+
+    Calls in flight are bounded by a semaphore rather than by a number of
+    threads, so hundreds of servers can be created and polled at once.
+    """
+
+    DEFAULT_CONCURRENCY = 32
+    DEFAULT_TIMEOUT = 300
+
+    def __init__(self, config, client=None, concurrency=None, history=None,
+                 rate_limiter=None, policy=None):
+        self.config = config
+        self.concurrency = concurrency or self.DEFAULT_CONCURRENCY
+        if client is None:
+            client = AsyncClient(
+                config['access_key'],
+                config['secret_key'],
+                pool_size=self.concurrency,
+                api_url=config.get('api_url'),
+                rate_limiter=rate_limiter)
+        self.client = client
+        self.history = history or NullHistory()
+        # Same schedule as the ServerWatcher of the sync provider.
+        self.policy = policy or PollPolicy(
+            initial=2.0, factor=1.5, max_delay=15.0)
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Created lazily so it belongs to the loop running the ops.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def close(self):
+        await self.client.close()
+
+    async def get_servers(self, **filters):
+        async with self.semaphore:
+            return await self.client.get_servers(**filters)
+
+    async def get_server(self, server_id):
+        async with self.semaphore:
+            return await self.client.get_server(server_id)
+
+    async def launch_server(self, params):
+        """Create and power on a server, returns a :class:`CreateResult`.
+
+        A server whose poweron failed is returned along with the error, for
+        the caller to terminate it.
+        """
+        server = None
+        try:
+            async with self.semaphore:
+                server = await self.client._create_server(**params)
+            async with self.semaphore:
+                await self.client.poweron_server(server.id)
+        except Exception as exc:
+            return CreateResult(params, server, exc)
+        return CreateResult(params, server, None)
+
+    async def terminate_server(self, server_id):
+        async with self.semaphore:
+            await self.client.destroy_server(server_id)
+
+    async def wait_many(self, servers, timeout=None, state='running'):
+        """Poll until the servers reach ``state``, with one listing per tick.
+
+        Returns the ready servers, with their fresh state, and the stuck ones.
+        """
+        timeout = timeout or self.DEFAULT_TIMEOUT
+        started = time.time()
+        pending = dict((server.id, server) for server in servers)
+        ready = {}
+        policy = copy.copy(self.policy)
+        policy.timeout = timeout
+        policy.expected = self.history.expected('boot')
+        poller = policy.start()
+        while True:
+            delay = poller.next_delay()
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+            try:
+                fresh = await self._refresh(pending)
+            except Exception:
+                logger.warning("Could not refresh servers", exc_info=True)
+                fresh = {}
+            for server_id, server in fresh.items():
+                pending[server_id] = server
+                if server.state == state:
+                    ready[server_id] = pending.pop(server_id)
+                    if state == 'running':
+                        self.history.record('boot', time.time() - started)
+            if not pending:
+                break
+            logger.debug(
+                "Waiting for %d servers, waited:%ds",
+                len(pending), poller.elapsed)
+
+        stuck = list(pending.values())
+        if stuck:
+            logger.warning(
+                "Servers not %s after %ds: %s", state, timeout,
+                " ".join("%s(%s)" % (server.id, server.state)
+                         for server in stuck))
+        return [ready[server.id] for server in servers
+                if server.id in ready], stuck
+
+    async def _refresh(self, pending):
+        if len(pending) == 1:
+            server = await self.get_server(list(pending)[0])
+            return {server.id: server}
+        # Narrow the listing down to the servers being waited on.
+        prefix = os.path.commonprefix(
+            [server.name or '' for server in pending.values()])
+        return dict(
+            (server.id, server)
+            for server in await self.get_servers(name=prefix)
+            if server.id in pending)
+
+    async def launch_servers(self, params_list):
+        """Launch servers and wait for them to run.
+
+        Returns a :class:`CreateResult` for each of them, in order. Servers
+        created but failed are terminated, and only returned along with
+        their error when that termination failed too.
+        """
+        try:
+            results = await asyncio.gather(
+                *[self.launch_server(params) for params in params_list])
+            launched = [
+                result.server for result in results if result.error is None]
+            ready, _ = await self.wait_many(launched)
+            ready = dict((server.id, server) for server in ready)
+            return await asyncio.gather(
+                *[self._settle(result, ready) for result in results])
+        finally:
+            await self.close()
+
+    async def _settle(self, result, ready):
+        """Result with the running server, or terminates the failed one.
+        """
+        if result.error is None:
+            server = ready.get(result.server.id)
+            if server is not None:
+                return result._replace(server=server)
+            result = result._replace(error=ProviderError(
+                "Could not provision server before timeout"))
+        if result.server is None:
+            return result
+        try:
+            await self.terminate_server(result.server.id)
+        except Exception:
+            logger.warning(
+                "Could not terminate failed server %s", result.server.id,
+                exc_info=True)
+            return result
+        return result._replace(server=None)
+
+    async def terminate_servers(self, server_ids):
+        """Returns, in order, None or the exception of each termination.
+        """
+        try:
+            return await asyncio.gather(
+                *[self.terminate_server(server_id)
+                  for server_id in server_ids],
+                return_exceptions=True)
+        finally:
+            await self.close()
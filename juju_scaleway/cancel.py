@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Time limits and cancellation of runner ops.
+
+Each op runs within a :class:`Scope`, current for the thread running it.
+Cancelling a scope, on Ctrl-C or once its time limit is spent, kills the
+subprocesses started through :func:`call`, :func:`check_call` and
+:func:`check_output`, and makes :func:`check`, called by waiting loops,
+raise, as do :func:`wait` and :func:`sleep` as soon as it happens. The
+op then fails like on any other error and cleans up after itself.
+"""
+
+from contextlib import contextmanager
+import subprocess
+import threading
+import time
+
+from juju_scaleway.exceptions import OpCancelled, TimeoutError
+
+
+_local = threading.local()
+
+
+class Scope(object):
+    """Cancellation state of one op.
+
+    ``limit`` bounds the seconds the op may spend running, time spent
+    queued between two pipeline stages does not count.
+    """
+
+    TIMEOUT = 'timeout'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, name, limit=None):
+        self.name = name
+        self.limit = limit
+        self.spent = 0.0
+        self.started = None
+        self.deadline = None
+        self.reason = None
+        self.cancelled = threading.Event()
+        self.processes = set()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def active(self):
+        """Make the scope current for the running thread, counting the
+        time spent against its limit.
+        """
+        self.check()
+        start = time.time()
+        if self.started is None:
+            self.started = start
+        if self.limit is not None:
+            self.deadline = start + self.limit - self.spent
+        previous = getattr(_local, 'scope', None)
+        _local.scope = self
+        try:
+            yield self
+        finally:
+            _local.scope = previous
+            self.deadline = None
+            self.spent += time.time() - start
+
+    def expired(self, now=None):
+        return (self.deadline is not None and
+                (now or time.time()) >= self.deadline)
+
+    def cancel(self, reason=CANCELLED):
+        with self.lock:
+            if self.reason is None:
+                self.reason = reason
+            processes = list(self.processes)
+        self.cancelled.set()
+        for process in processes:
+            _kill(process)
+
+    def check(self):
+        if self.reason == self.TIMEOUT:
+            raise TimeoutError("time limit of %ds exceeded" % self.limit)
+        if self.reason is not None:
+            raise OpCancelled("interrupted")
+
+    def track(self, process):
+        with self.lock:
+            self.processes.add(process)
+            cancelled = self.reason is not None
+        if cancelled:
+            _kill(process)
+
+    def untrack(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+
+def current():
+    return getattr(_local, 'scope', None)
+
+
+@contextmanager
+def within(scope):
+    """Make the scope of an op current for the running thread, which works
+    on its behalf, without counting that time against its limit.
+    """
+    previous = current()
+    _local.scope = scope
+    try:
+        yield scope
+    finally:
+        _local.scope = previous
+
+
+def check():
+    """Raise if the op of the running thread was cancelled.
+    """
+    scope = current()
+    if scope is not None:
+        scope.check()
+
+
+def wait(event, timeout=None, step=1):
+    """Like ``event.wait``, raising once the op of the running thread is
+    cancelled. Waits in slices of ``step`` seconds, as a bare wait can not
+    be interrupted by Ctrl-C.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        remaining = step
+        if deadline is not None:
+            remaining = min(step, deadline - time.time())
+        if remaining <= 0 or event.wait(remaining):
+            check()
+            return event.is_set()
+        check()
+
+
+def sleep(seconds):
+    """Like ``time.sleep``, raising as soon as the op of the running thread
+    is cancelled.
+    """
+    scope = current()
+    if scope is None:
+        time.sleep(seconds)
+        return
+    wait(scope.cancelled, seconds)
+
+
+def run(args, input=None, **kwargs):
+    """Run a command to completion, returns its exit code and output.
+
+    The process is killed if the current scope gets cancelled meanwhile,
+    which then raises.
+    """
+    scope = current()
+    if scope is not None:
+        scope.check()
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+    process = subprocess.Popen(args, **kwargs)
+    if scope is None:
+        output = process.communicate(input)[0]
+        return process.returncode, output
+
+    scope.track(process)
+    try:
+        output = process.communicate(input)[0]
+    finally:
+        scope.untrack(process)
+    scope.check()
+    return process.returncode, output
+
+
+def call(args, **kwargs):
+    return run(args, **kwargs)[0]
+
+
+def check_call(args, **kwargs):
+    returncode = call(args, **kwargs)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args)
+    return 0
+
+
+def check_output(args, **kwargs):
+    returncode, output = run(args, stdout=subprocess.PIPE, **kwargs)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args, output)
+    return output
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except OSError:
+        # Already gone.
+        pass
@@ -17,8 +17,9 @@ import sys
 from juju_scaleway.config import Config
 from juju_scaleway.constraints import SERIES_MAP
 from juju_scaleway.exceptions import (
-    ConfigError, PrecheckError, ProviderAPIError)
+    ConfigError, DeliveryError, PrecheckError, ProviderAPIError)
 from juju_scaleway import commands
+from juju_scaleway.stats import stats
 
 
 def _default_opts(parser):
@@ -38,6 +39,50 @@ def _machine_opts(parser):
         "--series", default="trusty", choices=SERIES_MAP.values(),
         help="OS Release for machine."
     )
+    parser.add_argument(
+        "--refresh-images", action="store_true", default=False,
+        help="Ignore the cached Scaleway image lookup"
+    )
+    parser.add_argument(
+        "--stock-image", action="store_true", default=False,
+        help="Boot the stock series image, even if build-image made one"
+    )
+    parser.add_argument(
+        "--retries", type=int, default=None, metavar="N",
+        help="Retries of a machine on API, ssh or juju errors, each"
+    )
+
+
+def _engine_opts(parser):
+    parser.add_argument(
+        "--async", dest="async_engine", action="store_true", default=False,
+        help="Drive Scaleway API calls from one event loop (needs aiohttp)"
+    )
+
+
+def parallel_type(value):
+    if value == 'auto':
+        return value
+    try:
+        count = int(value)
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise argparse.ArgumentTypeError(
+            "expected 'auto' or a positive number, got %r" % value)
+    return count
+
+
+def _parallel_opts(parser):
+    parser.add_argument(
+        "--parallel", type=parallel_type, default=None, metavar="N|auto",
+        help="Machines handled at once, per add-machine stage, auto adapts "
+             "to API and local load"
+    )
+    parser.add_argument(
+        "--op-timeout", type=float, default=None, metavar="SECONDS",
+        help="Cancel the work on a machine taking longer than this"
+    )
 
 
 PLUGIN_DESCRIPTION = "Juju Scaleway client-side provider"
@@ -49,6 +94,9 @@ def setup_parser():
         sys.exit(0)
 
     parser = argparse.ArgumentParser(description=PLUGIN_DESCRIPTION)
+    parser.add_argument(
+        "--stats", nargs="?", const="table", choices=("table", "json"),
+        help="Print API call and subprocess statistics on exit")
     subparsers = parser.add_subparsers()
     bootstrap = subparsers.add_parser(
         'bootstrap',
@@ -72,6 +120,8 @@ def setup_parser():
     add_machine.add_argument(
         "-k", "--ssh-key", default="",
         help="Use specified key when adding machines")
+    _engine_opts(add_machine)
+    _parallel_opts(add_machine)
     add_machine.set_defaults(command=commands.AddMachine)
 
     list_machines = subparsers.add_parser(
@@ -83,11 +133,36 @@ def setup_parser():
         help="Display all servers in Scaleway.")
     list_machines.set_defaults(command=commands.ListMachines)
 
+    pool = subparsers.add_parser(
+        'pool',
+        help="Keep booted servers ready for add-machine")
+    _default_opts(pool)
+    _machine_opts(pool)
+    pool.add_argument(
+        "--size", type=int, default=None,
+        help="Number of ready servers to keep for the series")
+    pool.add_argument(
+        "--status", action="store_true", default=False,
+        help="Show pool members instead of filling the pool")
+    pool.add_argument(
+        "--drain", action="store_true", default=False,
+        help="Terminate all pool servers of the environment")
+    _parallel_opts(pool)
+    pool.set_defaults(command=commands.ManagePool)
+
+    build_image = subparsers.add_parser(
+        'build-image',
+        help="Build a private image with juju dependencies preinstalled")
+    _default_opts(build_image)
+    _machine_opts(build_image)
+    build_image.set_defaults(command=commands.BuildImage)
+
     terminate_machine = subparsers.add_parser(
         "terminate-machine",
         help="Terminate machine")
     terminate_machine.add_argument("machines", nargs="+")
     _default_opts(terminate_machine)
+    _parallel_opts(terminate_machine)
     terminate_machine.set_defaults(command=commands.TerminateMachine)
 
     destroy_environment = subparsers.add_parser(
@@ -97,6 +172,8 @@ def setup_parser():
     destroy_environment.add_argument(
         "--force", action="store_true", default=False,
         help="Irrespective of environment state, destroy all env machines")
+    _engine_opts(destroy_environment)
+    _parallel_opts(destroy_environment)
     destroy_environment.set_defaults(command=commands.DestroyEnvironment)
 
     return parser
@@ -137,6 +214,17 @@ def main():
     except PrecheckError as exc:
         print("Precheck error: %s" % str(exc))
         sys.exit(1)
+    except DeliveryError as exc:
+        print("Incomplete: %s" % str(exc))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("Interrupted")
+        sys.exit(130)
+    finally:
+        if options.stats == 'json':
+            sys.stderr.write(stats.format_json() + "\n")
+        elif options.stats:
+            sys.stderr.write(stats.format_table() + "\n")
 
 if __name__ == '__main__':
     main()
@@ -10,98 +10,376 @@
 # file except in compliance with the License. You may obtain a copy of the
 # License at http://opensource.org/licenses/BSD-2-Clause
 
+import logging
 import os
+import threading
+import time
+
+from collections import namedtuple
 
 from juju_scaleway.exceptions import ProviderAPIError
+from juju_scaleway.ratelimit import HIGH, LOW, RateLimiter, parse_retry_after
+from juju_scaleway.runner import Runner
+from juju_scaleway.stats import endpoint, stats
 
 import json
 import requests
 
+try:
+    from urlparse import urljoin, urlparse
+except ImportError:  # Python3
+    from urllib.parse import urljoin, urlparse
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+logger = logging.getLogger("juju.scaleway")
+
 
 class Entity(object):
+    """API object storing the fields the plugin reads as slots.
+
+    Other fields stay in the leftover dict of the decoded response, looked
+    up only when one of them is accessed. Entities without other fields
+    carry no dict at all.
+    """
+
+    __slots__ = ('_extra',)
+    fields = ()
 
     @classmethod
     def from_dict(cls, data):
         i = cls()
-        i.__dict__.update(data)
+        extra = dict(data)
+        for field in cls.fields:
+            setattr(i, field, extra.pop(field, None))
+        i._extra = extra or None
         return i
 
+    def to_dict(self):
+        data = dict(self._extra or {})
+        data.update((field, getattr(self, field)) for field in self.fields)
+        return data
+
+    def __getattr__(self, name):
+        # Only called for attributes which are not slots.
+        if name.startswith('__') or name == '_extra':
+            raise AttributeError(name)
+        try:
+            return self._extra[name]
+        except (KeyError, TypeError):
+            raise AttributeError(name)
+
 
 class Server(Entity):
     """
-    Attributes: id, name, image, state, public_ip, creation_date
+    Attributes: id, name, state, public_ip, creation_date, tags, and from
+    the leftover fields image, volumes...
     """
 
+    __slots__ = fields = (
+        'id', 'name', 'state', 'public_ip', 'creation_date', 'tags')
+
 
 class Image(Entity):
     """
-    Attributes:, id, name, arch, public
+    Attributes: id, name, arch, public, creation_date, and from the
+    leftover fields root_volume, organization...
     """
 
+    __slots__ = fields = ('id', 'name', 'arch', 'public', 'creation_date')
+
+
+# Outcome of one server of a bulk creation. ``server`` is set as soon as it
+# was created, ``error`` if either the creation or the poweron failed.
+CreateResult = namedtuple('CreateResult', ['spec', 'server', 'error'])
+
 
 class Client(object):
 
-    def __init__(self, access_key, secret_key):
+    # One keep-alive connection per runner thread.
+    DEFAULT_POOL_SIZE = Runner.DEFAULT_NUM_RUNNER
+
+    # Retries on connection errors and 5xx responses, sleeping
+    # backoff_factor * 2 ** (retry - 1) seconds between attempts.
+    # Non-idempotent POSTs are only retried if the connection failed.
+    MAX_RETRIES = 3
+    BACKOFF_FACTOR = 0.5
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    # Throttled (429) requests were not processed, all methods are retried
+    # once the delay given by Retry-After, or a backoff, has passed.
+    MAX_THROTTLED_RETRIES = 5
+
+    # Concurrent create and poweron pairs in create_servers.
+    BULK_CONCURRENCY = 16
+
+    # Collections are paginated, the API default page is short.
+    DEFAULT_PER_PAGE = 100
+
+    def __init__(self, access_key, secret_key, pool_size=None, api_url=None):
         self.access_key = access_key
         self.secret_key = secret_key
-        self.api_url_base = 'https://api.scaleway.com'
+        self.api_url_base = api_url or 'https://api.scaleway.com'
+        self.pool_size = pool_size or self.DEFAULT_POOL_SIZE
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.rate_limiter = RateLimiter()
+
+    @property
+    def session(self):
+        """Pooled keep-alive session, shared by all runner threads.
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        retries = Retry(
+            total=self.MAX_RETRIES,
+            backoff_factor=self.BACKOFF_FACTOR,
+            status_forcelist=self.RETRY_STATUSES,
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max(self.pool_size, self.BULK_CONCURRENCY),
+            max_retries=retries)
+
+        session = requests.Session()
+        session.headers.update({
+            'User-Agent': 'juju/client',
+            'X-Auth-Token': self.secret_key})
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
 
     def get_images(self):
-        data = self.request("/images")
-        return [Image.from_dict(image) for image in data.get("images", [])]
+        return list(self.iter_images())
+
+    def iter_images(self):
+        return self.iter_collection('/images', 'images', Image)
 
     def get_url(self, target):
+        if target.startswith(('http://', 'https://')):
+            return target
         return "%s%s" % (self.api_url_base, target)
 
-    def get_servers(self):
-        data = self.request("/servers")
-        return [Server.from_dict(server) for server in data.get('servers', [])]
+    def get_servers(self, **filters):
+        return list(self.iter_servers(**filters))
+
+    def iter_servers(self, name=None, state=None):
+        params = {}
+        if name:
+            params['name'] = name
+        if state:
+            params['state'] = state
+        return self.iter_collection(
+            '/servers', 'servers', Server, params=params)
 
     def get_server(self, server_id):
         data = self.request("/servers/%s" % (server_id))
         return Server.from_dict(data.get('server', {}))
 
-    def create_server(self, name, image):
+    def create_server(self, name, image, tags=None):
+        server = self._create_server(name, image, tags)
+        self.poweron_server(server.id)
+        return server
+
+    def _create_server(self, name, image, tags=None):
         params = dict(
             name=name,
             image=image,
             organization=self.access_key)
+        if tags:
+            params['tags'] = list(tags)
 
         data = self.request('/servers', method='POST', params=params)
-        server = Server.from_dict(data.get('server', {}))
-        # Execute poweron action
-        self.request('/servers/%s/action' % (server.id),
-                     method='POST', params={'action': 'poweron'})
+        return Server.from_dict(data.get('server', {}))
 
-        return server
+    def update_server(self, server_id, **fields):
+        """Change writable fields of a server, e.g. its name or tags.
+        """
+        data = self.request('/servers/%s' % (server_id),
+                            method='PATCH', params=fields)
+        return Server.from_dict(data.get('server', {}))
+
+    def poweron_server(self, server_id):
+        data = self.request('/servers/%s/action' % (server_id),
+                            method='POST', params={'action': 'poweron'})
+        return data.get('task')
+
+    def create_servers(self, specs, concurrency=None):
+        """Create and power on servers concurrently.
+
+        Each poweron is fired as soon as its own creation returns. Failures
+        do not abort the batch, a :class:`CreateResult` is returned for each
+        spec, in order.
+        """
+        specs = list(specs)
+        if not specs:
+            return []
+        runner = Runner()
+        for index, spec in enumerate(specs):
+            runner.queue_op(_CreateServerOp(self, index, spec))
+        runner.start(min(concurrency or self.BULK_CONCURRENCY, len(specs)))
+        results = [None] * len(specs)
+        for result in runner.iter_results():
+            if result.ok:
+                index, created = result.value
+            else:
+                # Cancelled or out of time before the op could report.
+                index = result.op.index
+                created = CreateResult(result.op.spec, None, result.error)
+            results[index] = created
+        return results
 
     def destroy_server(self, server_id):
         data = self.request('/servers/%s/action' % (server_id),
                             method='POST', params={'action': 'terminate'})
         return data.get('task')
 
-    def request(self, target, method='GET', params=None):
-        params = params and dict(params) or {}
+    def poweroff_server(self, server_id):
+        data = self.request('/servers/%s/action' % (server_id),
+                            method='POST', params={'action': 'poweroff'})
+        return data.get('task')
 
-        headers = {'User-Agent': 'juju/client'}
-        headers = {'X-Auth-Token': self.secret_key}
-        url = self.get_url(target)
+    def delete_server(self, server_id):
+        """Remove a stopped server, its volumes are left behind.
+        """
+        self.send('/servers/%s' % (server_id), method='DELETE')
 
-        if method == 'POST':
-            headers['Content-Type'] = "application/json"
-            response = requests.post(
-                url, headers=headers, data=json.dumps(params)
-            )
-        else:
-            response = requests.get(url, headers=headers, params=params)
+    def delete_volume(self, volume_id):
+        self.send('/volumes/%s' % (volume_id), method='DELETE')
+
+    def create_snapshot(self, name, volume_id):
+        params = dict(
+            name=name,
+            volume_id=volume_id,
+            organization=self.access_key)
+        data = self.request('/snapshots', method='POST', params=params)
+        return data.get('snapshot', {})
+
+    def get_snapshot(self, snapshot_id):
+        data = self.request('/snapshots/%s' % (snapshot_id))
+        return data.get('snapshot', {})
+
+    def create_image(self, name, arch, root_volume):
+        """Register a private image booting from a snapshot.
+        """
+        params = dict(
+            name=name,
+            arch=arch,
+            root_volume=root_volume,
+            organization=self.access_key)
+        data = self.request('/images', method='POST', params=params)
+        return Image.from_dict(data.get('image', {}))
+
+    def iter_collection(self, target, key, entity, params=None):
+        """Yield entities of a collection as its pages arrive.
+        """
+        for response in self.iter_pages(target, params=params):
+            for data in response.json().get(key, []):
+                yield entity.from_dict(data)
+
+    def iter_pages(self, target, params=None):
+        """Yield the response of each page of a collection.
+
+        Follows the ``Link: <...>; rel="next"`` header, or ``X-Total-Count``
+        when the former is missing.
+        """
+        base_params = params and dict(params) or {}
+        base_params.setdefault('per_page', self.DEFAULT_PER_PAGE)
+        page = base_params.setdefault('page', 1)
+        base_url = url = self.get_url(target)
+        params = base_params
 
+        while url:
+            response = self.send(url, params=params)
+            yield response
+
+            next_link = response.links.get('next', {}).get('url')
+            total = int(response.headers.get('X-Total-Count') or 0)
+            if next_link:
+                url, params = urljoin(base_url, next_link), None
+            elif page * base_params['per_page'] < total:
+                url, params = base_url, dict(base_params, page=page + 1)
+            else:
+                url = None
+            page += 1
+
+    def request(self, target, method='GET', params=None):
+        response = self.send(target, method=method, params=params)
         data = response.json()
         if not data:
             raise ProviderAPIError(response, 'No json result found')
+        return data
+
+    def send(self, target, method='GET', params=None, headers=None):
+        params = params and dict(params) or {}
+        headers = headers and dict(headers) or {}
+        url = self.get_url(target)
+
+        # Writes go ahead of queued reads, POST and PATCH carry a JSON body.
+        has_body = method in ('POST', 'PATCH')
+        if has_body:
+            headers['Content-Type'] = "application/json"
+        priority = LOW if method == 'GET' else HIGH
+
+        start_time, retries, response = time.time(), 0, None
+        try:
+            for attempt in range(self.MAX_THROTTLED_RETRIES + 1):
+                self.rate_limiter.acquire(priority)
+                if has_body:
+                    response = self.session.request(
+                        method, url, headers=headers, data=json.dumps(params)
+                    )
+                else:
+                    response = self.session.request(
+                        method, url, headers=headers, params=params)
+                self.rate_limiter.update(response.headers)
+                # Connection and 5xx retries made by the session adapter.
+                retries += len(getattr(
+                    getattr(response.raw, 'retries', None), 'history', ()))
+
+                if response.status_code == 429:
+                    stats.record_throttle()
+                if (response.status_code != 429 or
+                        attempt == self.MAX_THROTTLED_RETRIES):
+                    break
+                retries += 1
+                delay = parse_retry_after(
+                    response.headers.get('Retry-After'))
+                if delay is None:
+                    delay = self.BACKOFF_FACTOR * (2 ** attempt)
+                logger.debug(
+                    "Throttled on %s %s, retrying in %0.1fs",
+                    method, url, delay)
+                self.rate_limiter.backoff(delay)
+        finally:
+            stats.record_request(
+                method,
+                endpoint(urlparse(url).path, params.get('action')),
+                time.time() - start_time,
+                status=response is not None and response.status_code or None,
+                retries=retries,
+                size=response is not None and len(response.content) or 0)
+
         if response.status_code >= 400:
-            raise ProviderAPIError(response, data['message'])
+            try:
+                message = response.json().get('message')
+            except ValueError:
+                message = None
+            raise ProviderAPIError(response, message)
 
-        return data
+        return response
 
     @classmethod
     def connect(cls):
@@ -112,6 +390,23 @@ class Client(object):
         return cls(access_key, secret_key)
 
 
+class _CreateServerOp(object):
+
+    def __init__(self, client, index, spec):
+        self.client = client
+        self.index = index
+        self.spec = spec
+
+    def run(self):
+        server = None
+        try:
+            server = self.client._create_server(**self.spec)
+            self.client.poweron_server(server.id)
+        except Exception as exc:
+            return self.index, CreateResult(self.spec, server, exc)
+        return self.index, CreateResult(self.spec, server, None)
+
+
 def main():
     import code
     client = Client.connect()
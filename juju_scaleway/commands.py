@@ -13,12 +13,18 @@
 import logging
 import time
 import uuid
-import yaml
 
 from juju_scaleway import constraints
-from juju_scaleway.exceptions import ConfigError, PrecheckError
+from juju_scaleway.exceptions import (
+    ConfigError, DeliveryError, PrecheckError, ProviderError, TimeoutError)
 from juju_scaleway import ops
-from juju_scaleway.runner import Runner
+from juju_scaleway import pool
+from juju_scaleway import ssh
+from juju_scaleway.polling import PollPolicy
+from juju_scaleway.registrar import Registrar
+from juju_scaleway.retry import RetryPolicy
+from juju_scaleway.runner import Pipeline, Runner
+from juju_scaleway.status import load_yaml
 
 
 logger = logging.getLogger("juju.scaleway")
@@ -30,21 +36,43 @@ class BaseCommand(object):
         self.config = config
         self.provider = provider
         self.env = environment
-        self.runner = Runner()
+        self.runner = Runner(
+            workers=config.parallel, timeout=config.op_timeout,
+            progress="machines")
 
-    def solve_constraints(self):
+    def solve_constraints(self, prebuilt=True):
         start_time = time.time()
-        image_map = constraints.get_images(self.provider.client)
+        cache = constraints.ImageCache(self.config.image_cache_path)
+        refresh = self.config.refresh_images
+        prebuilt = prebuilt and not self.config.stock_image
+        image_map = constraints.get_images(
+            self.provider.client, cache, refresh=refresh, prebuilt=prebuilt)
+        if self.config.series not in image_map and not refresh:
+            # A series may have been published since the cache was filled.
+            image_map = constraints.get_images(
+                self.provider.client, cache, refresh=True, prebuilt=prebuilt)
         logger.debug("Looked up scaleway images in %0.2f seconds",
                      time.time() - start_time)
         return image_map[self.config.series]
 
+    def get_pool(self):
+        return pool.Pool(
+            self.provider, self.config.get_env_name(), self.config.state_dir,
+            workers=self.config.parallel, retry=self.retry_policy())
+
+    def retry_policy(self):
+        """Retries of machine ops, None for the op defaults.
+        """
+        if self.config.retries is None:
+            return None
+        return RetryPolicy.uniform(self.config.retries)
+
     def check_preconditions(self):
         """Check for provider and configured environments.yaml.
         """
         env_name = self.config.get_env_name()
         with open(self.config.get_env_conf()) as handle:
-            conf = yaml.safe_load(handle.read())
+            conf = load_yaml(handle)
             if 'environments' not in conf:
                 raise ConfigError(
                     "Invalid environments.yaml, no 'environments' section")
@@ -83,9 +111,10 @@ class Bootstrap(BaseCommand):
             name="%s-0" % self.config.get_env_name(), image=image)
 
         machine = ops.MachineAdd(
-            self.provider, self.env, params, series=self.config.series
+            self.provider, self.env, params, series=self.config.series,
+            retry=self.retry_policy()
         )
-        server = machine.run()
+        server = machine.provision()
 
         logger.info("Bootstrapping environment...")
         try:
@@ -93,6 +122,8 @@ class Bootstrap(BaseCommand):
         except:
             self.provider.terminate_server(server.id)
             raise
+        finally:
+            machine.close_ssh(server)
         logger.info("Bootstrap complete.")
 
     def check_preconditions(self):
@@ -111,12 +142,12 @@ class ListMachines(BaseCommand):
         header = "{:<8} {:<18} {:<8} {:<12} {:<10}".format(
             "Id", "Name", "Status", "Created", "Address")
 
-        allmachines = self.config.options.all
-        for server in self.provider.get_servers():
-            name = server.name
+        name_prefix = None
+        if not self.config.options.all:
+            name_prefix = '%s-' % env_name
 
-            if not allmachines and not name.startswith('%s-' % env_name):
-                continue
+        for server in self.provider.iter_servers(name_prefix=name_prefix):
+            name = server.name
 
             if header:
                 print(header)
@@ -139,41 +170,247 @@ class AddMachine(BaseCommand):
     def run(self):
         self.check_preconditions()
         image = self.solve_constraints()
-        logger.info("Launching %d servers...", self.config.num_machines)
+        series = self.config.series
+
+        # Booted servers from the warm pool first, then launch the rest.
+        # Without a pool for the series, skip listing servers for it.
+        warm_pool = self.get_pool()
+        claimed = []
+        if warm_pool.target(series):
+            claimed = warm_pool.claim(series, self.config.num_machines)
+            warm_pool.refill_in_background(series)
 
         template = dict(
             image=image)
 
-        for _ in range(self.config.num_machines):
+        params_list = []
+        for _ in range(self.config.num_machines - len(claimed)):
             params = dict(template)
             params['name'] = "%s-%s" % (
                 self.config.get_env_name(), uuid.uuid4().hex)
-            self.runner.queue_op(
-                ops.MachineRegister(
-                    self.provider, self.env, params, series=self.config.series
-                )
-            )
+            params_list.append(params)
+
+        registrar = Registrar(
+            self.env, masters=self.provider.ssh_masters,
+            workers=self.config.parallel)
+        options = dict(
+            series=series, retry=self.retry_policy(), registrar=registrar)
+        machines = [
+            ops.MachineRegister(
+                self.provider, self.env, dict(template, name=server.name),
+                server=server, **options)
+            for server in claimed]
+        if params_list:
+            logger.info("Launching %d servers...", len(params_list))
+        if params_list and self.config.async_engine:
+            from juju_scaleway import aio
+            launched = aio.run(
+                aio.factory(self.provider).launch_servers(params_list))
+            for result in launched:
+                if result.error is not None:
+                    logger.error(
+                        "Could not launch server %s: %s",
+                        result.spec['name'], result.error)
+                    # Left over when the async termination failed too.
+                    if result.server is not None:
+                        self.provider.terminate_server(result.server.id)
+                    continue
+                machines.append(ops.MachineRegister(
+                    self.provider, self.env, result.spec,
+                    server=result.server, **options))
+        else:
+            machines.extend(
+                ops.MachineRegister(self.provider, self.env, params, **options)
+                for params in params_list)
+
+        pipeline = Pipeline(
+            self.pipeline_stages(len(machines)),
+            timeout=self.config.op_timeout, progress="machines")
+        for machine in machines:
+            pipeline.queue_op(machine)
+        delivered = 0
+        try:
+            for result in pipeline.iter_results():
+                if not result.ok:
+                    continue
+                server, machine_id = result.value
+                delivered += 1
+                logger.info(
+                    "Registered id:%s name:%s ip:%s as juju machine %s",
+                    server.id, server.name,
+                    server.public_ip['address'] if server.public_ip else None,
+                    machine_id)
+        finally:
+            registrar.close()
+        if delivered < self.config.num_machines:
+            raise DeliveryError("Added", delivered, self.config.num_machines)
+
+    def pipeline_stages(self, count):
+        """Workers per stage. The launch stage stands for the bulk creation
+        of ``Client.create_servers``: as many creations in flight, each
+        poweron fired once its creation returns, and servers handed over to
+        the wait stage one by one instead of once all are created. Waits
+        are cheap as the server watcher and the ssh probe serve all of
+        them. Register workers hand hosts over to the registrar, which
+        bounds the registrations running at once itself.
+
+        ``--parallel N`` caps every stage to N machines at once, ``auto``
+        keeps these sizes and adapts the registrations.
+        """
+        limit = count
+        if self.config.parallel not in (None, 'auto'):
+            limit = min(count, self.config.parallel)
+        return [
+            ('launch', min(limit, self.provider.client.BULK_CONCURRENCY)),
+            ('wait', min(limit, 128)),
+            ('verify', min(limit, 32)),
+            ('register', min(limit, Registrar.BATCH_SIZE)),
+        ]
+
+
+class ManagePool(BaseCommand):
+    """
+    Actions:
+    - Record the target size of the series pool, with --size
+    - Launch servers missing to reach it, wait for them to answer ssh
+    - Report pool members, with --status
+    - Terminate all pool servers of the environment, with --drain
+    """
 
-        for (server, _) in self.runner.iter_results():
-            logger.info(
-                "Registered id:%s name:%s ip:%s as juju machine",
-                server.id, server.name,
-                server.public_ip['address'] if server.public_ip else None
-            )
+    def run(self):
+        warm_pool = self.get_pool()
+        series = self.config.series
+
+        if self.config.pool_drain:
+            servers = warm_pool.drain()
+            logger.info("Drained %d pool servers", len(servers))
+            return
+
+        if self.config.pool_size is not None:
+            warm_pool.set_target(series, self.config.pool_size)
+
+        if self.config.pool_status:
+            return self.print_status(warm_pool)
+
+        added = warm_pool.fill(series, self.solve_constraints())
+        logger.info(
+            "Added %d servers to the %s pool, target %d",
+            added, series, warm_pool.target(series))
+
+    def print_status(self, warm_pool):
+        targets = warm_pool.targets()
+        counts = {}
+        for server in warm_pool.members():
+            tags = server.tags or ()
+            member_series = [
+                tag.split(':', 1)[1] for tag in tags
+                if tag.startswith('series:')]
+            key = (member_series[0] if member_series else 'unknown',
+                   pool.READY_TAG in tags)
+            counts[key] = counts.get(key, 0) + 1
+
+        print("{:<10} {:>6} {:>6} {:>8}".format(
+            "Series", "Target", "Ready", "Booting"))
+        for series in sorted(set(targets) | set(k for k, _ in counts)):
+            print("{:<10} {:>6} {:>6} {:>8}".format(
+                series, targets.get(series, 0),
+                counts.get((series, True), 0),
+                counts.get((series, False), 0)))
+
+
+class BuildImage(BaseCommand):
+    """
+    Actions:
+    - Launch a server from the stock image of the series
+    - Wait for ssh, upgrade it and install the packages of juju provisioning
+    - Power it off, snapshot its root volume into a private image
+    - Delete the server
+    New machines of the series then boot the newest of these images.
+    """
+
+    snapshot_timeout = 1800
+    snapshot_policy = dict(initial=5.0, factor=1.5, max_delay=30.0)
+
+    def run(self):
+        series = self.config.series
+        image = self.solve_constraints(prebuilt=False)
+        params = dict(
+            name="%s-image-%s" % (self.config.get_env_name(),
+                                  uuid.uuid4().hex),
+            image=image)
+
+        logger.info("Launching %s image builder (eta 5m)...", series)
+        builder = ops.MachineAdd(
+            self.provider, self.env, params, series=series,
+            retry=self.retry_policy())
+        server = builder.provision()
+        try:
+            logger.info("Installing packages on %s...", server.name)
+            try:
+                ssh.prepare_image(
+                    server.public_ip['address'],
+                    masters=self.provider.ssh_masters)
+            finally:
+                builder.close_ssh(server)
+            self.provider.poweroff_server(server.id)
+            stopped, _ = self.provider.wait_many(
+                [server], timeout=self.snapshot_timeout, state='stopped')
+            if not stopped:
+                raise ProviderError("Could not stop %s" % server.name)
+        except:
+            self.provider.terminate_server(server.id)
+            raise
+
+        server = stopped[0]
+        try:
+            built = self.snapshot(server, constraints.prebuilt_image_name(
+                series))
+        finally:
+            self.provider.delete_server(server)
+
+        # Make the new image visible to the cached lookups right away.
+        constraints.get_images(
+            self.provider.client,
+            constraints.ImageCache(self.config.image_cache_path),
+            refresh=True)
+        logger.info("Built image %s id:%s", built.name, built.id)
+        return built
+
+    def snapshot(self, server, name):
+        client = self.provider.client
+        logger.info("Snapshotting %s into %s...", server.name, name)
+        snapshot = client.create_snapshot(name, server.volumes['0']['id'])
+
+        poller = PollPolicy(
+            timeout=self.snapshot_timeout, **self.snapshot_policy).start()
+        while snapshot.get('state') != 'available':
+            if not poller.sleep():
+                raise TimeoutError(
+                    "Snapshot %s not available before timeout" % name)
+            snapshot = client.get_snapshot(snapshot['id'])
+
+        return client.create_image(
+            name, getattr(server, 'arch', None) or 'arm', snapshot['id'])
 
 
 class TerminateMachine(BaseCommand):
 
+    # Machines removed from the juju state per juju call.
+    TERMINATE_BATCH_SIZE = 100
+
     def run(self):
         """Terminate machine in environment.
         """
         self.check_preconditions()
-        self._terminate_machines(lambda x: x in self.config.options.machines)
+        self._terminate_machines(
+            lambda x: x in self.config.options.machines, strict=True)
 
-    def _terminate_machines(self, machine_filter):
+    def _terminate_machines(self, machine_filter, strict=False):
+        """Terminate the juju machines matching the filter, with their
+        servers. ``strict`` raises unless all of them were terminated.
+        """
         logger.debug("Checking for machines to terminate")
-        status = self.env.status()
-        machines = status.get('machines', {})
+        machines = self.env.machines()
 
         # Using the api server-id can be the provider id, but
         # else it defaults to ip, and we have to disambiguate.
@@ -186,17 +423,23 @@ class TerminateMachine(BaseCommand):
                     'machine_id': machine
                 })
 
-        address_map = dict([
-            (d.public_ip['address'] if d.public_ip else None, d)
-            for d in self.provider.get_servers()
-        ])
+        # Stream the organization servers, only keeping those known to juju.
+        addresses = set(
+            machine.get('dns-name') for machine in machines.values())
+        address_map = {}
+        for server in self.provider.iter_servers():
+            address = server.public_ip['address'] if server.public_ip else None
+            if address in addresses:
+                address_map[address] = server
         if not remove:
-            return status, address_map
+            return machines, address_map
 
         logger.info(
             "Terminating machines %s",
             " ".join([machine['machine_id'] for machine in remove])
         )
+        removed = self._remove_from_env(
+            [machine['machine_id'] for machine in remove])
 
         for machine in remove:
             server = address_map.get(machine['address'])
@@ -219,13 +462,44 @@ class TerminateMachine(BaseCommand):
                         'machine_id': machine['machine_id'],
                         'server_id': server_id
                     },
-                    env_only=env_only
+                    env_only=env_only,
+                    iaas_only=machine['machine_id'] in removed,
+                    retry=self.retry_policy()
                 )
             )
-        for _ in self.runner.iter_results():
-            pass
+        terminated = sum(
+            1 for result in self.runner.iter_results() if result.ok)
+        if strict and terminated < len(remove):
+            raise DeliveryError("Terminated", terminated, len(remove))
 
-        return status, address_map
+        return machines, address_map
+
+    def _remove_from_env(self, machine_ids):
+        """Remove machines from the juju state, a batch per juju call.
+
+        Returns the ids of the machines removed. Those of a failed batch
+        still listed by juju are left to their own op, which reports the
+        error of each.
+        """
+        removed = set()
+        for index in range(0, len(machine_ids), self.TERMINATE_BATCH_SIZE):
+            batch = machine_ids[index:index + self.TERMINATE_BATCH_SIZE]
+            try:
+                self.env.terminate_machines(batch)
+            except Exception as exc:
+                logger.warning(
+                    "Could not remove machines %s at once: %s",
+                    " ".join(batch), exc)
+                try:
+                    remaining = self.env.machines()
+                except Exception:
+                    continue
+                removed.update(
+                    machine_id for machine_id in batch
+                    if machine_id not in remaining)
+            else:
+                removed.update(batch)
+        return removed
 
 
 class DestroyEnvironment(TerminateMachine):
@@ -245,7 +519,9 @@ class DestroyEnvironment(TerminateMachine):
         if force:
             return self.force_environment_destroy()
 
-        env_status, server_map = self._terminate_machines(
+        self.get_pool().drain()
+
+        env_machines, server_map = self._terminate_machines(
             state_service_filter
         )
 
@@ -258,8 +534,7 @@ class DestroyEnvironment(TerminateMachine):
         self.env.destroy_environment()
 
         # Remove the state server.
-        bootstrap_host = env_status.get(
-            'machines', {}).get('0', {}).get('dns-name')
+        bootstrap_host = env_machines.get('0', {}).get('dns-name')
         server = server_map.get(bootstrap_host)
         if server:
             logger.info("Terminating state server")
@@ -268,20 +543,33 @@ class DestroyEnvironment(TerminateMachine):
 
     def force_environment_destroy(self):
         env_name = self.config.get_env_name()
-        env_machines = [m for m in self.provider.get_servers()
-                        if m.name.startswith("%s-" % env_name)]
+        drained = set(server.id for server in self.get_pool().drain())
+        env_machines = [
+            machine for machine in self.provider.get_servers(
+                name_prefix="%s-" % env_name)
+            if machine.id not in drained]
 
         logger.info("Destroying environment")
-        for machine in env_machines:
-            self.runner.queue_op(
-                ops.MachineDestroy(
-                    self.provider, self.env, {'server_id': machine.id},
-                    iaas_only=True
+        if self.config.async_engine:
+            from juju_scaleway import aio
+            results = aio.run(aio.factory(self.provider).terminate_servers(
+                [machine.id for machine in env_machines]))
+            for machine, result in zip(env_machines, results):
+                if isinstance(result, Exception):
+                    logger.error(
+                        "Could not terminate server %s: %s",
+                        machine.id, result)
+        else:
+            for machine in env_machines:
+                self.runner.queue_op(
+                    ops.MachineDestroy(
+                        self.provider, self.env, {'server_id': machine.id},
+                        iaas_only=True, retry=self.retry_policy()
+                    )
                 )
-            )
 
-        for _ in self.runner.iter_results():
-            pass
+            for _ in self.runner.iter_results():
+                pass
 
         # Fast destroy the client cache by removing the jenv file.
         self.env.destroy_environment_jenv()
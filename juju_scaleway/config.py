@@ -11,12 +11,12 @@
 # License at http://opensource.org/licenses/BSD-2-Clause
 
 import os
-import yaml
 import sys
 
 from juju_scaleway.env import Environment
 from juju_scaleway.exceptions import ConfigError
 from juju_scaleway import provider
+from juju_scaleway.status import load_yaml
 
 
 class Config(object):
@@ -27,7 +27,7 @@ class Config(object):
     def connect_provider(self):
         """Connect to Scaleway.
         """
-        return provider.factory()
+        return provider.factory(state_dir=self.state_dir)
 
     def connect_environment(self):
         """Return a websocket connection to the environment.
@@ -36,6 +36,9 @@ class Config(object):
 
     def validate(self):
         provider.validate()
+        if self.async_engine:
+            from juju_scaleway import aio
+            aio.validate()
         self.get_env_name()
 
     @property
@@ -58,6 +61,58 @@ class Config(object):
     def num_machines(self):
         return getattr(self.options, 'num_machines', 0)
 
+    @property
+    def async_engine(self):
+        return getattr(self.options, 'async_engine', False)
+
+    @property
+    def parallel(self):
+        """Workers of bulk commands, a number, ``'auto'`` or None.
+        """
+        return getattr(self.options, 'parallel', None)
+
+    @property
+    def retries(self):
+        return getattr(self.options, 'retries', None)
+
+    @property
+    def op_timeout(self):
+        return getattr(self.options, 'op_timeout', None)
+
+    @property
+    def refresh_images(self):
+        return getattr(self.options, 'refresh_images', False)
+
+    @property
+    def stock_image(self):
+        return getattr(self.options, 'stock_image', False)
+
+    @property
+    def pool_size(self):
+        return getattr(self.options, 'size', None)
+
+    @property
+    def pool_drain(self):
+        return getattr(self.options, 'drain', False)
+
+    @property
+    def pool_status(self):
+        return getattr(self.options, 'status', False)
+
+    @property
+    def state_dir(self):
+        """Plugin private files, e.g. caches, under the juju home.
+        """
+        return os.path.join(self.juju_home, 'scaleway')
+
+    @property
+    def ssh_control_dir(self):
+        return os.path.join(self.state_dir, 'ssh')
+
+    @property
+    def image_cache_path(self):
+        return os.path.join(self.state_dir, 'images.json')
+
     @property
     def juju_home(self):
         jhome = os.environ.get("JUJU_HOME")
@@ -82,7 +137,7 @@ class Config(object):
                 return handle.read().strip()
 
         with open(self.get_env_conf()) as handle:
-            conf = yaml.safe_load(handle.read())
+            conf = load_yaml(handle)
             if 'default' not in conf:
                 raise ConfigError("No Environment specified")
             return conf['default']
@@ -10,20 +10,162 @@
 # file except in compliance with the License. You may obtain a copy of the
 # License at http://opensource.org/licenses/BSD-2-Clause
 
+import logging
+import os
+import re
+import time
+
+from juju_scaleway.client import Image
+from juju_scaleway.files import dump_json, file_lock, load_json
+
+
+logger = logging.getLogger("juju.scaleway")
+
 SERIES_MAP = {
     'Ubuntu Utopic (14.10)': 'utopic',
     'Ubuntu Trusty (14.04 LTS)': 'trusty',
 }
 
 
-def get_images(client):
-    images = {}
-    for i in client.get_images():
+# Private images made by build-image, e.g. juju-trusty-20150301120000.
+PREBUILT_RE = re.compile(r'^juju-(?P<series>[a-z]+)-\d+$')
+
+
+def prebuilt_image_name(series):
+    return 'juju-%s-%s' % (series, time.strftime('%Y%m%d%H%M%S'))
+
+
+def get_images(client, cache=None, refresh=False, prebuilt=True):
+    """Resolve series to image ids.
+
+    With a ``cache``, fresh entries are returned without any API call and
+    stale ones are revalidated, see :func:`not_modified`. ``refresh``
+    ignores the cached entry. Unless ``prebuilt`` is false, images made by
+    build-image are preferred to stock ones.
+    """
+    def resolve(stock, built):
+        images = dict(stock)
+        if prebuilt:
+            images.update(built)
+        return images
+
+    if cache is None:
+        return resolve(*match_images(client.iter_images()))
+
+    with cache.lock():
+        entry = None if refresh else cache.load()
+        if entry is not None and cache.is_fresh(entry):
+            return resolve(entry['images'], entry['prebuilt'])
+
+        if entry is not None and not_modified(client, entry):
+            logger.debug("Scaleway image catalog not modified")
+            cache.save(entry['images'], entry['prebuilt'], entry['etags'],
+                       entry['total'])
+            return resolve(entry['images'], entry['prebuilt'])
+
+        # Headers of each page, recorded as the images stream through.
+        headers = []
+        stock, built = match_images(
+            Image.from_dict(image)
+            for response in _recorded(client.iter_pages('/images'), headers)
+            for image in response.json().get('images', []))
+        etags = [page.get('ETag') for page in headers]
+        total = int(headers[-1].get('X-Total-Count') or 0)
+        # Pages without an ETag can not be revalidated.
+        cache.save(stock, built, etags if all(etags) else None, total)
+        return resolve(stock, built)
+
+
+def _recorded(responses, headers):
+    for response in responses:
+        headers.append(response.headers)
+        yield response
+
+
+def not_modified(client, entry):
+    """Whether the catalog cached in ``entry`` is unchanged.
+
+    Each page is revalidated against its own ETag, so images added or
+    removed anywhere are noticed. The count of images, ``X-Total-Count``,
+    gives the number of pages. Images added after a full last page leave
+    the cached pages alone, the next page is then checked for emptiness.
+    """
+    etags, total = entry['etags'], entry['total']
+    per_page = client.DEFAULT_PER_PAGE
+    if not etags or len(etags) != max(1, -(-total // per_page)):
+        return False
+    for page, etag in enumerate(etags, 1):
+        response = client.send(
+            '/images', params={'page': page, 'per_page': per_page},
+            headers={'If-None-Match': etag})
+        if response.status_code != 304:
+            return False
+        count = response.headers.get('X-Total-Count')
+        if count is not None and int(count) != total:
+            return False
+    if total == len(etags) * per_page:
+        response = client.send(
+            '/images', params={'page': len(etags) + 1, 'per_page': per_page})
+        if response.json().get('images'):
+            return False
+    return True
+
+
+def match_images(images):
+    """Stock public image, and newest prebuilt private image, per series.
+    """
+    matches = {}
+    prebuilt = {}
+    newest = {}
+    for i in images:
         if not i.public:
+            match = PREBUILT_RE.match(i.name or '')
+            serie = match and match.group('series')
+            if serie in SERIES_MAP.values() and \
+               (i.creation_date or '') >= newest.get(serie, ''):
+                prebuilt[serie] = i.id
+                newest[serie] = i.creation_date or ''
             continue
 
         for serie in SERIES_MAP:
             if ("%s" % serie) == i.name:
-                images[SERIES_MAP[serie]] = i.id
+                matches[SERIES_MAP[serie]] = i.id
+
+    return matches, prebuilt
+
+
+class ImageCache(object):
+    """Series to image id map persisted on disk, with the ETag of each
+    catalog page and the count of images.
+
+    Concurrent invocations serialize on a lock file, so only one of them
+    downloads the catalog while the others wait for its result.
+    """
+
+    DEFAULT_TTL = 3600
+    FIELDS = ('images', 'prebuilt', 'etags', 'total', 'checked')
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = self.DEFAULT_TTL if ttl is None else ttl
+
+    def lock(self):
+        return file_lock(self.path + '.lock')
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get('checked', 0) < self.ttl
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        entry = load_json(self.path)
+        if not isinstance(entry, dict) or not all(
+                field in entry for field in self.FIELDS):
+            logger.warning("Ignoring corrupted image cache %s", self.path)
+            return None
+        return entry
 
-    return images
+    def save(self, images, prebuilt, etags=None, total=0):
+        entry = {'images': images, 'prebuilt': prebuilt, 'etags': etags,
+                 'total': total, 'checked': time.time()}
+        dump_json(self.path, entry)
@@ -16,37 +16,106 @@ except ImportError:  # Python3
     import http.client as httplib
 
 import logging
+import re
 import shutil
 import subprocess
 import socket
 
+import json
 import os
+import threading
 import yaml
 
+from juju_scaleway import cancel
 from juju_scaleway.constraints import SERIES_MAP
+from juju_scaleway.exceptions import JujuAPIError
+from juju_scaleway.jujuapi import APIClient, status_dict
+from juju_scaleway.registrar import Registrar
+from juju_scaleway.ssh import ControlMasters
+from juju_scaleway.stats import stats
+from juju_scaleway.status import load_yaml, status_machines
 
 
 logger = logging.getLogger("juju.scaleway")
 
+ADDED_RE = re.compile(r'created machine (\S+)')
+
 
 class Environment(object):
 
     def __init__(self, config):
         self.config = config
+        self.ssh_masters = ControlMasters(config.ssh_control_dir)
+        self._api = None
+        self._api_checked = False
+        self._api_lock = threading.Lock()
+
+    @property
+    def jenv_path(self):
+        return os.path.join(
+            self.config.juju_home, "environments",
+            "%s.jenv" % self.config.get_env_name())
+
+    def api(self):
+        """Connection to the juju API server shared by all threads, None
+        when the juju CLI has to be used instead.
+        """
+        with self._api_lock:
+            if self._api_checked:
+                return self._api
+            self._api_checked = True
+            if os.environ.get('JUJU_SCALEWAY_JUJU_API') == '0':
+                return None
+            if not APIClient.available():
+                logger.debug("websocket-client missing, using the juju CLI")
+                return None
+            client = APIClient.from_jenv(self.jenv_path)
+            if client is None:
+                return None
+            try:
+                self._api = client.connect()
+            except Exception as exc:
+                logger.debug("Using the juju CLI, no juju API: %s", exc)
+            return self._api
+
+    def api_failed(self, exc):
+        """Use the juju CLI from now on.
+        """
+        logger.warning("Juju API call failed, using the juju CLI: %s", exc)
+        self.close()
+        with self._api_lock:
+            self._api_checked = True
+
+    def close(self):
+        with self._api_lock:
+            if self._api is not None:
+                self._api.close()
+            self._api = None
+            self._api_checked = False
+
+    def authorized_keys(self):
+        """Public key juju logs into its machines with.
+        """
+        path = os.path.join(self.config.juju_home, "ssh", "juju_id_rsa.pub")
+        with open(path) as handle:
+            return handle.read()
 
     def _run(self, command, env=None, capture_err=False):
         if env is None:
             env = dict(os.environ)
+        # Provisioning over the master connections of the plugin ops.
+        env = self.ssh_masters.environ(env)
         env["JUJU_ENV"] = self.config.get_env_name()
         args = ['juju']
         args.extend(command)
         logger.debug("Running juju command: %s", " ".join(args))
         try:
-            if capture_err:
-                return subprocess.check_call(
+            with stats.timed_subprocess("juju %s" % command[0]):
+                if capture_err:
+                    return cancel.check_call(
+                        args, env=env, stderr=subprocess.STDOUT)
+                return cancel.check_output(
                     args, env=env, stderr=subprocess.STDOUT)
-            return subprocess.check_output(
-                args, env=env, stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as exc:
             logger.error(
                 "Failed to run command %s\n%s",
@@ -55,18 +124,35 @@ class Environment(object):
             raise
 
     def status(self):
-        return yaml.safe_load(self._run(['status']))
+        api = self.api()
+        if api is not None:
+            try:
+                return status_dict(api.full_status())
+            except JujuAPIError as exc:
+                self.api_failed(exc)
+        return json.loads(
+            self._run(['status', '--format', 'json']).decode('utf-8'))
+
+    def machines(self):
+        """Machines of the environment status, keyed by id, without
+        decoding the rest of it.
+        """
+        api = self.api()
+        if api is not None:
+            try:
+                return status_dict(api.full_status())['machines']
+            except JujuAPIError as exc:
+                self.api_failed(exc)
+        return status_machines(self._run(['status', '--format', 'json']))
 
     def is_running(self):
         """Try to connect the api server websocket to see if env is running.
         """
-        name = self.config.get_env_name()
-        jenv = os.path.join(
-            self.config.juju_home, "environments", "%s.jenv" % name)
+        jenv = self.jenv_path
         if not os.path.exists(jenv):
             return False
         with open(jenv) as handle:
-            data = yaml.safe_load(handle.read())
+            data = load_yaml(handle)
             if not data:
                 return False
             conf = data.get('bootstrap-config')
@@ -81,20 +167,46 @@ class Environment(object):
             return False
 
     def add_machine(self, location, key=None, debug=False):
+        if location.startswith('ssh:') and not (key or debug) and self.api():
+            registrar = Registrar(self, masters=self.ssh_masters, workers=1)
+            try:
+                return registrar.register(
+                    location.split('@', 1)[-1], self.config.series)
+            finally:
+                registrar.close()
+
         ops = ['add-machine', location]
         if key:
             ops.extend(['--ssh-key', key])
         if debug:
             ops.append('--debug')
+            return self._run(ops, capture_err=True)
 
-        return self._run(ops, capture_err=debug)
+        output = self._run(ops).decode('utf-8', 'replace')
+        match = ADDED_RE.search(output)
+        return match.group(1) if match else output.strip()
 
     def terminate_machines(self, machines):
+        api = self.api()
+        if api is not None:
+            try:
+                return api.destroy_machines(machines)
+            except JujuAPIError as exc:
+                self.api_failed(exc)
         cmd = ['terminate-machine', '--force']
         cmd.extend(machines)
         return self._run(cmd)
 
     def destroy_environment(self):
+        api = self.api()
+        if api is not None:
+            try:
+                api.destroy_environment()
+            except JujuAPIError as exc:
+                self.api_failed(exc)
+            else:
+                # As the CLI does, forget about the environment.
+                return self.destroy_environment_jenv()
         cmd = [
             'destroy-environment', "-y", self.config.get_env_name()]
         return self._run(cmd)
@@ -106,11 +218,9 @@ class Environment(object):
         will work, but will wait for a timeout to connect to the state server
         before doing the same.
         """
-        env_name = self.config.get_env_name()
-        jenv_path = os.path.join(
-            self.config.juju_home, "environments", "%s.jenv" % env_name)
-        if os.path.exists(jenv_path):
-            os.remove(jenv_path)
+        self.close()
+        if os.path.exists(self.jenv_path):
+            os.remove(self.jenv_path)
 
     def bootstrap(self):
         return self._run(['bootstrap', '-v'])
@@ -148,7 +258,7 @@ class Environment(object):
 
         # Updated env config with the bootstrap host.
         with open(self.config.get_env_conf()) as handle:
-            data = yaml.safe_load(handle.read())
+            data = load_yaml(handle)
             env_conf = data['environments'].get(env_name)
         env_conf['bootstrap-host'] = host
 
@@ -46,3 +46,31 @@ class ProviderAPIError(Exception):
         return "<ProviderAPIError message:%s response:%r>" % (
             self.message or "Unknown",
             self.response.status_code)
+
+
+class OpCancelled(Exception):
+    """ A machine operation was interrupted before completion.
+    """
+
+
+class DeliveryError(ProviderError):
+    """ Fewer machines than requested were handled.
+    """
+
+    def __init__(self, action, delivered, requested):
+        self.action = action
+        self.delivered = delivered
+        self.requested = requested
+
+    def __str__(self):
+        return "%s %d of %d machines" % (
+            self.action, self.delivered, self.requested)
+
+
+class JujuAPIError(Exception):
+    """ A call to the juju API server failed.
+    """
+
+    def __init__(self, message, code=None):
+        super(JujuAPIError, self).__init__(message)
+        self.code = code
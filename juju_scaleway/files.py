@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Plugin state files, shared by concurrent invocations.
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def ensure_dir(path, mode=0o700):
+    if not os.path.exists(path):
+        os.makedirs(path, mode)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock across processes, a no-op where flock is missing.
+    """
+    ensure_dir(os.path.dirname(path))
+    with open(path, 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def load_json(path, default=None):
+    """Content of a JSON file, ``default`` if missing or corrupted.
+    """
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_atomic(path, content, mode=None):
+    """Write aside then rename, readers never see a partial file.
+    """
+    directory = os.path.dirname(path)
+    ensure_dir(directory)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix='.%s' % os.path.basename(path))
+    with os.fdopen(fd, 'w') as handle:
+        handle.write(content)
+    if mode is not None:
+        os.chmod(tmp_path, mode)
+    getattr(os, 'replace', os.rename)(tmp_path, path)
+
+
+def dump_json(path, data):
+    write_atomic(path, json.dumps(data))
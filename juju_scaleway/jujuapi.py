@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Client of the juju API server, the websocket the juju CLI itself talks to.
+
+One connection serves all the calls of a command, where each juju process
+would load its client and log in again. Requires ``websocket-client``
+(``pip install juju-scaleway[api]``), the callers fall back to the juju CLI
+without it.
+"""
+
+import itertools
+import json
+import logging
+import os
+import ssl
+import tempfile
+import threading
+import time
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+from juju_scaleway.exceptions import JujuAPIError
+from juju_scaleway.stats import stats
+from juju_scaleway.status import load_yaml
+
+
+logger = logging.getLogger("juju.scaleway")
+
+
+class APIClient(object):
+    """Calls are serialized on the connection, they are short compared to
+    the work juju does for them.
+    """
+
+    PORT = 17070
+    CONNECT_TIMEOUT = 10
+
+    def __init__(self, addresses, user, password, ca_cert=None,
+                 env_uuid=None):
+        self.addresses = addresses
+        self.user = user
+        self.password = password
+        self.ca_cert = ca_cert
+        self.env_uuid = env_uuid
+        self.conn = None
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def available(cls):
+        return websocket is not None
+
+    @classmethod
+    def from_jenv(cls, path):
+        """Client of the environment described by a jenv file, None if the
+        file misses credentials or addresses.
+        """
+        try:
+            with open(path) as handle:
+                data = load_yaml(handle) or {}
+        except (IOError, OSError):
+            return None
+        addresses = data.get('state-servers') or []
+        if not addresses and data.get('bootstrap-config'):
+            host = data['bootstrap-config'].get('bootstrap-host')
+            if host:
+                addresses = ['%s:%d' % (host, cls.PORT)]
+        if not addresses or not data.get('password'):
+            return None
+        return cls(
+            addresses, data.get('user') or 'admin', data['password'],
+            ca_cert=data.get('ca-cert'), env_uuid=data.get('environ-uuid'))
+
+    def connect(self):
+        if websocket is None:
+            raise JujuAPIError("websocket-client is not installed")
+        sslopt = {'cert_reqs': ssl.CERT_NONE}
+        ca_path = None
+        if self.ca_cert:
+            ca_path = self._write_ca()
+            sslopt = {'cert_reqs': ssl.CERT_REQUIRED, 'ca_certs': ca_path,
+                      'check_hostname': False}
+        path = '/'
+        if self.env_uuid:
+            path = '/environment/%s/api' % self.env_uuid
+        errors = []
+        try:
+            for address in self.addresses:
+                try:
+                    self.conn = websocket.create_connection(
+                        'wss://%s%s' % (address, path), sslopt=sslopt,
+                        timeout=self.CONNECT_TIMEOUT)
+                    break
+                except Exception as exc:
+                    errors.append("%s: %s" % (address, exc))
+            else:
+                raise JujuAPIError(
+                    "Could not connect to the juju API, %s" % (
+                        "; ".join(errors)))
+        finally:
+            if ca_path is not None:
+                os.remove(ca_path)
+        # Requests may take long, e.g. destroying an environment.
+        self.conn.settimeout(None)
+        self.call('Admin', 'Login', {
+            'AuthTag': 'user-%s' % self.user, 'Password': self.password,
+            'Nonce': ''})
+        return self
+
+    def _write_ca(self):
+        handle, path = tempfile.mkstemp(prefix='juju-ca-', suffix='.pem')
+        with os.fdopen(handle, 'w') as ca_file:
+            ca_file.write(self.ca_cert)
+        return path
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def call(self, facade, request, params=None, version=0):
+        message = {
+            'Type': facade, 'Version': version, 'Request': request,
+            'Params': params or {}}
+        start = time.time()
+        error = True
+        size = 0
+        try:
+            with self.lock:
+                if self.conn is None:
+                    raise JujuAPIError("Not connected to the juju API")
+                message['RequestId'] = request_id = next(self.ids)
+                try:
+                    self.conn.send(json.dumps(message))
+                    while True:
+                        data = self.conn.recv()
+                        reply = json.loads(data)
+                        if reply.get('RequestId') == request_id:
+                            break
+                except Exception as exc:
+                    self.conn.close()
+                    self.conn = None
+                    raise JujuAPIError("Lost the juju API connection: %s" % (
+                        exc or exc.__class__.__name__))
+            size = len(data)
+            if reply.get('Error'):
+                raise JujuAPIError(
+                    "%s.%s: %s" % (facade, request, reply['Error']),
+                    reply.get('ErrorCode'))
+            error = False
+            return reply.get('Response') or {}
+        finally:
+            stats.record_request(
+                'JUJU', '%s.%s' % (facade, request), time.time() - start,
+                status=500 if error else 200, size=size)
+
+    def full_status(self):
+        return self.call('Client', 'FullStatus', {'Patterns': []})
+
+    def add_machines(self, machine_params):
+        """Record machines in the environment state, in one call. Returns
+        a machine id or an error message per machine, in order.
+        """
+        response = self.call(
+            'Client', 'AddMachines', {'MachineParams': machine_params})
+        results = []
+        for result in response.get('Machines') or []:
+            error = result.get('Error')
+            if error:
+                results.append(
+                    JujuAPIError(error.get('Message') or str(error),
+                                 error.get('Code')))
+            else:
+                results.append(result['Machine'])
+        return results
+
+    def provisioning_script(self, machine_id, nonce):
+        """Script installing the machine agent of a manual machine.
+        """
+        response = self.call('Client', 'ProvisioningScript', {
+            'MachineId': machine_id, 'Nonce': nonce,
+            'DataDir': '/var/lib/juju', 'DisablePackageCommands': False})
+        return response['Script']
+
+    def destroy_machines(self, machine_ids, force=True):
+        self.call('Client', 'DestroyMachines', {
+            'MachineNames': list(machine_ids), 'Force': force})
+
+    def destroy_environment(self):
+        self.call('Client', 'DestroyEnvironment')
+
+
+def status_dict(status):
+    """FullStatus response in the shape of ``juju status`` output, as far
+    as machines go.
+    """
+    machines = {}
+    for machine_id, machine in (status.get('Machines') or {}).items():
+        machines[machine_id] = {
+            'agent-state': machine.get('AgentState'),
+            'life': machine.get('Life') or None,
+            'dns-name': machine.get('DNSName'),
+            'instance-id': machine.get('InstanceId'),
+            'series': machine.get('Series'),
+            'hardware': machine.get('Hardware'),
+        }
+    return {
+        'environment': status.get('EnvironmentName'),
+        'machines': machines,
+        'services': dict(
+            (name, {}) for name in status.get('Services') or {}),
+    }
@@ -14,7 +14,10 @@ import logging
 import time
 import subprocess
 
-from juju_scaleway.exceptions import TimeoutError
+from juju_scaleway import cancel
+from juju_scaleway.exceptions import ProviderAPIError, TimeoutError
+from juju_scaleway.polling import PollPolicy
+from juju_scaleway.retry import RetryPolicy
 from juju_scaleway import ssh
 
 
@@ -22,6 +25,13 @@ logger = logging.getLogger("juju.scaleway")
 
 
 class MachineOp(object):
+    """
+    A stage failing on a transient error is retried as allowed by the
+    ``retry`` option, a RetryPolicy.
+    """
+
+    # Seconds the op may run before runners cancel it, None for no limit.
+    time_limit = None
 
     def __init__(self, provider, env, params, **options):
         self.provider = provider
@@ -29,33 +39,145 @@ class MachineOp(object):
         self.params = params
         self.created = time.time()
         self.options = options
+        self.retries = (self.options.get('retry') or RetryPolicy()).start()
+
+    @property
+    def label(self):
+        return self.params.get('name') or self.params.get('machine_id', '')
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.label)
 
     def run(self):
         raise NotImplementedError()
 
+    def run_stage(self, stage):
+        while True:
+            cancel.check()
+            try:
+                return getattr(self, stage)()
+            except Exception as exc:
+                kind = self.retries.allow(exc)
+                if kind is None:
+                    raise
+                logger.warning(
+                    "Retrying %s of %r after %s error: %s",
+                    stage, self, kind, exc)
+            self.retries.sleep()
+            self.recover(stage)
+
+    def recover(self, stage):
+        """Pick up what a failed stage left before it runs again.
+        """
+
 
 class MachineAdd(MachineOp):
+    """
+    Stages: launch the server, wait for it to run, then for ssh. ``run``
+    goes through them in a row, a runner Pipeline one at a time, each
+    stage on its own workers.
+
+    Stages are retried on the server launched so far.
+    """
 
+    stages = ('launch', 'wait', 'verify')
+    time_limit = 1800
     timeout = 360
-    delay = 8
+    # Ssh retries once the port answers, e.g. until keys are installed.
+    policy = dict(initial=1.0, factor=1.5, max_delay=8.0)
+
+    def __init__(self, provider, env, params, **options):
+        super(MachineAdd, self).__init__(provider, env, params, **options)
+        # Servers may have been launched ahead of time, in bulk.
+        self.server = self.options.get('server')
+
+    @property
+    def label(self):
+        if self.server is not None:
+            return self.server.name
+        return super(MachineAdd, self).label
 
     def run(self):
-        server = self.provider.launch_server(self.params)
-        self.provider.wait_on(server)
-        server = self.provider.get_server(server.id)
-        self.verify_ssh(server)
-        return server
+        self.run_stages(self.stages)
+        return self.finish()
+
+    def provision(self):
+        """Running server answering ssh, its master connection left open
+        for the commands which follow.
+        """
+        self.run_stages(MachineAdd.stages)
+        return self.server
+
+    def run_stages(self, stages):
+        try:
+            for stage in stages:
+                self.run_stage(stage)
+        except:
+            self.abort()
+            raise
+
+    def recover(self, stage):
+        if stage == 'launch' and self.server is None:
+            # The server may have been created before the error.
+            self.server = self.provider.find_server(self.params['name'])
+            if self.server is not None and self.server.state == 'stopped':
+                self.provider.poweron_server(self.server.id)
+        elif stage == 'verify':
+            self.close_ssh(self.server)
+
+    def launch(self):
+        if self.server is None:
+            self.server = self.provider.launch_server(self.params)
+
+    def wait(self):
+        if self.server.state != 'running':
+            self.server = self.provider.wait_on(self.server)
+
+    def verify(self):
+        self.verify_ssh(self.server)
+
+    def finish(self):
+        self.close_ssh(self.server)
+        return self.server
+
+    def abort(self):
+        """Terminate the server of a failed op.
+        """
+        if self.server is None:
+            return
+        try:
+            if self.server.public_ip:
+                self.close_ssh(self.server)
+            self.provider.terminate_server(self.server.id)
+        except Exception:
+            logger.warning(
+                "Could not terminate server %s", self.server.id,
+                exc_info=True)
+
+    def close_ssh(self, server):
+        if self.provider.ssh_masters is not None:
+            self.provider.ssh_masters.close(server.public_ip['address'])
 
     def verify_ssh(self, server):
         """Workaround for manual provisioning and ssh availability.
         Manual provider bails immediately upon failure to connect on
         ssh, we loop to allow the server time to start ssh.
         """
-        max_time = self.timeout + time.time()
+        history = self.provider.history
+        poller = PollPolicy(timeout=self.timeout, **self.policy).start()
+        # Spawn ssh once the port shows a banner, rather than to find out.
+        if not self.provider.ssh_probe.wait(
+                server.public_ip['address'], self.timeout,
+                expected=history.expected('ssh')):
+            raise TimeoutError(
+                "No ssh banner from id:%s name:%s ip:%s before timeout" % (
+                    server.id, server.name, server.public_ip['address']))
         running = False
-        while max_time > time.time():
+        while True:
             try:
-                if ssh.check_ssh(server.public_ip['address']):
+                if ssh.check_ssh(
+                        server.public_ip['address'],
+                        masters=self.provider.ssh_masters):
                     running = True
                     break
             except subprocess.CalledProcessError as exc:
@@ -66,8 +188,9 @@ class MachineAdd(MachineOp):
                     logger.debug(
                         "Waiting for ssh on id:%s ip:%s name:%s remaining:%d",
                         server.id, server.public_ip['address'], server.name,
-                        int(max_time-time.time()))
-                    time.sleep(self.delay)
+                        int(poller.remaining))
+                    if not poller.sleep():
+                        break
                 else:
                     logger.error(
                         "Could not ssh to server name: %s id: %s ip: %s\n%s",
@@ -79,28 +202,101 @@ class MachineAdd(MachineOp):
             raise TimeoutError(
                 "Could not provision id:%s name:%s ip:%s before timeout" % (
                     server.id, server.name, server.public_ip['address']))
+        history.record('ssh', poller.elapsed)
 
 
 class MachineRegister(MachineAdd):
 
-    def run(self):
-        server = super(MachineRegister, self).run()
-        try:
-            machine_id = self.env.add_machine(
-                "ssh:root@%s" % server.public_ip['address'],
+    stages = MachineAdd.stages + ('register',)
+
+    def __init__(self, provider, env, params, **options):
+        super(MachineRegister, self).__init__(
+            provider, env, params, **options)
+        self.machine_id = None
+
+    def register(self):
+        if self.machine_id is not None:
+            return
+        address = self.server.public_ip['address']
+        registrar = self.options.get('registrar')
+        if registrar is not None:
+            self.machine_id = registrar.register(
+                address, self.options.get('series'),
                 key=self.options.get('key'))
-        except:
-            self.provider.terminate_server(server.id)
-            raise
-        return server, machine_id
+            return
+        self.machine_id = self.env.add_machine(
+            "ssh:root@%s" % address, key=self.options.get('key'))
+
+    def recover(self, stage):
+        if stage != 'register':
+            return super(MachineRegister, self).recover(stage)
+        # Juju may have registered the machine before failing. Earlier
+        # attempts may also have left machines on their way out.
+        address = self.server.public_ip['address']
+        machines = self.env.machines()
+        candidates = [
+            machine_id for machine_id, machine in machines.items()
+            if machine.get('dns-name') == address and
+            machine.get('life') not in ('dying', 'dead') and
+            machine.get('agent-state') != 'error']
+        if candidates:
+            self.machine_id = max(candidates, key=_machine_number)
+            logger.info(
+                "Server %s is already juju machine %s",
+                self.server.id, self.machine_id)
+
+    def finish(self):
+        server = super(MachineRegister, self).finish()
+        return server, self.machine_id
 
 
 class MachineDestroy(MachineOp):
+    """
+    Stages: remove the machine from juju, unless ``iaas_only``, then
+    terminate its server, unless ``env_only``.
+    """
+
+    stages = ('unregister', 'terminate')
+    time_limit = 600
+
+    def __init__(self, provider, env, params, **options):
+        super(MachineDestroy, self).__init__(
+            provider, env, params, **options)
+        self.unregistered = bool(self.options.get('iaas_only'))
+        self.terminated = bool(self.options.get('env_only'))
 
     def run(self):
-        if not self.options.get('iaas_only'):
-            self.env.terminate_machines([self.params['machine_id']])
-        if self.options.get('env_only'):
+        for stage in self.stages:
+            self.run_stage(stage)
+
+    def unregister(self):
+        if self.unregistered:
+            return
+        self.env.terminate_machines([self.params['machine_id']])
+        self.unregistered = True
+
+    def terminate(self):
+        if self.terminated:
             return
         logger.debug("Destroying server %s", self.params['server_id'])
         self.provider.terminate_server(self.params['server_id'])
+        self.terminated = True
+
+    def recover(self, stage):
+        # The failed call may have gone through nonetheless.
+        if stage == 'unregister':
+            if self.params['machine_id'] not in self.env.machines():
+                self.unregistered = True
+        elif stage == 'terminate':
+            try:
+                self.provider.get_server(self.params['server_id'])
+            except ProviderAPIError as exc:
+                # Other errors show again on the next attempt.
+                if getattr(exc.response, 'status_code', None) == 404:
+                    self.terminated = True
+
+
+def _machine_number(machine_id):
+    """Order of top level juju machines, by creation.
+    """
+    return int(machine_id) if machine_id.isdigit() else -1
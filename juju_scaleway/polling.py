@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Polling policies for the server and ssh wait loops.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from juju_scaleway import cancel
+from juju_scaleway.files import dump_json, load_json
+
+
+logger = logging.getLogger("juju.scaleway")
+
+
+class PollPolicy(object):
+    """Poll fast first, then back off exponentially, with jitter.
+
+    When the typical duration of the wait is ``expected``, the first poll
+    is pushed back to a fraction of it, as earlier ones are mostly wasted.
+    """
+
+    def __init__(self, initial=1.0, factor=1.5, max_delay=15.0, jitter=0.2,
+                 timeout=None, expected=None):
+        self.initial = initial
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.timeout = timeout
+        self.expected = expected
+
+    def start(self):
+        return Poller(self)
+
+
+class Poller(object):
+    """Running state of a policy, from the start of a wait.
+    """
+
+    # Share of the expected duration slept before the first poll.
+    EXPECTED_RATIO = 0.75
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.started = time.time()
+        self.attempts = 0
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def remaining(self):
+        if self.policy.timeout is None:
+            return None
+        return max(0.0, self.policy.timeout - self.elapsed)
+
+    def next_delay(self):
+        """Seconds to sleep before the next poll, None past the deadline.
+        """
+        policy = self.policy
+        remaining = self.remaining
+        if remaining is not None and remaining <= 0:
+            return None
+
+        if self.attempts == 0 and policy.expected:
+            delay = max(
+                policy.initial,
+                policy.expected * self.EXPECTED_RATIO - self.elapsed)
+        else:
+            delay = min(
+                policy.max_delay,
+                policy.initial * policy.factor ** self.attempts)
+            delay *= random.uniform(1 - policy.jitter, 1 + policy.jitter)
+        self.attempts += 1
+
+        if remaining is not None:
+            delay = min(delay, remaining)
+        return delay
+
+    def sleep(self):
+        """Sleep until the next poll, False once past the deadline. Raises
+        as soon as the op of the running thread is cancelled.
+        """
+        delay = self.next_delay()
+        if delay is None:
+            return False
+        cancel.sleep(delay)
+        return True
+
+
+class WaitHistory(object):
+    """Recent durations of waits, e.g. boot and ssh readiness, on disk.
+
+    Shared by concurrent invocations on a best effort basis, a lost
+    sample only makes the estimate a little older.
+    """
+
+    SAMPLES = 20
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def expected(self, kind):
+        """Median of the recent durations, None without history.
+        """
+        samples = sorted(self._load().get(kind, []))
+        if not samples:
+            return None
+        return samples[len(samples) // 2]
+
+    def record(self, kind, duration):
+        with self.lock:
+            data = self._load()
+            samples = data.setdefault(kind, [])
+            samples.append(round(duration, 2))
+            del samples[:-self.SAMPLES]
+            try:
+                self._save(data)
+            except (IOError, OSError):
+                logger.debug("Could not save wait history", exc_info=True)
+
+    def _load(self):
+        data = load_json(self.path)
+        return data if isinstance(data, dict) else {}
+
+    def _save(self, data):
+        dump_json(self.path, data)
+
+
+class NullHistory(object):
+    """History of a provider without a juju home, learns nothing.
+    """
+
+    def expected(self, kind):
+        return None
+
+    def record(self, kind, duration):
+        pass
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Warm pool of booted and ssh verified servers, claimed by add-machine.
+"""
+
+import logging
+import os
+import subprocess
+import sys
+import uuid
+
+from juju_scaleway.files import dump_json, ensure_dir, file_lock, load_json
+from juju_scaleway import ops
+from juju_scaleway.runner import Runner
+
+
+logger = logging.getLogger("juju.scaleway")
+
+# Members are tagged booting until ssh answers, only ready ones are claimed.
+READY_TAG = 'juju-pool'
+BOOTING_TAG = 'juju-pool-booting'
+
+
+def series_tag(series):
+    return 'series:%s' % series
+
+
+class Pool(object):
+    """Servers of an environment provisioned ahead of add-machine.
+
+    Members are named ``<env>-pool-<series>-<hex>``, a claim renames them
+    ``<env>-<hex>`` like any other machine of the environment and drops the
+    pool tags. Target sizes per series are kept under the state dir, and
+    claims serialize on a lock file so concurrent invocations never get
+    the same server.
+    """
+
+    def __init__(self, provider, env_name, state_dir, workers=None,
+                 retry=None):
+        self.provider = provider
+        self.workers = workers
+        self.retry = retry
+        self.env_name = env_name
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, 'pool-%s.json' % env_name)
+        self.lock_path = self.path + '.lock'
+
+    def prefix(self, series=None):
+        if series is None:
+            return '%s-pool-' % self.env_name
+        return '%s-pool-%s-' % (self.env_name, series)
+
+    def targets(self):
+        targets = load_json(self.path, {})
+        return targets if isinstance(targets, dict) else {}
+
+    def target(self, series):
+        return self.targets().get(series, 0)
+
+    def set_target(self, series, size):
+        with file_lock(self.lock_path):
+            targets = self.targets()
+            targets[series] = max(0, size)
+            dump_json(self.path, targets)
+
+    def members(self, series=None):
+        """Pool servers, booting ones included, streamed from the API.
+        """
+        for server in self.provider.iter_servers(
+                name_prefix=self.prefix(series)):
+            if set(server.tags or ()) & set((READY_TAG, BOOTING_TAG)):
+                yield server
+
+    def claim(self, series, count):
+        """Take up to ``count`` ready servers out of the pool.
+        """
+        claimed = []
+        if count <= 0:
+            return claimed
+        with file_lock(self.lock_path):
+            for server in self.members(series):
+                if len(claimed) == count:
+                    break
+                if (READY_TAG not in (server.tags or ()) or
+                        server.state != 'running'):
+                    continue
+                name = "%s-%s" % (self.env_name, uuid.uuid4().hex)
+                try:
+                    claimed.append(self.provider.update_server(
+                        server.id, name=name, tags=[]))
+                except Exception as exc:
+                    logger.warning(
+                        "Could not claim pool server %s: %s", server.id, exc)
+        if claimed:
+            logger.info(
+                "Claimed %d servers from the %s pool", len(claimed), series)
+        return claimed
+
+    def fill(self, series, image):
+        """Launch the servers missing to reach the target size, and wait
+        for them to boot and answer ssh.
+
+        Launches happen under the pool lock, so a concurrent fill sees the
+        booting servers and does not launch them twice. Returns the number
+        of servers added to the pool.
+        """
+        with file_lock(self.lock_path):
+            missing = self.target(series) - len(list(self.members(series)))
+            if missing <= 0:
+                return 0
+            logger.info("Launching %d %s pool servers...", missing, series)
+            launched = self.provider.launch_servers([
+                dict(name="%s%s" % (self.prefix(series), uuid.uuid4().hex),
+                     image=image, tags=[BOOTING_TAG, series_tag(series)])
+                for _ in range(missing)])
+
+        servers = []
+        for result in launched:
+            if result.error is not None:
+                logger.error(
+                    "Could not launch pool server %s: %s",
+                    result.spec['name'], result.error)
+                if result.server is not None:
+                    self.provider.terminate_server(result.server.id)
+                continue
+            servers.append(result.server)
+
+        ready, stuck = self.provider.wait_many(servers)
+        for server in stuck:
+            self.provider.terminate_server(server.id)
+
+        runner = Runner(workers=self.workers)
+        for server in ready:
+            runner.queue_op(ops.MachineAdd(
+                self.provider, None, {}, series=series, server=server,
+                retry=self.retry))
+        # Ops terminate the servers ssh never answered on.
+        added = 0
+        for result in runner.iter_results():
+            if not result.ok:
+                continue
+            server = result.value
+            self.provider.update_server(
+                server.id, tags=[READY_TAG, series_tag(series)])
+            added += 1
+        return added
+
+    def refill_in_background(self, series):
+        """Fill the pool from a detached plugin process, which outlives
+        the current command.
+        """
+        args = [sys.executable, '-m', 'juju_scaleway.cli', 'pool',
+                '-e', self.env_name, '--series', series]
+        ensure_dir(self.state_dir)
+        log_path = os.path.join(self.state_dir, 'pool-%s.log' % self.env_name)
+        with open(os.devnull, 'rb') as devnull:
+            with open(log_path, 'ab') as log:
+                subprocess.Popen(
+                    args, stdin=devnull, stdout=log, stderr=log,
+                    close_fds=True, preexec_fn=getattr(os, 'setsid', None))
+        logger.debug("Refilling the %s pool in the background", series)
+
+    def drain(self):
+        """Terminate every member, and stop refills.
+        """
+        with file_lock(self.lock_path):
+            dump_json(self.path, {})
+            servers = list(self.members())
+        for server in servers:
+            self.provider.terminate_server(server.id)
+        return servers
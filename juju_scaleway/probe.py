@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Ssh readiness probes, many hosts multiplexed on one thread.
+"""
+
+import collections
+import copy
+import errno
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+try:
+    import selectors
+except ImportError:  # Python2
+    selectors = None
+
+from juju_scaleway import cancel
+from juju_scaleway.polling import PollPolicy
+from juju_scaleway.stats import stats
+
+
+logger = logging.getLogger("juju.scaleway")
+
+# Same values as the selectors module.
+EVENT_READ = 1
+EVENT_WRITE = 2
+
+
+class BannerProbe(object):
+    """Waits for hosts to accept connections on the ssh port and send an
+    ssh banner, without spawning any process.
+
+    Connections are non-blocking and all handled by a single thread,
+    started while some hosts are pending. Each host retries on its own
+    backoff, a refused connection costs a round trip, a dropped one
+    ``CONNECT_TIMEOUT`` seconds.
+    """
+
+    CONNECT_TIMEOUT = 5.0
+    # Upper bound of the loop latency for newly registered hosts.
+    TICK = 0.5
+
+    def __init__(self, port=None, policy=None):
+        self.port = port or int(os.environ.get('JUJU_SCALEWAY_SSH_PORT', 22))
+        self.policy = policy or PollPolicy(
+            initial=1.0, factor=1.5, max_delay=5.0)
+        self.pending = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def wait(self, host, timeout, expected=None):
+        """Block until ``host`` shows an ssh banner, False on timeout.
+
+        Once refused, the next attempt waits for most of the ``expected``
+        seconds ssh usually takes to come up.
+        """
+        policy = self.policy
+        if expected:
+            policy = copy.copy(policy)
+            policy.expected = expected
+        probe = _Probe(host, self.port, policy, time.time() + timeout)
+        with self.lock:
+            self.pending.append(probe)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+        try:
+            cancel.wait(probe.done)
+        except Exception:
+            probe.deadline = 0
+            raise
+        return probe.ready
+
+    def _run(self):
+        selector = new_selector()
+        probes = []
+        try:
+            while True:
+                with self.lock:
+                    probes.extend(self.pending)
+                    del self.pending[:]
+                    if not probes:
+                        self.thread = None
+                        return
+
+                now = time.time()
+                wake = now + self.TICK
+                for probe in probes:
+                    if probe.sock is None and probe.next_attempt <= now:
+                        probe.connect(selector)
+                    if probe.sock is not None:
+                        wake = min(wake, probe.started + self.CONNECT_TIMEOUT)
+                    else:
+                        wake = min(wake, probe.next_attempt)
+
+                timeout = max(0, wake - time.time())
+                if selector.get_map():
+                    for key, _ in selector.select(timeout):
+                        key.data.on_event(selector)
+                else:
+                    time.sleep(timeout)
+
+                now = time.time()
+                for probe in probes:
+                    if (probe.sock is not None and
+                            now - probe.started >= self.CONNECT_TIMEOUT):
+                        probe.retry(selector, "timed out")
+                    if not probe.done.is_set() and now >= probe.deadline:
+                        probe.finish(selector, False)
+                probes = [probe for probe in probes if not probe.done.is_set()]
+        except Exception:
+            # Let the waiters fall back to retrying ssh itself.
+            logger.warning("Ssh probes failed", exc_info=True)
+            with self.lock:
+                probes.extend(self.pending)
+                del self.pending[:]
+                self.thread = None
+            for probe in probes:
+                probe.ready = True
+                probe.done.set()
+        finally:
+            selector.close()
+
+
+class _Probe(object):
+    """Connection attempts to one host, driven by the probe thread.
+    """
+
+    def __init__(self, host, port, policy, deadline):
+        self.host = host
+        self.port = port
+        self.deadline = deadline
+        self.poller = policy.start()
+        self.sock = None
+        self.connected = False
+        self.buffer = b''
+        self.started = None
+        self.next_attempt = 0
+        self.ready = False
+        self.done = threading.Event()
+
+    def connect(self, selector):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.connected = False
+        self.buffer = b''
+        self.started = time.time()
+        code = self.sock.connect_ex((self.host, self.port))
+        if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.sock.close()
+            self.sock = None
+            return self.retry(selector, os.strerror(code))
+        selector.register(self.sock, EVENT_WRITE, self)
+
+    def on_event(self, selector):
+        if not self.connected:
+            code = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if code:
+                return self.retry(selector, os.strerror(code))
+            self.connected = True
+            selector.modify(self.sock, EVENT_READ, self)
+            return
+
+        try:
+            data = self.sock.recv(256)
+        except socket.error as exc:
+            return self.retry(selector, str(exc))
+        if not data:
+            return self.retry(selector, "connection closed")
+        self.buffer += data
+        if not self.buffer.startswith(b'SSH-'[:len(self.buffer)]):
+            return self.retry(selector, "not an ssh banner")
+        if b'\n' in self.buffer:
+            self.finish(selector, True)
+
+    def retry(self, selector, reason):
+        self.close(selector, error=True)
+        delay = self.poller.next_delay()
+        logger.debug(
+            "Waiting for ssh on %s:%d (%s), retry in %0.1fs",
+            self.host, self.port, reason, delay)
+        self.next_attempt = time.time() + delay
+
+    def finish(self, selector, ready):
+        self.close(selector, error=not ready)
+        self.ready = ready
+        self.done.set()
+
+    def close(self, selector, error):
+        if self.sock is None:
+            return
+        stats.record_probe(
+            "ssh banner", time.time() - self.started, error=error)
+        selector.unregister(self.sock)
+        self.sock.close()
+        self.sock = None
+
+
+def new_selector():
+    if selectors is not None:
+        return selectors.DefaultSelector()
+    return SelectSelector()
+
+
+_Key = collections.namedtuple('_Key', ['fileobj', 'events', 'data'])
+
+
+class SelectSelector(object):
+    """The part of ``selectors.DefaultSelector`` the probes use, on top of
+    ``select.select``, for Python 2.
+    """
+
+    def __init__(self):
+        self.keys = {}
+
+    def register(self, fileobj, events, data=None):
+        self.keys[fileobj.fileno()] = _Key(fileobj, events, data)
+
+    def modify(self, fileobj, events, data=None):
+        self.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        del self.keys[fileobj.fileno()]
+
+    def get_map(self):
+        return self.keys
+
+    def select(self, timeout=None):
+        readers = [fd for fd, key in self.keys.items()
+                   if key.events & EVENT_READ]
+        writers = [fd for fd, key in self.keys.items()
+                   if key.events & EVENT_WRITE]
+        try:
+            readable, writable, _ = select.select(
+                readers, writers, [], timeout)
+        except (select.error, OSError) as exc:
+            if exc.args and exc.args[0] == errno.EINTR:
+                return []
+            raise
+        events = collections.defaultdict(int)
+        for fd in readable:
+            events[fd] |= EVENT_READ
+        for fd in writable:
+            events[fd] |= EVENT_WRITE
+        return [(self.keys[fd], mask) for fd, mask in events.items()]
+
+    def close(self):
+        self.keys.clear()
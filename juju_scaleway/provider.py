@@ -12,18 +12,26 @@
 
 import logging
 import os
+import threading
 import time
-import itertools
 
+from juju_scaleway import cancel
 from juju_scaleway.exceptions import ConfigError, ProviderError
-from juju_scaleway.client import Client
+from juju_scaleway.client import Client, Server
+from juju_scaleway.polling import NullHistory, PollPolicy, WaitHistory
+from juju_scaleway.probe import BannerProbe
+from juju_scaleway.ssh import ControlMasters
 
 logger = logging.getLogger("juju.scaleway")
 
 
-def factory():
+def factory(state_dir=None):
     cfg = Scaleway.get_config()
-    return Scaleway(cfg)
+    history = ssh_masters = None
+    if state_dir is not None:
+        history = WaitHistory(os.path.join(state_dir, 'waits.json'))
+        ssh_masters = ControlMasters(os.path.join(state_dir, 'ssh'))
+    return Scaleway(cfg, history=history, ssh_masters=ssh_masters)
 
 
 def validate():
@@ -32,12 +40,19 @@ def validate():
 
 class Scaleway(object):
 
-    def __init__(self, config, client=None):
+    def __init__(self, config, client=None, history=None, ssh_masters=None):
         self.config = config
+        self.history = history or NullHistory()
+        self.ssh_masters = ssh_masters
         if client is None:
-            self.client = Client(
+            client = Client(
                 config['access_key'],
-                config['secret_key'])
+                config['secret_key'],
+                api_url=config.get('api_url'))
+        self.client = client
+        self.cache = StateCache()
+        self.watcher = ServerWatcher(self)
+        self.ssh_probe = BannerProbe()
 
     @classmethod
     def get_config(cls):
@@ -51,44 +66,297 @@ class Scaleway(object):
         if secret_key:
             provider_conf['secret_key'] = secret_key
 
+        # Alternate endpoint, e.g. a local stand-in of the API.
+        api_url = os.environ.get('SCALEWAY_API_URL')
+        if api_url:
+            provider_conf['api_url'] = api_url
+
         if 'access_key' not in provider_conf or \
            'secret_key' not in provider_conf:
             raise ConfigError("Missing Scaleway api credentials")
         return provider_conf
 
-    def get_servers(self):
-        return self.client.get_servers()
+    def get_servers(self, name_prefix=None, state=None):
+        """Cached and coalesced listing, see :meth:`iter_servers` to stream
+        large ones.
+        """
+        def load():
+            generation = self.cache.generation
+            servers = list(self.iter_servers(name_prefix, state))
+            for server in servers:
+                self.cache.put(('server', server.id), server, generation)
+            return servers
+        return self.cache.get(('servers', name_prefix, state), load)
+
+    def iter_servers(self, name_prefix=None, state=None):
+        """Filters are pushed to the API query, and checked again here: the
+        API name filter is not anchored, and unsupported ones are ignored.
+        """
+        servers = self.client.iter_servers(name=name_prefix, state=state)
+        for server in servers:
+            if name_prefix and not server.name.startswith(name_prefix):
+                continue
+            if state and server.state != state:
+                continue
+            yield server
 
     def get_server(self, server_id):
-        return self.client.get_server(server_id)
+        return self.cache.get(
+            ('server', server_id),
+            lambda: self.client.get_server(server_id))
 
     def launch_server(self, params):
-        return self.client.create_server(**params)
+        try:
+            return self.client.create_server(**params)
+        finally:
+            self.cache.invalidate()
+
+    def launch_servers(self, params_list):
+        try:
+            return self.client.create_servers(params_list)
+        finally:
+            self.cache.invalidate()
+
+    def update_server(self, server_id, **fields):
+        try:
+            return self.client.update_server(server_id, **fields)
+        finally:
+            self.cache.invalidate(server_id)
 
     def terminate_server(self, server_id):
-        self.client.destroy_server(server_id)
+        try:
+            self.client.destroy_server(server_id)
+        finally:
+            self.cache.invalidate(server_id)
+
+    def poweron_server(self, server_id):
+        try:
+            self.client.poweron_server(server_id)
+        finally:
+            self.cache.invalidate(server_id)
+
+    def poweroff_server(self, server_id):
+        try:
+            self.client.poweroff_server(server_id)
+        finally:
+            self.cache.invalidate(server_id)
+
+    def find_server(self, name):
+        """Server of that exact name, None if there is none.
+        """
+        for server in self.iter_servers(name_prefix=name):
+            if server.name == name:
+                return server
+        return None
+
+    def delete_server(self, server):
+        """Remove a stopped server along with its volumes.
+        """
+        try:
+            self.client.delete_server(server.id)
+        finally:
+            self.cache.invalidate(server.id)
+        for volume in (getattr(server, 'volumes', None) or {}).values():
+            self.client.delete_volume(volume['id'])
 
     def wait_on(self, server):
-        # Wait up to 5 minutes, in 30 sec increments
-        print(server.name)
-        result = self._wait_on_server(server, 30, 10)
-        if not result:
+        """Wait for a server to run, return its refreshed state.
+        """
+        ready, _ = self.wait_many([server])
+        if not ready:
             raise ProviderError("Could not provision server before timeout")
-        return result
-
-    def _wait_on_server(self, server, limit, delay=10):
-        # Redo cci.wait to give user feedback in verbose mode.
-        for count, new_server in enumerate(itertools.repeat(server.id)):
-            server = self.get_server(new_server)
-            if server.state == 'running':
-                return True
-            if count >= limit:
-                return False
-            if count and count % 3 == 0:
-                logger.debug(
-                    "Waiting for server:%s ip:%s waited:%ds",
-                    server.name,
-                    server.public_ip['address'] if server.public_ip else None,
-                    count * delay
-                )
-            time.sleep(delay)
+        return ready[0]
+
+    def wait_many(self, servers, timeout=None, state='running'):
+        """Wait for servers, or server ids, to reach a state, by default to
+        run.
+
+        Returns the list of servers in that state, and the list of servers
+        which did not reach it before the timeout.
+        """
+        return self.watcher.wait_many(
+            servers, timeout or ServerWatcher.DEFAULT_TIMEOUT, state)
+
+
+class ServerWatcher(object):
+    """Refreshes every server being waited on with one listing per tick.
+
+    Waiters, usually runner threads, register their servers and block until
+    these are running or timed out. A single polling thread runs as long as
+    some servers are pending.
+    """
+
+    DEFAULT_TIMEOUT = 300
+
+    def __init__(self, provider, policy=None):
+        self.provider = provider
+        self.policy = policy or PollPolicy(
+            initial=2.0, factor=1.5, max_delay=15.0)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def watch(self, server, timeout, state='running'):
+        if not isinstance(server, Server):
+            server = Server.from_dict({'id': server})
+        waiter = _Waiter(server, time.time() + timeout, state)
+        with self.lock:
+            self.pending[server.id] = waiter
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+        return waiter
+
+    def wait_many(self, servers, timeout, state='running'):
+        waiters = [self.watch(server, timeout, state) for server in servers]
+        try:
+            for waiter in waiters:
+                cancel.wait(waiter.done)
+        except Exception:
+            # Let the polling thread drop the servers on its next tick.
+            for waiter in waiters:
+                waiter.deadline = 0
+            raise
+
+        ready = [waiter.server for waiter in waiters if waiter.ready]
+        stuck = [waiter.server for waiter in waiters if not waiter.ready]
+        if stuck:
+            logger.warning(
+                "Servers not %s after %ds: %s", state, timeout,
+                " ".join("%s(%s)" % (server.id, server.state)
+                         for server in stuck))
+        return ready, stuck
+
+    def _run(self):
+        self.policy.expected = self.provider.history.expected('boot')
+        poller = self.policy.start()
+        while True:
+            with self.lock:
+                waiters = dict(self.pending)
+
+            try:
+                servers = self._refresh(waiters)
+            except Exception:
+                logger.warning("Could not refresh servers", exc_info=True)
+                servers = {}
+
+            now = time.time()
+            with self.lock:
+                for server_id, waiter in waiters.items():
+                    server = servers.get(server_id)
+                    if server is not None:
+                        waiter.server = server
+                        waiter.ready = server.state == waiter.state
+                    if waiter.ready and waiter.state == 'running':
+                        self.provider.history.record(
+                            'boot', now - waiter.registered)
+                    if waiter.ready or now >= waiter.deadline:
+                        del self.pending[server_id]
+                        waiter.done.set()
+                if not self.pending:
+                    self.thread = None
+                    return
+                pending = len(self.pending)
+
+            logger.debug(
+                "Waiting for %d servers, waited:%ds",
+                pending, poller.elapsed)
+            poller.sleep()
+
+    def _refresh(self, waiters):
+        if len(waiters) == 1:
+            server = self.provider.get_server(list(waiters)[0])
+            return {server.id: server}
+        # Narrow the listing down to the servers being waited on.
+        prefix = os.path.commonprefix(
+            [waiter.server.name or '' for waiter in waiters.values()])
+        return dict(
+            (server.id, server)
+            for server in self.provider.get_servers(name_prefix=prefix)
+            if server.id in waiters)
+
+
+class StateCache(object):
+    """Short lived cache of server reads, with single-flight loading.
+
+    Threads missing the same key while it is being loaded wait for that
+    load instead of issuing their own request. Writes invalidate entries,
+    and results of loads overlapping a write are not kept.
+    """
+
+    DEFAULT_TTL = 1.0
+
+    def __init__(self, ttl=None):
+        self.ttl = self.DEFAULT_TTL if ttl is None else ttl
+        self.entries = {}
+        self.inflight = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = _Flight(self.generation)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+                if (flight.error is None and
+                        flight.generation == self.generation):
+                    self.entries[key] = (time.time() + self.ttl, flight.value)
+            flight.done.set()
+        return flight.value
+
+    def put(self, key, value, generation):
+        """Store a value read at the given generation, unless a write
+        happened since.
+        """
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = (time.time() + self.ttl, value)
+
+    def invalidate(self, server_id=None):
+        """Drop listings, and the given server, or all servers.
+        """
+        with self.lock:
+            self.generation += 1
+            for key in list(self.entries):
+                if key[0] == 'servers' or server_id in (None, key[1]):
+                    del self.entries[key]
+
+
+class _Flight(object):
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.value = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Waiter(object):
+
+    def __init__(self, server, deadline, state):
+        self.server = server
+        self.state = state
+        self.registered = time.time()
+        self.deadline = deadline
+        self.ready = False
+        self.done = threading.Event()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Client side scheduling of API requests, to stay under the API rate limit.
+"""
+
+import email.utils
+import heapq
+import itertools
+import threading
+import time
+
+
+# Mutating calls (create, poweron, terminate) go before status polling.
+HIGH = 0
+LOW = 1
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, in seconds or HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+class RateLimiter(object):
+    """Token bucket shared by all the threads of a client.
+
+    Callers block in :meth:`acquire` until a token is available, and are
+    served by priority first, then in arrival order. The bucket is drained
+    by the rate limit headers of responses and by throttled responses.
+    """
+
+    DEFAULT_RATE = 20.0
+    DEFAULT_BURST = 20
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate or self.DEFAULT_RATE
+        self.burst = burst or self.DEFAULT_BURST
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    def acquire(self, priority=LOW):
+        with self._cond:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.time()
+                    self._refill(now)
+                    if self._waiters[0] != ticket:
+                        # Woken up when the head of the queue moves.
+                        self._cond.wait()
+                        continue
+                    if now < self.blocked_until:
+                        self._cond.wait(self.blocked_until - now)
+                    elif self.tokens < 1:
+                        self._cond.wait((1 - self.tokens) / self.rate)
+                    else:
+                        self.tokens -= 1
+                        return
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def reserve(self, priority=LOW):
+        """Take a token without blocking, for event loops. Returns 0, or the
+        seconds to wait before trying again. Threads blocked in
+        :meth:`acquire` are served first.
+        """
+        with self._cond:
+            now = time.time()
+            self._refill(now)
+            if self._waiters and self._waiters[0][0] <= priority:
+                return 1.0 / self.rate
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            return 0
+
+    def update(self, headers):
+        """Sync the bucket with the X-RateLimit-* headers of a response.
+        """
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None:
+            return
+        with self._cond:
+            try:
+                self.tokens = min(self.tokens, float(remaining))
+                if self.tokens < 1 and reset is not None:
+                    reset = float(reset)
+                    # Either a delay or an epoch timestamp.
+                    if reset < 10 ** 9:
+                        reset += time.time()
+                    self.blocked_until = max(self.blocked_until, reset)
+            except ValueError:
+                return
+            self._cond.notify_all()
+
+    def backoff(self, delay):
+        """Stop handing out tokens for ``delay`` seconds.
+        """
+        with self._cond:
+            self.tokens = 0.0
+            self.updated = time.time()
+            self.blocked_until = max(
+                self.blocked_until, self.updated + delay)
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        # Nothing accrues while blocked, do not burst right after a backoff.
+        since = max(self.updated, min(self.blocked_until, now))
+        self.tokens = min(
+            float(self.burst),
+            self.tokens + (now - since) * self.rate)
+        self.updated = now
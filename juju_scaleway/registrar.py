@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Registration of many manual machines with juju at once.
+"""
+
+import logging
+import threading
+import time
+import uuid
+
+try:
+    from Queue import Queue
+except ImportError:  # Python3
+    from queue import Queue
+
+from juju_scaleway import cancel
+from juju_scaleway import ssh
+from juju_scaleway.exceptions import JujuAPIError
+from juju_scaleway.runner import Autoscaler, Runner, Workers
+
+
+logger = logging.getLogger("juju.scaleway")
+
+
+class Registrar(object):
+    """Aggregates the hosts handed over by machine ops into batches.
+
+    Over the juju API, a batch is recorded in the environment with a single
+    call, then each host runs its provisioning script over its ssh master
+    connection. Without the API, each host gets its own ``juju add-machine``
+    process. Either way, at most ``workers`` hosts are provisioned at once,
+    a number adapted to the load with ``'auto'``.
+
+    A batch closes once ``BATCH_SIZE`` hosts are waiting, or ``WINDOW``
+    seconds after its first one.
+
+    Hosts are provisioned within the :class:`cancel.Scope` of the op that
+    registers them, which kills their processes when it is cancelled. The
+    hosts of cancelled ops are dropped, and removed from juju if already
+    recorded.
+    """
+
+    BATCH_SIZE = 32
+    WINDOW = 0.5
+
+    def __init__(self, env, masters=None, workers=None):
+        self.env = env
+        self.masters = masters
+        self.autoscaler = None
+        if workers == 'auto':
+            self.autoscaler = Autoscaler(Runner.MAX_NUM_RUNNER)
+        self.num_workers = Runner.DEFAULT_NUM_RUNNER
+        if workers not in (None, 'auto'):
+            self.num_workers = workers
+        self.pending = []
+        self.cond = threading.Condition()
+        self.thread = None
+        self.jobs = Queue()
+        self.workers = Workers(self.jobs, self._provision)
+
+    def register(self, host, series, key=None):
+        """Block until the host is a juju machine, returns its id.
+        """
+        registration = _Registration(host, series, key, cancel.current())
+        # Custom keys are only handled by the juju CLI.
+        registration.via_api = self.env.api() is not None and not key
+        if registration.via_api:
+            # Before queueing, on the ssh master of the calling op.
+            registration.hardware = ssh.detect_hardware(
+                host, masters=self.masters)
+        with self.cond:
+            self.pending.append(registration)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+
+        cancel.wait(registration.done)
+        if registration.error is not None:
+            raise registration.error
+        return registration.machine_id
+
+    def close(self):
+        self.workers.stop()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.pending:
+                    self.thread = None
+                    return
+                closes = self.pending[0].queued + self.WINDOW
+                while (len(self.pending) < self.BATCH_SIZE and
+                       time.time() < closes):
+                    self.cond.wait(closes - time.time())
+                batch = self.pending[:self.BATCH_SIZE]
+                del self.pending[:self.BATCH_SIZE]
+            batch = [
+                registration for registration in batch
+                if not registration.dropped()]
+            if not batch:
+                continue
+
+            if not self.workers.target:
+                self.workers.resize(self.num_workers)
+            elif self.autoscaler is not None:
+                self.autoscaler.apply(self.workers, self.jobs.qsize())
+            try:
+                self._record(batch)
+            except Exception as exc:
+                logger.warning("Could not record machines: %s", exc)
+                for registration in batch:
+                    registration.finish(error=exc)
+                continue
+            for registration in batch:
+                self.jobs.put(registration)
+
+    def _record(self, batch):
+        """Add the machines of the batch to the environment state, in one
+        API call, when they can be provisioned through the API.
+
+        Only the machines juju returns an error for fail. When the call
+        itself fails, the juju CLI registers the whole batch instead.
+        """
+        api = self.env.api()
+        batch = [
+            registration for registration in batch
+            if registration.via_api]
+        if api is None or not batch:
+            return
+        logger.debug("Recording %d machines with juju", len(batch))
+        try:
+            results = api.add_machines([
+                registration.machine_params() for registration in batch])
+        except JujuAPIError as exc:
+            self.env.api_failed(exc)
+            for registration in batch:
+                registration.via_api = False
+            return
+        for index, registration in enumerate(batch):
+            if index >= len(results):
+                registration.error = JujuAPIError(
+                    "No result for machine %s" % registration.host)
+            elif isinstance(results[index], Exception):
+                registration.error = results[index]
+            else:
+                registration.machine_id = results[index]
+
+    def _provision(self, registration):
+        if registration.dropped():
+            if registration.machine_id is not None:
+                self._forget(registration.machine_id)
+            return
+        try:
+            with cancel.within(registration.scope):
+                if registration.machine_id is None:
+                    registration.machine_id = self.env.add_machine(
+                        "ssh:root@%s" % registration.host,
+                        key=registration.key)
+                else:
+                    script = self.env.api().provisioning_script(
+                        registration.machine_id, registration.nonce)
+                    ssh.provision_machine(
+                        registration.host, script,
+                        self.env.authorized_keys(), masters=self.masters)
+                # The op may have given up on the machine meanwhile.
+                cancel.check()
+        except Exception as exc:
+            if registration.machine_id is not None:
+                self._forget(registration.machine_id)
+            return registration.finish(error=exc)
+        registration.finish()
+
+    def _forget(self, machine_id):
+        try:
+            self.env.terminate_machines([machine_id])
+        except Exception:
+            logger.warning(
+                "Could not remove juju machine %s", machine_id,
+                exc_info=True)
+
+
+class _Registration(object):
+
+    def __init__(self, host, series, key, scope=None):
+        self.host = host
+        self.series = series
+        self.key = key
+        self.scope = scope
+        self.via_api = False
+        self.hardware = None
+        self.queued = time.time()
+        self.nonce = "manual:%s:%s" % (host, uuid.uuid4())
+        self.machine_id = None
+        self.error = None
+        self.done = threading.Event()
+
+    def machine_params(self):
+        return {
+            'Series': self.series,
+            'Jobs': ['JobHostUnits'],
+            'InstanceId': 'manual:%s' % self.host,
+            'Nonce': self.nonce,
+            'HardwareCharacteristics': self.hardware or None,
+            'Addrs': [{'Value': self.host, 'Type': 'ipv4',
+                       'NetworkScope': 'public'}],
+        }
+
+    def dropped(self):
+        """Finish the registration if its op was cancelled, or failed to
+        be recorded, returns whether it did.
+        """
+        if self.error is None and self.scope is not None:
+            try:
+                self.scope.check()
+            except Exception as exc:
+                self.error = exc
+        if self.error is None:
+            return False
+        self.finish()
+        return True
+
+    def finish(self, error=None):
+        if error is not None:
+            self.error = error
+        self.done.set()
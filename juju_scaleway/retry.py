@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Retries of failed machine op stages, by kind of error.
+"""
+
+import os
+import re
+import subprocess
+
+import requests
+
+from juju_scaleway import cancel
+from juju_scaleway.exceptions import (
+    JujuAPIError, ProviderAPIError, TimeoutError)
+from juju_scaleway.polling import PollPolicy
+
+
+# Kinds of errors worth retrying.
+API = 'api'
+SSH = 'ssh'
+JUJU = 'juju'
+
+# Error codes of the juju API for conditions which may clear up, other
+# codes are permanent.
+JUJU_TRANSIENT_CODES = (
+    'try again', 'excessive contention', 'upgrade in progress')
+# Uncoded juju API errors a retry would not fix, e.g. no such series.
+JUJU_PERMANENT_RE = re.compile(
+    r'no such|not found|not valid|invalid|unknown|not supported|'
+    r'not implemented|unauthorized|already exists|permission denied',
+    re.IGNORECASE)
+
+
+def classify(exc):
+    """Kind of a transient error, None for errors a retry would not fix.
+    """
+    scope = cancel.current()
+    if scope is not None and scope.reason is not None:
+        # Out of time or interrupted, not a failure of the op itself.
+        return None
+    if isinstance(exc, ProviderAPIError):
+        status = getattr(exc.response, 'status_code', None)
+        if status is None or status >= 500 or status == 429:
+            return API
+        return None
+    if isinstance(exc, requests.RequestException):
+        return API
+    if isinstance(exc, JujuAPIError):
+        return _classify_juju(exc)
+    if isinstance(exc, subprocess.CalledProcessError):
+        command = exc.cmd[0] if exc.cmd else ''
+        if os.path.basename(command) == 'juju':
+            return JUJU
+        return SSH
+    if isinstance(exc, TimeoutError):
+        return SSH
+    return None
+
+
+def _classify_juju(exc):
+    """Lost connections, where the juju CLI takes over, and transient call
+    errors are retried.
+    """
+    if exc.code:
+        return JUJU if exc.code in JUJU_TRANSIENT_CODES else None
+    if JUJU_PERMANENT_RE.search(str(exc)):
+        return None
+    return JUJU
+
+
+class RetryPolicy(object):
+    """Retries allowed per kind of error, with backoff between attempts.
+    """
+
+    def __init__(self, api=3, ssh=1, juju=2, backoff=None):
+        self.limits = {API: api, SSH: ssh, JUJU: juju}
+        self.backoff = backoff or PollPolicy(
+            initial=2.0, factor=2.0, max_delay=30.0)
+
+    @classmethod
+    def uniform(cls, count):
+        return cls(api=count, ssh=count, juju=count)
+
+    def start(self):
+        return Retries(self)
+
+
+class Retries(object):
+    """Retries left to one op.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.used = dict((kind, 0) for kind in policy.limits)
+        self.poller = policy.backoff.start()
+
+    def allow(self, exc):
+        """Kind of ``exc`` if it may be retried, counting the attempt.
+        """
+        kind = classify(exc)
+        if kind is None or self.used[kind] >= self.policy.limits[kind]:
+            return None
+        self.used[kind] += 1
+        return kind
+
+    def sleep(self):
+        self.poller.sleep()
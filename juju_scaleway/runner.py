@@ -11,88 +11,528 @@
 # License at http://opensource.org/licenses/BSD-2-Clause
 
 """
-Thread based concurrency around bulk ops. scaleway api is sync
+Thread based concurrency around bulk ops. scaleway api is sync, see
+juju_scaleway.aio for the event loop based alternative.
+
+A Runner runs whole ops on a few threads, a Pipeline runs ops made of
+stages with a pool of threads per stage. Both yield an OpResult per op,
+bound each op to its time limit and cancel the ops left on Ctrl-C.
 """
 
 import logging
+import multiprocessing
+import os
 
 try:
     from Queue import Queue, Empty
 except ImportError:  # Python3
     from queue import Queue, Empty
 
+import sys
 import threading
+import time
+
+from juju_scaleway import cancel
+from juju_scaleway.exceptions import OpCancelled, TimeoutError
+from juju_scaleway.stats import stats
 
 
 logger = logging.getLogger("juju.scaleway")
 
 
-class Runner(object):
+class OpResult(object):
+    """Outcome of an op, its return value or the error it failed with.
+    """
 
-    DEFAULT_NUM_RUNNER = 4
+    OK = 'ok'
+    FAILED = 'failed'
+    TIMEOUT = 'timeout'
+    CANCELLED = 'cancelled'
 
-    def __init__(self):
-        self.jobs = Queue()
+    def __init__(self, op, value=None, error=None, started=None,
+                 finished=None):
+        self.op = op
+        self.value = value
+        self.error = error
+        self.started = started
+        self.finished = finished or time.time()
+
+    @property
+    def status(self):
+        if self.error is None:
+            return self.OK
+        if isinstance(self.error, OpCancelled):
+            return self.CANCELLED
+        if isinstance(self.error, TimeoutError):
+            return self.TIMEOUT
+        return self.FAILED
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return 0.0
+        return self.finished - self.started
+
+    def __repr__(self):
+        return "<OpResult %r %s %0.1fs>" % (
+            self.op, self.status, self.duration)
+
+
+class Progress(object):
+    """Done, running and failed counts of a run, with the time left at the
+    current rate, and the ops queued in front of each stage of pipelines.
+
+    Rewritten in place on terminals, logged every ``LOG_INTERVAL`` seconds
+    otherwise.
+    """
+
+    LOG_INTERVAL = 10
+
+    def __init__(self, label, total, stream=None):
+        self.label = label
+        self.total = total
+        self.stream = stream or sys.stderr
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.started = time.time()
+        self.logged = self.started
+        self.done = self.failed = self.running = 0
+        self.depths = None
+
+    def update(self, done, failed, running, depths=None):
+        self.done, self.failed, self.running = done, failed, running
+        self.depths = depths
+        if self.tty:
+            self.stream.write("\r%s\x1b[K" % self.line())
+            self.stream.flush()
+        elif time.time() - self.logged >= self.LOG_INTERVAL:
+            self.logged = time.time()
+            logger.info(self.line())
+
+    def line(self):
+        finished = self.done + self.failed
+        eta = "?"
+        if finished:
+            left = (time.time() - self.started) / finished * (
+                self.total - finished)
+            eta = "%d:%02d" % divmod(int(left), 60)
+        line = "%s: %d/%d done, %d running, %d failed, ETA %s" % (
+            self.label, self.done, self.total, self.running, self.failed,
+            eta)
+        if self.depths:
+            line += ", queued %s" % " ".join(
+                "%s:%d" % depth for depth in self.depths)
+        return line
+
+    def close(self):
+        if self.tty:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+class BaseRunner(object):
+    """Results, time limits, cancellation and progress of a run.
+
+    Subclasses start and stop the threads running ops, and keep the
+    :class:`cancel.Scope` of each op queued or running in ``scopes``.
+    """
+
+    # Seconds between two checks of time limits and worker counts.
+    TICK_INTERVAL = 0.5
+
+    def __init__(self, timeout=None, progress=None):
+        """``timeout`` overrides the ``time_limit`` of ops, in seconds.
+        ``progress`` labels a live progress line, none is shown without.
+        """
+        self.timeout = timeout
+        self.progress = progress
         self.results = Queue()
         self.job_count = 0
-        self.runners = []
-        self.started = False
+        self.scopes = {}
+        self.lock = threading.Lock()
+        self.ticked = time.time()
 
-    def queue_op(self, operation):
-        self.jobs.put(operation)
-        self.job_count += 1
+    def time_limit(self, operation):
+        if self.timeout is not None:
+            return self.timeout
+        return getattr(operation, 'time_limit', None)
+
+    def add_scope(self, operation):
+        scope = cancel.Scope(repr(operation), self.time_limit(operation))
+        with self.lock:
+            self.scopes[operation] = scope
+        return scope
+
+    def complete(self, operation, value=None, error=None):
+        with self.lock:
+            scope = self.scopes.pop(operation, None)
+        result = OpResult(
+            operation, value, error,
+            started=scope.started if scope is not None else None)
+        if result.status == OpResult.FAILED:
+            logger.error(
+                "Op %r failed: %s", operation, error,
+                exc_info=logger.isEnabledFor(logging.DEBUG))
+        elif error is not None:
+            logger.warning("Op %r %s: %s", operation, result.status, error)
+        self.results.put(result)
 
     def iter_results(self):
-        auto = not self.started
+        """Start the run unless started, and yield an OpResult per op as
+        they complete.
+        """
+        progress = None
+        if self.progress is not None:
+            progress = Progress(self.progress, self.job_count)
+        done = failed = 0
+        self.start()
+        try:
+            while self.job_count:
+                result = self.gather_result(progress, done, failed)
+                self.job_count -= 1
+                if result.ok:
+                    done += 1
+                else:
+                    failed += 1
+                if progress is not None:
+                    progress.update(
+                        done, failed, self.running(), self.depths())
+                yield result
+        except KeyboardInterrupt:
+            logger.warning("Interrupted, cancelling %d ops", self.job_count)
+            self.cancel()
+            raise
+        finally:
+            self.stop()
+            if progress is not None:
+                progress.close()
 
-        if auto:
-            self.start(min(self.DEFAULT_NUM_RUNNER, self.job_count))
+    def gather_result(self, progress=None, done=0, failed=0):
+        # Wait in slices, to stay interruptible. Ticks also happen while
+        # results keep coming, or time limits would go unchecked.
+        while True:
+            try:
+                return self.results.get(timeout=self.TICK_INTERVAL)
+            except Empty:
+                if progress is not None:
+                    progress.update(
+                        done, failed, self.running(), self.depths())
+            finally:
+                now = time.time()
+                if now - self.ticked >= self.TICK_INTERVAL:
+                    self.ticked = now
+                    self.tick()
 
-        for _ in range(self.job_count):
-            self.job_count -= 1
-            result = self.gather_result()
-            if isinstance(result, Exception):
-                continue
-            yield result
+    def tick(self):
+        now = time.time()
+        with self.lock:
+            expired = [
+                scope for scope in self.scopes.values()
+                if scope.expired(now)]
+        for scope in expired:
+            logger.debug("%s ran out of time, cancelling", scope.name)
+            scope.cancel(cancel.Scope.TIMEOUT)
 
-        if auto:
-            self.stop()
+    def depths(self):
+        """Ops queued per stage, as (name, count) pairs, None if unstaged.
+        """
+        return None
+
+    def running(self):
+        with self.lock:
+            return sum(
+                1 for scope in self.scopes.values()
+                if scope.started is not None)
+
+    def cancel(self):
+        """Interrupt running ops, which clean up after themselves, and
+        drop queued ones.
+        """
+        with self.lock:
+            scopes = list(self.scopes.values())
+        for scope in scopes:
+            scope.cancel()
 
-    def gather_result(self):
-        return self.results.get()
+    def start(self):
+        raise NotImplementedError()
+
+    def stop(self):
+        raise NotImplementedError()
+
+
+class Runner(BaseRunner):
+
+    DEFAULT_NUM_RUNNER = 4
+    # Bound of adaptive runs, as many as pooled API connections.
+    MAX_NUM_RUNNER = 16
+
+    def __init__(self, workers=None, timeout=None, progress=None):
+        """``workers`` is a number of threads, or ``'auto'`` to adapt it to
+        the load, starting from the default.
+        """
+        super(Runner, self).__init__(timeout, progress)
+        self.jobs = Queue()
+        self.workers = Workers(self.jobs, self._run_op)
+        self.autoscaler = None
+        if workers == 'auto':
+            self.autoscaler = Autoscaler(self.MAX_NUM_RUNNER)
+        self.num_workers = self.DEFAULT_NUM_RUNNER
+        if workers not in (None, 'auto'):
+            self.num_workers = workers
+        self.started = False
+
+    def queue_op(self, operation):
+        self.add_scope(operation)
+        self.jobs.put(operation)
+        self.job_count += 1
 
-    def start(self, count):
-        for _ in range(count):
-            runner = OpRunner(self.jobs, self.results)
-            runner.daemon = True
-            self.runners.append(runner)
-            runner.start()
+    def start(self, count=None):
+        if self.started:
+            return
+        if count is None:
+            count = min(self.num_workers, self.job_count)
+        self.workers.resize(count)
         self.started = True
 
     def stop(self):
-        for runner in self.runners:
-            runner.join()
+        self.workers.stop()
         self.started = False
 
+    def tick(self):
+        super(Runner, self).tick()
+        if self.autoscaler is not None:
+            self.autoscaler.apply(self.workers, self.jobs.qsize())
+
+    def cancel(self):
+        super(Runner, self).cancel()
+        while True:
+            try:
+                operation = self.jobs.get(block=False)
+            except Empty:
+                break
+            self.complete(operation, error=OpCancelled("never started"))
+
+    def _run_op(self, operation):
+        scope = self.scopes[operation]
+        try:
+            with scope.active():
+                value = operation.run()
+        except Exception as exc:
+            return self.complete(operation, error=exc)
+        self.complete(operation, value)
 
-class OpRunner(threading.Thread):
 
-    def __init__(self, ops, results):
-        self.ops = ops
-        self.results = results
-        super(OpRunner, self).__init__()
+class Workers(object):
+    """Threads handling the jobs of a queue, until stopped.
+
+    Their number may change while they run, extra threads retire once done
+    with their current job.
+    """
+
+    # Seconds an idle thread waits for a job before checking for retirement.
+    IDLE_CHECK = 0.5
+
+    def __init__(self, jobs, handle):
+        self.jobs = jobs
+        self.handle = handle
+        self.target = 0
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def resize(self, count):
+        with self.lock:
+            self.target = max(0, count)
+            while len(self.threads) < self.target:
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                self.threads.append(thread)
+                thread.start()
+
+    def stop(self):
+        """Let running jobs finish, then end all threads.
+        """
+        with self.lock:
+            self.target = 0
+            threads = list(self.threads)
+        for thread in threads:
+            thread.join()
 
-    def run(self):
-        while 1:
+    def _run(self):
+        current = threading.current_thread()
+        while True:
+            with self.lock:
+                if len(self.threads) > self.target:
+                    self.threads.remove(current)
+                    return
             try:
-                operation = self.ops.get(block=False)
+                job = self.jobs.get(timeout=self.IDLE_CHECK)
             except Empty:
-                return
+                continue
+            self.handle(job)
+
+
+class Autoscaler(object):
+    """Adapts a number of workers to the load seen since the last check.
+
+    One more worker while jobs are queued and all is well, half as many
+    when the API throttles, when API calls or subprocesses get twice as
+    slow as the best seen so far, or when the machine is overloaded.
+    """
+
+    INTERVAL = 2.0
+    SLOWDOWN = 2.0
+    # Calls in a window before its mean latency is trusted.
+    MIN_SAMPLES = 5
+
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.last = stats.snapshot()
+        self.checked = time.time()
+        self.baselines = {}
+
+    def apply(self, workers, backlog):
+        size = self.adjust(workers.target, backlog)
+        if size != workers.target:
+            logger.debug(
+                "Resizing workers from %d to %d, %d queued",
+                workers.target, size, backlog)
+            workers.resize(size)
+
+    def adjust(self, current, backlog):
+        now = time.time()
+        if now - self.checked < self.INTERVAL:
+            return current
+        snapshot = stats.snapshot()
+        last, self.last, self.checked = self.last, snapshot, now
+
+        shrunk = max(self.minimum, current // 2)
+        if snapshot['throttles'] > last['throttles']:
+            return shrunk
+        for kind, count_key in (('request', 'requests'),
+                                ('subprocess', 'subprocesses')):
+            count = snapshot[count_key] - last[count_key]
+            if count < self.MIN_SAMPLES:
+                continue
+            latency = (
+                snapshot[kind + '_time'] - last[kind + '_time']) / count
+            baseline = min(self.baselines.get(kind, latency), latency)
+            self.baselines[kind] = baseline
+            if latency > self.SLOWDOWN * baseline:
+                return shrunk
+
+        load = cpu_load()
+        if load > 2:
+            return shrunk
+        if backlog and load < 1:
+            return min(self.maximum, current + 1)
+        return current
+
+
+def cpu_load():
+    """Load average per cpu, 0 where unknown.
+    """
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return 0
+    try:
+        return load / multiprocessing.cpu_count()
+    except NotImplementedError:
+        return load
+
+
+class Pipeline(BaseRunner):
+    """Runs staged ops, each stage on its own bounded pool of threads.
+
+    An op lists its ``stages``, names passed in order to its ``run_stage``,
+    and returns its result from ``finish``, ``abort`` is called when a stage
+    raises or the op is cancelled in between. Ops move to the queue of the
+    next stage as soon as one stage is done, so a slow stage only holds
+    back its own workers, and the throughput is the one of the slowest
+    stage. Stage queues are bounded, a stage blocks once the next one is
+    that far behind.
+
+    Time spent in each stage, queued before it and blocked on the next
+    queue is recorded in the ``stages`` section of the stats.
+    """
+
+    # Queued ops per worker of the next stage, before handing over blocks.
+    QUEUE_FACTOR = 2
+
+    def __init__(self, stages, timeout=None, progress=None):
+        """``stages`` is a list of (name, workers) pairs.
+        """
+        super(Pipeline, self).__init__(timeout, progress)
+        self.stages = [(name, max(1, workers)) for name, workers in stages]
+        self.queues = [Queue()] + [
+            Queue(maxsize=workers * self.QUEUE_FACTOR)
+            for _, workers in self.stages[1:]]
+        self.workers = [
+            Workers(queue, self._stage_handler(index))
+            for index, queue in enumerate(self.queues)]
+
+    def queue_op(self, operation):
+        self.add_scope(operation)
+        self.queues[0].put((operation, time.time()))
+        self.job_count += 1
+
+    def depths(self):
+        return [
+            (name, queue.qsize())
+            for (name, _), queue in zip(self.stages, self.queues)]
+
+    def start(self):
+        for (_, count), workers in zip(self.stages, self.workers):
+            workers.resize(count)
+
+    def stop(self):
+        for workers in self.workers:
+            workers.stop()
+        # Ops handed over to a stage stopped in the meantime, on cancel.
+        self._abort_queued()
+
+    def cancel(self):
+        super(Pipeline, self).cancel()
+        self._abort_queued()
+
+    def _abort_queued(self):
+        for queue in self.queues:
+            while True:
+                try:
+                    operation, _ = queue.get(block=False)
+                except Empty:
+                    break
+                operation.abort()
+                self.complete(operation, error=OpCancelled("interrupted"))
+
+    def _stage_handler(self, index):
+        name = self.stages[index][0]
+        last = index == len(self.stages) - 1
+
+        def handle(job):
+            operation, queued = job
+            start = time.time()
+            stats.record_stage("%s queued" % name, start - queued)
 
             try:
-                result = operation.run()
+                with self.scopes[operation].active():
+                    operation.run_stage(name)
+                    result = operation.finish() if last else None
             except Exception as exc:
-                logger.exception("Error while processing op %s", operation)
-                result = exc
+                stats.record_stage(name, time.time() - start, error=True)
+                operation.abort()
+                self.complete(operation, error=exc)
+                return
 
-            self.results.put(result)
+            done = time.time()
+            stats.record_stage(name, done - start)
+            if last:
+                self.complete(operation, result)
+                return
+            self.queues[index + 1].put((operation, done))
+            stats.record_stage("%s blocked" % name, time.time() - done)
+        return handle
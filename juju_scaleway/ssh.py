@@ -10,33 +10,217 @@
 # file except in compliance with the License. You may obtain a copy of the
 # License at http://opensource.org/licenses/BSD-2-Clause
 
+import logging
+import os
 import subprocess
+import tempfile
+
+try:
+    from shlex import quote
+except ImportError:  # Python2
+    from pipes import quote
+
+from juju_scaleway import cancel
+from juju_scaleway.files import ensure_dir, write_atomic
+from juju_scaleway.stats import stats
+
+
+logger = logging.getLogger("juju.scaleway")
 
 # juju-core will defer to either ssh or go.crypto/ssh impl
 # these options are only for the ssh ops below (availability
 # check and apt-get update on precise instances).
-SSH_CMD = ("/usr/bin/ssh",
+SSH_CMD = (os.environ.get("JUJU_SCALEWAY_SSH", "/usr/bin/ssh"),
            "-o", "StrictHostKeyChecking=no",
            "-o", "UserKnownHostsFile=/dev/null")
 
 
-def check_ssh(host, user="root"):
-    cmd = list(SSH_CMD) + ["%s@%s" % (user, host), "ls"]
-    process = subprocess.Popen(
-        args=cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+class ControlMasters(object):
+    """Per host master connections, shared by the ssh invocations of an op.
 
-    output, err = process.communicate()
-    retcode = process.poll()
+    The first ssh to a host authenticates and leaves a master in the
+    background, listening on a socket under ``directory``. Later ssh calls
+    to that host, including the ones of juju through the wrapper prepended
+    to its PATH, run over it without a new handshake. Ops close the master
+    once done, ``PERSIST`` only bounds the life of forgotten ones.
+    """
 
-    if retcode:
-        raise subprocess.CalledProcessError(
-            retcode, cmd, '%s%s' % (output, err or '')
-        )
+    PERSIST = 120
+    # Unix socket paths are limited to about a hundred bytes.
+    MAX_PATH = 100
+    WRAPPER = """#!/bin/sh
+# Generated by juju-scaleway, reuses its ssh master connections.
+exec %s -o ControlMaster=auto -o ControlPath=%s -o ControlPersist=%d "$@"
+"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.bin_dir = os.path.join(directory, 'bin')
+
+    @property
+    def enabled(self):
+        return len(self.path('255.255.255.255')) <= self.MAX_PATH
+
+    def path(self, host, user="root"):
+        return os.path.join(self.directory, "%s@%s" % (user, host))
+
+    def options(self, host, user="root", master=True):
+        """Options reusing the master of the host, and starting it unless
+        ``master`` is false.
+        """
+        if not self.enabled:
+            return []
+        ensure_dir(self.directory)
+        options = ["-o", "ControlPath=%s" % self.path(host, user)]
+        if not master:
+            return options + ["-o", "ControlMaster=no"]
+        return options + ["-o", "ControlMaster=auto",
+                          "-o", "ControlPersist=%d" % self.PERSIST]
+
+    def environ(self, env):
+        """Process environment running juju's ssh through the wrapper.
+        """
+        if not self.enabled:
+            return env
+        wrapper = os.path.join(self.bin_dir, 'ssh')
+        content = self.WRAPPER % (
+            quote(SSH_CMD[0]), quote(os.path.join(self.directory, '%r@%h')),
+            self.PERSIST)
+        try:
+            with open(wrapper) as handle:
+                current = handle.read()
+        except (IOError, OSError):
+            current = None
+        if current != content:
+            write_atomic(wrapper, content, mode=0o755)
+        env = dict(env)
+        env['PATH'] = os.pathsep.join([self.bin_dir, env.get('PATH', '')])
+        return env
+
+    def close(self, host, user="root"):
+        path = self.path(host, user)
+        if not os.path.exists(path):
+            return
+        cmd = [SSH_CMD[0], "-o", "ControlPath=%s" % path, "-O", "exit",
+               "%s@%s" % (user, host)]
+        with open(os.devnull, 'wb') as devnull:
+            if subprocess.call(cmd, stdout=devnull, stderr=devnull):
+                logger.debug("Could not close ssh master of %s", host)
+
+
+def _ssh(host, user, masters, master=False):
+    cmd = list(SSH_CMD)
+    if masters is not None:
+        cmd.extend(masters.options(host, user, master))
+    cmd.append("%s@%s" % (user, host))
+    return cmd
+
+
+def check_ssh(host, user="root", masters=None):
+    cmd = _ssh(host, user, masters, master=True) + ["ls"]
+    # Not a pipe, a master left in the background would keep it open.
+    with tempfile.TemporaryFile() as output:
+        with stats.timed_subprocess("ssh check"):
+            retcode = cancel.call(
+                cmd, stdout=output, stderr=subprocess.STDOUT)
+        output.seek(0)
+        if retcode:
+            raise subprocess.CalledProcessError(
+                retcode, cmd, output.read().decode('utf-8', 'replace'))
     return True
 
 
-def update_instance(host, user="root"):
-    base = list(SSH_CMD) + ["%s@%s" % (user, host)]
-    subprocess.check_output(
-        base + ["apt-get", "update"], stderr=subprocess.STDOUT
-    )
+def update_instance(host, user="root", masters=None):
+    base = _ssh(host, user, masters)
+    with stats.timed_subprocess("ssh update"):
+        cancel.check_output(
+            base + ["apt-get", "update"], stderr=subprocess.STDOUT
+        )
+
+
+# Packages the manual provider installs on every new machine, preinstalled
+# in build-image images along with the package index and pending upgrades.
+IMAGE_PACKAGES = (
+    "curl", "cpu-checker", "bridge-utils", "rsyslog-gnutls", "cloud-utils",
+    "cloud-image-utils", "tmux")
+
+IMAGE_SCRIPT = """set -e
+export DEBIAN_FRONTEND=noninteractive
+apt-get update
+apt-get -y -o Dpkg::Options::=--force-confold dist-upgrade
+apt-get -y install %s
+apt-get clean
+sync
+""" % " ".join(IMAGE_PACKAGES)
+
+
+def prepare_image(host, user="root", masters=None):
+    return run_script(host, IMAGE_SCRIPT, user, masters, name="ssh prepare")
+
+
+def run_script(host, script, user="root", masters=None, name="ssh script"):
+    """Pipe a shell script to bash on the host, returns its output.
+    """
+    cmd = _ssh(host, user, masters) + ["bash", "-s"]
+    with stats.timed_subprocess(name):
+        returncode, output = cancel.run(
+            cmd, input=script.encode('utf-8'), stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd, output)
+    return output.decode('utf-8', 'replace')
+
+
+# Juju architecture names of uname machine types.
+ARCHES = {
+    'armv7l': 'armhf', 'aarch64': 'arm64', 'x86_64': 'amd64',
+    'i686': 'i386', 'ppc64le': 'ppc64el'}
+
+HARDWARE_SCRIPT = """uname -m
+grep -c ^processor /proc/cpuinfo
+awk '/^MemTotal:/ {print $2}' /proc/meminfo
+"""
+
+
+def detect_hardware(host, user="root", masters=None):
+    """Hardware characteristics of a host, as juju records them, empty
+    when they could not be read.
+    """
+    output = run_script(
+        host, HARDWARE_SCRIPT, user, masters, name="ssh hardware")
+    try:
+        machine, cores, memory = output.split()[:3]
+        cores, memory = int(cores), int(memory)
+    except ValueError:
+        logger.warning("Unexpected hardware of %s: %r", host, output)
+        return {}
+    return {
+        'Arch': ARCHES.get(machine, machine),
+        'CpuCores': cores,
+        # MB, from kB.
+        'Mem': memory // 1024,
+    }
+
+
+# Account juju logs into on manual machines, set up as its CLI does.
+UBUNTU_USER_SCRIPT = """set -e
+id ubuntu >/dev/null 2>&1 || useradd -m -s /bin/bash ubuntu
+echo 'ubuntu ALL=(ALL) NOPASSWD:ALL' > /etc/sudoers.d/90-juju-ubuntu
+chmod 0440 /etc/sudoers.d/90-juju-ubuntu
+install -d -m 700 -o ubuntu -g ubuntu ~ubuntu/.ssh
+cat >> ~ubuntu/.ssh/authorized_keys <<'JUJU_KEYS'
+%s
+JUJU_KEYS
+chown ubuntu:ubuntu ~ubuntu/.ssh/authorized_keys
+chmod 600 ~ubuntu/.ssh/authorized_keys
+"""
+
+
+def provision_machine(host, script, keys, user="root", masters=None):
+    """Run a juju provisioning script, once ``keys`` are authorized for
+    the ubuntu user.
+    """
+    run_script(
+        host, UBUNTU_USER_SCRIPT % keys.strip() + script, user, masters,
+        name="ssh provision")
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Counters and latency histograms of API calls, spawned subprocesses, network
+probes and pipeline stages.
+"""
+
+import contextlib
+import json
+import re
+import threading
+import time
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+ID_RE = re.compile(
+    r'/[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}',
+    re.IGNORECASE)
+
+
+def endpoint(path, action=None):
+    """Group API paths by route, e.g. ``/servers/{id}/action:poweron``.
+    """
+    path = ID_RE.sub('/{id}', path.split('?', 1)[0])
+    if action:
+        path = '%s:%s' % (path, action)
+    return path
+
+
+class Timing(object):
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, elapsed, error=False, retries=0, size=0):
+        self.count += 1
+        self.errors += error and 1 or 0
+        self.retries += retries
+        self.bytes += size
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        for index, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, ratio):
+        """Upper bound of the bucket holding the given percentile.
+        """
+        rank = ratio * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'total': round(self.total, 3),
+            'mean': round(self.count and self.total / self.count, 3),
+            'max': round(self.max, 3),
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'histogram': dict(zip(
+                ['<=%s' % bound for bound in BUCKETS] +
+                ['>%s' % BUCKETS[-1]],
+                self.buckets)),
+        }
+
+
+class Stats(object):
+    """Thread safe registry, shared by the client and the runner threads.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = {}
+        self.subprocesses = {}
+        self.probes = {}
+        self.stages = {}
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def record_request(self, method, path, elapsed,
+                       status=None, retries=0, size=0):
+        key = "%s %s" % (method, path)
+        error = status is None or status >= 400
+        with self._lock:
+            timing = self.requests.setdefault(key, Timing())
+            timing.add(elapsed, error=error, retries=retries, size=size)
+
+    def record_subprocess(self, name, elapsed, error=False):
+        with self._lock:
+            timing = self.subprocesses.setdefault(name, Timing())
+            timing.add(elapsed, error=error)
+
+    def record_throttle(self):
+        with self._lock:
+            self.throttles += 1
+
+    def snapshot(self):
+        """Running totals of API calls, subprocesses and throttled calls,
+        cheap enough to be polled.
+        """
+        with self._lock:
+            requests = list(self.requests.values())
+            subprocesses = list(self.subprocesses.values())
+            return {
+                'requests': sum(timing.count for timing in requests),
+                'request_time': sum(timing.total for timing in requests),
+                'subprocesses': sum(
+                    timing.count for timing in subprocesses),
+                'subprocess_time': sum(
+                    timing.total for timing in subprocesses),
+                'throttles': self.throttles,
+            }
+
+    def record_probe(self, name, elapsed, error=False):
+        with self._lock:
+            timing = self.probes.setdefault(name, Timing())
+            timing.add(elapsed, error=error)
+
+    def record_stage(self, name, elapsed, error=False):
+        with self._lock:
+            timing = self.stages.setdefault(name, Timing())
+            timing.add(elapsed, error=error)
+
+    @contextlib.contextmanager
+    def timed_subprocess(self, name):
+        start = time.time()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self.record_subprocess(name, time.time() - start, error=error)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'wall_time': round(time.time() - self.started, 3),
+                'throttles': self.throttles,
+                'requests': dict(
+                    (key, timing.to_dict())
+                    for key, timing in self.requests.items()),
+                'subprocesses': dict(
+                    (key, timing.to_dict())
+                    for key, timing in self.subprocesses.items()),
+                'probes': dict(
+                    (key, timing.to_dict())
+                    for key, timing in self.probes.items()),
+                'stages': dict(
+                    (key, timing.to_dict())
+                    for key, timing in self.stages.items()),
+            }
+
+    def format_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def format_table(self):
+        data = self.to_dict()
+        row = "{:<44} {:>6} {:>6} {:>7} {:>8} {:>8} {:>8} {:>10}"
+        lines = [row.format(
+            "Call", "Count", "Errors", "Retries", "Mean", "p95", "Max",
+            "Bytes")]
+        for section in ('requests', 'subprocesses', 'probes', 'stages'):
+            for key, timing in sorted(data[section].items()):
+                lines.append(row.format(
+                    key[:44], timing['count'], timing['errors'],
+                    timing['retries'], "%.3f" % timing['mean'],
+                    "%.3f" % timing['p95'], "%.3f" % timing['max'],
+                    timing['bytes']))
+        lines.append("Throttled calls: %d" % data['throttles'])
+        lines.append("Wall time: %.2fs" % data['wall_time'])
+        return "\n".join(lines)
+
+
+# Process wide registry.
+stats = Stats()
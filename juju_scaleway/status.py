@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#                         Edouard Bonlieu <ebonlieu@scaleway.com>
+#                         Julien Castets <jcastets@scaleway.com>
+#                         Manfred Touron <mtouron@scaleway.com>
+#                         Kevin Deldycke <kdeldycke@scaleway.com>
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+"""
+Parsing of juju documents: status output and environment files.
+
+The status of a large environment weighs megabytes, mostly units of
+services. It is read as JSON, which the standard library decodes in C,
+stopping once the wanted top level member is decoded. YAML files go
+through libyaml when PyYAML was built with it.
+"""
+
+import json
+import re
+
+import yaml
+
+
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def load_yaml(stream):
+    """Like ``yaml.safe_load``, with the C loader when available.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def json_member(text, key, default=None):
+    """Value of ``key`` in the JSON object ``text``, ``default`` if absent.
+
+    Members are decoded one at a time and dropped, the ones following
+    ``key`` are not decoded at all.
+    """
+    index = _skip(text, 0)
+    if text[index:index + 1] != '{':
+        raise ValueError("Expected a JSON object")
+    index = _skip(text, index + 1)
+    if text[index:index + 1] == '}':
+        return default
+    while True:
+        name, index = _decoder.raw_decode(text, index)
+        index = _skip(text, index)
+        if text[index:index + 1] != ':':
+            raise ValueError("Expected ':' at %d" % index)
+        value, index = _decoder.raw_decode(text, _skip(text, index + 1))
+        if name == key:
+            return value
+        index = _skip(text, index)
+        if text[index:index + 1] != ',':
+            return default
+        index = _skip(text, index + 1)
+
+
+def status_machines(output):
+    """Machines of ``juju status --format json`` output, keyed by id.
+    """
+    if isinstance(output, bytes):
+        output = output.decode('utf-8')
+    return json_member(output, 'machines') or {}
+
+
+def _skip(text, index):
+    return _WHITESPACE.match(text, index).end()
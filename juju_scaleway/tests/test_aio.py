@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import unittest
+
+# Python 3.6+ only. No async syntax here, nose and setup.py test import
+# this module on every interpreter.
+try:
+    import asyncio
+    from juju_scaleway import aio
+except (ImportError, SyntaxError):
+    aio = None
+
+from juju_scaleway.client import Server
+from juju_scaleway.exceptions import ProviderAPIError
+from juju_scaleway.polling import PollPolicy
+
+
+def resolved(value=None, error=None):
+    """Awaitable done with ``value`` or ``error``.
+    """
+    future = asyncio.get_event_loop().create_future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(value)
+    return future
+
+
+class FakeAsyncClient(object):
+    """Servers run after ``boot_polls`` listings, poweron of names in
+    ``poweron_errors`` fails. Methods return futures rather than being
+    coroutines.
+    """
+
+    def __init__(self, boot_polls=1, poweron_errors=()):
+        self.boot_polls = boot_polls
+        self.poweron_errors = poweron_errors
+        self.servers = {}
+        self.polls = {}
+        self.calls = []
+
+    def add(self, name):
+        server_id = 'id-%s' % name
+        self.servers[server_id] = Server.from_dict(
+            {'id': server_id, 'name': name, 'state': 'stopped'})
+        return self.servers[server_id]
+
+    def _create_server(self, name, image, tags=None):
+        self.calls.append('create')
+        return resolved(self.add(name))
+
+    def poweron_server(self, server_id):
+        self.calls.append('poweron')
+        if self.servers[server_id].name in self.poweron_errors:
+            return resolved(error=ProviderAPIError(None, "poweron failed"))
+        return resolved()
+
+    def get_server(self, server_id):
+        self.calls.append('get_server')
+        return resolved(self._poll(server_id))
+
+    def get_servers(self, name=None, state=None):
+        self.calls.append('get_servers')
+        return resolved(
+            [self._poll(server_id) for server_id in list(self.servers)])
+
+    def destroy_server(self, server_id):
+        self.calls.append('destroy')
+        del self.servers[server_id]
+        return resolved()
+
+    def close(self):
+        return resolved()
+
+    def _poll(self, server_id):
+        self.polls[server_id] = self.polls.get(server_id, 0) + 1
+        server = self.servers[server_id]
+        if self.polls[server_id] >= self.boot_polls:
+            server = Server.from_dict(
+                {'id': server.id, 'name': server.name, 'state': 'running'})
+        return server
+
+
+@unittest.skipIf(aio is None, "asyncio engine requires Python 3.6+")
+class AsyncScalewayTest(unittest.TestCase):
+
+    def provider(self, client):
+        return aio.AsyncScaleway(
+            {}, client=client,
+            policy=PollPolicy(initial=0.01, max_delay=0.01))
+
+    def test_launch_servers(self):
+        client = FakeAsyncClient(boot_polls=3)
+        params_list = [
+            {'name': 'juju-%d' % index, 'image': 'image'}
+            for index in range(4)]
+        results = aio.run(self.provider(client).launch_servers(params_list))
+
+        self.assertEqual(
+            [result.server.name for result in results],
+            ['juju-0', 'juju-1', 'juju-2', 'juju-3'])
+        self.assertTrue(all(result.error is None for result in results))
+        self.assertTrue(all(
+            result.server.state == 'running' for result in results))
+        # One listing per tick for all the servers.
+        self.assertEqual(client.calls.count('get_servers'), 3)
+        self.assertEqual(client.calls.count('get_server'), 0)
+
+    def test_poweron_failure_terminates(self):
+        client = FakeAsyncClient(poweron_errors=('juju-1',))
+        params_list = [
+            {'name': 'juju-%d' % index, 'image': 'image'}
+            for index in range(2)]
+        results = aio.run(self.provider(client).launch_servers(params_list))
+
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, ProviderAPIError)
+        self.assertIsNone(results[1].server)
+        self.assertEqual(list(client.servers), ['id-juju-0'])
+
+    def test_launch_server_keeps_server(self):
+        client = FakeAsyncClient(poweron_errors=('juju-0',))
+        result = aio.run(self.provider(client).launch_server(
+            {'name': 'juju-0', 'image': 'image'}))
+        self.assertEqual(result.server.id, 'id-juju-0')
+        self.assertIsInstance(result.error, ProviderAPIError)
+
+    def test_wait_timeout(self):
+        client = FakeAsyncClient(boot_polls=1000)
+        server = client.add('juju-0')
+        ready, stuck = aio.run(
+            self.provider(client).wait_many([server], timeout=0.05))
+        self.assertEqual(ready, [])
+        self.assertEqual([server.id for server in stuck], ['id-juju-0'])
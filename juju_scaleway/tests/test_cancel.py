@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import threading
+import time
+import unittest
+
+from juju_scaleway import cancel
+from juju_scaleway.exceptions import OpCancelled, TimeoutError
+
+
+class WaitTest(unittest.TestCase):
+
+    def test_set(self):
+        event = threading.Event()
+        threading.Timer(0.1, event.set).start()
+        self.assertTrue(cancel.wait(event, step=0.05))
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertFalse(cancel.wait(threading.Event(), timeout=0.1))
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_cancelled(self):
+        scope = cancel.Scope('op')
+        threading.Timer(0.1, scope.cancel).start()
+        with scope.active():
+            self.assertRaises(
+                OpCancelled, cancel.wait, threading.Event(), step=0.05)
+
+
+class SleepTest(unittest.TestCase):
+
+    def test_outside_scope(self):
+        start = time.time()
+        cancel.sleep(0.05)
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_wakes_on_cancel(self):
+        scope = cancel.Scope('op', limit=60)
+        threading.Timer(0.1, scope.cancel, args=(scope.TIMEOUT,)).start()
+        start = time.time()
+        with scope.active():
+            self.assertRaises(TimeoutError, cancel.sleep, 30)
+        self.assertLess(time.time() - start, 1)
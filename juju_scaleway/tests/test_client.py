@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import json
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway import client
+from juju_scaleway.client import Client, Server
+from juju_scaleway.exceptions import OpCancelled, ProviderAPIError
+from juju_scaleway.ratelimit import HIGH, LOW
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code=200, data=None, headers=None, links=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.links = links or {}
+        self.content = json.dumps(data).encode('utf-8')
+        self.raw = None
+
+    def json(self):
+        if self.data is None:
+            raise ValueError("No JSON object could be decoded")
+        return self.data
+
+
+class FakeSession(object):
+    """Answers requests from a list of responses, recording them.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        self.requests.append((method, url, params))
+        return self.responses.pop(0)
+
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client('access', 'secret')
+
+    def test_shared(self):
+        sessions = []
+        build = self.client._build_session
+        with mock.patch.object(
+                self.client, '_build_session', side_effect=build) as built:
+            threads = [
+                threading.Thread(
+                    target=lambda: sessions.append(self.client.session))
+                for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(built.call_count, 1)
+        self.assertEqual(len(set(id(session) for session in sessions)), 1)
+
+    def test_close(self):
+        session = self.client.session
+        self.client.close()
+        self.assertIsNot(self.client.session, session)
+
+    def test_retries(self):
+        adapter = self.client.session.get_adapter('https://api.scaleway.com')
+        retries = adapter.max_retries
+        self.assertEqual(retries.total, Client.MAX_RETRIES)
+        self.assertTrue(retries.is_retry('GET', 503))
+        # POSTs are not idempotent, only retried when not sent at all.
+        self.assertFalse(retries.is_retry('POST', 503))
+        self.assertFalse(retries.is_retry('GET', 404))
+        self.assertGreaterEqual(
+            adapter._pool_maxsize, Client.BULK_CONCURRENCY)
+
+
+class SendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client('access', 'secret')
+        self.client.rate_limiter = mock.Mock()
+
+    def send(self, *responses, **kwargs):
+        self.client._session = FakeSession(responses)
+        return self.client.send('/servers', **kwargs)
+
+    def test_error_message(self):
+        with self.assertRaises(ProviderAPIError) as raised:
+            self.send(FakeResponse(404, {'message': 'not found'}))
+        self.assertEqual(raised.exception.message, 'not found')
+        self.assertEqual(raised.exception.response.status_code, 404)
+
+    def test_error_without_json(self):
+        with self.assertRaises(ProviderAPIError) as raised:
+            self.send(FakeResponse(502))
+        self.assertIsNone(raised.exception.message)
+
+    def test_request_without_data(self):
+        self.client._session = FakeSession([FakeResponse(200, {})])
+        self.assertRaises(ProviderAPIError, self.client.request, '/servers')
+
+    def test_retry_after(self):
+        response = self.send(
+            FakeResponse(429, headers={'Retry-After': '3'}),
+            FakeResponse(200, {'servers': []}))
+        self.assertEqual(response.status_code, 200)
+        self.client.rate_limiter.backoff.assert_called_once_with(3.0)
+        self.assertEqual(len(self.client._session.requests), 2)
+
+    def test_backoff(self):
+        self.send(FakeResponse(429), FakeResponse(429), FakeResponse(200, {}))
+        self.assertEqual(
+            self.client.rate_limiter.backoff.call_args_list,
+            [mock.call(Client.BACKOFF_FACTOR),
+             mock.call(Client.BACKOFF_FACTOR * 2)])
+
+    def test_gives_up(self):
+        responses = [FakeResponse(429)] * (Client.MAX_THROTTLED_RETRIES + 2)
+        with self.assertRaises(ProviderAPIError) as raised:
+            self.send(*responses)
+        self.assertEqual(raised.exception.response.status_code, 429)
+        self.assertEqual(
+            len(self.client._session.requests),
+            Client.MAX_THROTTLED_RETRIES + 1)
+
+    def test_priority(self):
+        self.send(FakeResponse(200, {}))
+        self.send(FakeResponse(200, {}), method='POST')
+        self.assertEqual(
+            self.client.rate_limiter.acquire.call_args_list,
+            [mock.call(LOW), mock.call(HIGH)])
+        self.assertEqual(self.client.rate_limiter.update.call_count, 2)
+
+
+class CreateServersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client('access', 'secret')
+        self.client._create_server = self.create
+        self.client.poweron_server = self.poweron
+        self.create_errors = ()
+        self.poweron_errors = ()
+
+    def create(self, name, image, tags=None):
+        if name in self.create_errors:
+            raise ProviderAPIError(None, "create failed")
+        return Server.from_dict({'id': 'id-%s' % name, 'name': name})
+
+    def poweron(self, server_id):
+        if server_id in self.poweron_errors:
+            raise ProviderAPIError(None, "poweron failed")
+
+    def create_servers(self, count):
+        return self.client.create_servers(
+            [{'name': 'juju-%d' % index, 'image': 'image'}
+             for index in range(count)], concurrency=3)
+
+    def test_in_order(self):
+        results = self.create_servers(8)
+        self.assertEqual(
+            [result.server.name for result in results],
+            ['juju-%d' % index for index in range(8)])
+        self.assertTrue(all(result.error is None for result in results))
+
+    def test_failures(self):
+        self.create_errors = ('juju-1',)
+        self.poweron_errors = ('id-juju-2',)
+        results = self.create_servers(4)
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[1].spec['name'], 'juju-1')
+        self.assertIsNone(results[1].server)
+        self.assertIsInstance(results[1].error, ProviderAPIError)
+        # Created but not powered on, left to the caller to terminate.
+        self.assertEqual(results[2].server.id, 'id-juju-2')
+        self.assertIsInstance(results[2].error, ProviderAPIError)
+        self.assertIsNone(results[3].error)
+
+    def test_failed_op(self):
+        run = client._CreateServerOp.run
+
+        def cancelled(operation):
+            if operation.index == 0:
+                raise OpCancelled("cancelled")
+            return run(operation)
+
+        with mock.patch.object(client._CreateServerOp, 'run', cancelled):
+            results = self.create_servers(2)
+        self.assertEqual(results[0].spec['name'], 'juju-0')
+        self.assertIsInstance(results[0].error, OpCancelled)
+        self.assertIsNone(results[1].error)
+
+
+def page(names, **kwargs):
+    return FakeResponse(
+        200, {'servers': [{'id': name, 'name': name} for name in names]},
+        **kwargs)
+
+
+class IterPagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client('access', 'secret', api_url='https://api')
+
+    def iter_servers(self, *responses):
+        self.session = self.client._session = FakeSession(responses)
+        return self.client.iter_servers()
+
+    def test_link_header(self):
+        servers = self.iter_servers(
+            page(['a', 'b'], links={'next': {'url': '/servers?page=2'}}),
+            page(['c'], links={'next': {'url': '/servers?page=3'}}),
+            page([]))
+        self.assertEqual([server.id for server in servers], ['a', 'b', 'c'])
+        self.assertEqual(
+            [request[1:] for request in self.session.requests], [
+                ('https://api/servers', {'page': 1, 'per_page': 100}),
+                ('https://api/servers?page=2', {}),
+                ('https://api/servers?page=3', {})])
+
+    def test_total_count(self):
+        self.client.DEFAULT_PER_PAGE = 2
+        headers = {'X-Total-Count': '5'}
+        servers = self.iter_servers(
+            page(['a', 'b'], headers=headers),
+            page(['c', 'd'], headers=headers),
+            page(['e'], headers=headers))
+        self.assertEqual(len(list(servers)), 5)
+        self.assertEqual(
+            [request[2]['page'] for request in self.session.requests],
+            [1, 2, 3])
+
+    def test_single_page(self):
+        servers = self.iter_servers(page(['a']))
+        self.assertEqual([server.id for server in servers], ['a'])
+        self.assertEqual(len(self.session.requests), 1)
+
+    def test_streams(self):
+        servers = self.iter_servers(
+            page(['a'], links={'next': {'url': '/servers?page=2'}}),
+            page(['b']))
+        self.assertEqual(next(servers).id, 'a')
+        # The next page is only fetched once the first is consumed.
+        self.assertEqual(len(self.session.requests), 1)
+        self.assertEqual(next(servers).id, 'b')
+        self.assertEqual(len(self.session.requests), 2)
+
+    def test_filters(self):
+        self.client.DEFAULT_PER_PAGE = 1
+        headers = {'X-Total-Count': '2'}
+        self.client._session = FakeSession([
+            page(['a'], headers=headers), page(['b'], headers=headers)])
+        list(self.client.iter_servers(state='running'))
+        self.assertEqual(
+            [request[2] for request in self.client._session.requests], [
+                {'state': 'running', 'page': 1, 'per_page': 1},
+                {'state': 'running', 'page': 2, 'per_page': 1}])
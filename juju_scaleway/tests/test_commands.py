@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+from collections import OrderedDict
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway import commands
+from juju_scaleway import runner
+from juju_scaleway.client import Server
+from juju_scaleway.exceptions import (
+    DeliveryError, JujuAPIError, TimeoutError)
+
+
+def command(cls, **options):
+    config = mock.Mock(parallel=None, op_timeout=None, retries=None)
+    for name, value in options.items():
+        setattr(config, name, value)
+    provider = mock.Mock()
+    provider.client.BULK_CONCURRENCY = 64
+    return cls(config, provider, mock.Mock())
+
+
+class PipelineStagesTest(unittest.TestCase):
+
+    def stages(self, count, parallel):
+        add = command(commands.AddMachine, parallel=parallel)
+        return dict(add.pipeline_stages(count))
+
+    def test_defaults(self):
+        for parallel in (None, 'auto'):
+            self.assertEqual(
+                self.stages(500, parallel),
+                {'launch': 64, 'wait': 128, 'verify': 32, 'register': 32})
+
+    def test_few_machines(self):
+        self.assertEqual(
+            set(self.stages(3, None).values()), set([3]))
+
+    def test_parallel(self):
+        self.assertEqual(
+            self.stages(500, 8),
+            {'launch': 8, 'wait': 8, 'verify': 8, 'register': 8})
+        self.assertEqual(self.stages(500, 100)['verify'], 32)
+
+
+class AddMachinePoolTest(unittest.TestCase):
+
+    def run_command(self, target):
+        add = command(
+            commands.AddMachine, num_machines=0, series='trusty',
+            async_engine=False)
+        warm_pool = mock.Mock()
+        warm_pool.target.return_value = target
+        warm_pool.claim.return_value = []
+        with mock.patch.multiple(
+                add, check_preconditions=mock.DEFAULT,
+                solve_constraints=mock.DEFAULT, get_pool=mock.DEFAULT) as m:
+            m['get_pool'].return_value = warm_pool
+            add.run()
+        return warm_pool
+
+    def test_no_pool(self):
+        warm_pool = self.run_command(0)
+        self.assertFalse(warm_pool.claim.called)
+        self.assertFalse(warm_pool.refill_in_background.called)
+
+    def test_pool(self):
+        warm_pool = self.run_command(2)
+        warm_pool.claim.assert_called_once_with('trusty', 0)
+        warm_pool.refill_in_background.assert_called_once_with('trusty')
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.build = command(commands.BuildImage)
+        self.build.snapshot_policy = dict(initial=0.01, max_delay=0.01)
+        self.client = self.build.provider.client
+        self.client.create_snapshot.return_value = {
+            'id': 'snapshot-1', 'state': 'snapshotting'}
+        self.server = Server.from_dict({
+            'id': 'server-1', 'name': 'env-image-1',
+            'volumes': {'0': {'id': 'volume-1'}}})
+
+    def test_image(self):
+        self.client.get_snapshot.side_effect = [
+            {'id': 'snapshot-1', 'state': 'snapshotting'},
+            {'id': 'snapshot-1', 'state': 'available'}]
+        image = self.build.snapshot(self.server, 'juju-trusty-1')
+
+        self.assertIs(image, self.client.create_image.return_value)
+        self.client.create_snapshot.assert_called_once_with(
+            'juju-trusty-1', 'volume-1')
+        self.assertEqual(self.client.get_snapshot.call_count, 2)
+        self.client.create_image.assert_called_once_with(
+            'juju-trusty-1', 'arm', 'snapshot-1')
+
+    def test_timeout(self):
+        self.build.snapshot_timeout = 0.05
+        self.client.get_snapshot.return_value = {
+            'id': 'snapshot-1', 'state': 'snapshotting'}
+        self.assertRaises(
+            TimeoutError, self.build.snapshot, self.server, 'juju-trusty-1')
+        self.assertFalse(self.client.create_image.called)
+
+
+class FakeJuju(object):
+    """Juju environment refusing to remove ``broken`` machines, and any
+    batch of several machines holding one of them.
+    """
+
+    def __init__(self, count, broken=()):
+        self.state = OrderedDict(
+            (str(index), {'dns-name': '10.0.0.%d' % index,
+                          'instance-id': 'id-%d' % index})
+            for index in range(1, count + 1))
+        self.broken = broken
+        self.calls = []
+
+    def machines(self):
+        return OrderedDict(self.state)
+
+    def terminate_machines(self, machine_ids):
+        self.calls.append(list(machine_ids))
+        for machine_id in machine_ids:
+            if machine_id in self.broken:
+                raise JujuAPIError(
+                    "machine %s has unit not valid" % machine_id)
+        for machine_id in machine_ids:
+            del self.state[machine_id]
+
+
+class RemoveFromEnvTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(runner, 'logger')
+        self.logger = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def terminate(self, env, machine_ids):
+        terminate = command(commands.TerminateMachine, retries=0)
+        terminate.TERMINATE_BATCH_SIZE = 3
+        terminate.env = env
+        terminate.provider.iter_servers.return_value = [
+            Server.from_dict({
+                'id': machine['instance-id'],
+                'public_ip': {'address': machine['dns-name']}})
+            for machine in env.state.values()]
+        self.provider = terminate.provider
+        terminate._terminate_machines(
+            lambda machine_id: machine_id in machine_ids, strict=True)
+
+    def test_batches(self):
+        env = FakeJuju(5)
+        self.terminate(env, ['1', '2', '3', '4', '5'])
+        self.assertEqual(env.calls, [['1', '2', '3'], ['4', '5']])
+        self.assertEqual(env.state, {})
+        self.assertEqual(self.provider.terminate_server.call_count, 5)
+
+    def test_failed_batch(self):
+        env = FakeJuju(6, broken=('5',))
+        self.assertRaises(
+            DeliveryError, self.terminate, env, ['1', '2', '3', '4', '5', '6'])
+
+        # Only the machines of the failed batch are removed one by one.
+        self.assertEqual(env.calls[0], ['1', '2', '3'])
+        self.assertEqual(env.calls[1], ['4', '5', '6'])
+        self.assertEqual(
+            sorted(env.calls[2:]), [['4'], ['5'], ['6']])
+        self.assertEqual(list(env.state), ['5'])
+
+        # The broken machine keeps its server and reports its own error.
+        terminated = [
+            call[0][0]
+            for call in self.provider.terminate_server.call_args_list]
+        self.assertEqual(
+            sorted(terminated), ['id-1', 'id-2', 'id-3', 'id-4', 'id-6'])
+        self.assertEqual(self.logger.error.call_count, 1)
+        operation, error = self.logger.error.call_args[0][1:]
+        self.assertEqual(operation.params['machine_id'], '5')
+        self.assertIn('machine 5', str(error))
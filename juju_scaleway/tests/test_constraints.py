@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway import constraints
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+
+class FakeCatalog(object):
+    """Image listing with an ETag per page, as served by the API.
+    """
+
+    DEFAULT_PER_PAGE = 2
+
+    def __init__(self, images):
+        self.images = images
+        self.requests = []
+
+    def send(self, target, params=None, headers=None):
+        page = params['page']
+        self.requests.append((page, bool(headers)))
+        start = (page - 1) * params['per_page']
+        data = {'images': self.images[start:start + params['per_page']]}
+        etag = '"%d"' % hash(json.dumps(data, sort_keys=True))
+        if headers and headers.get('If-None-Match') == etag:
+            return FakeResponse(304, headers={'ETag': etag})
+        return FakeResponse(200, data, headers={
+            'ETag': etag, 'X-Total-Count': str(len(self.images))})
+
+    def iter_pages(self, target):
+        page = 1
+        while True:
+            response = self.send(
+                target, {'page': page, 'per_page': self.DEFAULT_PER_PAGE})
+            yield response
+            if page * self.DEFAULT_PER_PAGE >= len(self.images):
+                return
+            page += 1
+
+
+def image(name, image_id, public=True, creation_date=None):
+    return {'id': image_id, 'name': name, 'public': public,
+            'creation_date': creation_date}
+
+
+class CatalogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = constraints.ImageCache(
+            os.path.join(self.directory, 'images.json'), ttl=0)
+        self.catalog = FakeCatalog([
+            image('Ubuntu Trusty (14.04 LTS)', 'trusty-1'),
+            image('Debian Wheezy', 'wheezy-1'),
+            image('Ubuntu Utopic (14.10)', 'utopic-1')])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_images(self):
+        self.catalog.requests = []
+        return constraints.get_images(self.catalog, self.cache)
+
+
+class GetImagesTest(CatalogTestCase):
+
+    def test_revalidates_every_page(self):
+        self.get_images()
+        self.assertEqual(
+            self.get_images(), {'trusty': 'trusty-1', 'utopic': 'utopic-1'})
+        self.assertEqual(self.catalog.requests, [(1, True), (2, True)])
+
+    def test_change_past_first_page(self):
+        self.get_images()
+        self.catalog.images[2] = image('Ubuntu Utopic (14.10)', 'utopic-2')
+        self.assertEqual(self.get_images()['utopic'], 'utopic-2')
+
+    def test_added_after_full_page(self):
+        self.catalog.images.append(image('Debian Jessie', 'jessie-1'))
+        self.get_images()
+        self.catalog.images.append(
+            image('Ubuntu Trusty (14.04 LTS)', 'trusty-2'))
+        self.assertEqual(self.get_images()['trusty'], 'trusty-2')
+
+    def test_streams_pages(self):
+        requested = []
+        match_images = constraints.match_images
+
+        def match(images):
+            for found in images:
+                requested.append(len(self.catalog.requests))
+                yield found
+
+        with mock.patch.object(
+                constraints, 'match_images',
+                side_effect=lambda images: match_images(match(images))):
+            self.get_images()
+        # Images of a page are matched before the next page is fetched.
+        self.assertEqual(requested, [1, 1, 2])
+
+    def test_fresh_entry(self):
+        self.cache.ttl = 3600
+        self.get_images()
+        self.assertEqual(self.get_images()['trusty'], 'trusty-1')
+        self.assertEqual(self.catalog.requests, [])
+
+    def test_ignores_incomplete_entry(self):
+        with open(self.cache.path, 'w') as handle:
+            json.dump({'images': {'trusty': 'stale'}, 'etag': '"1"'}, handle)
+        self.assertEqual(self.get_images()['trusty'], 'trusty-1')
+        self.assertEqual(self.catalog.requests, [(1, False), (2, False)])
+
+
+class PrebuiltImagesTest(CatalogTestCase):
+
+    def setUp(self):
+        super(PrebuiltImagesTest, self).setUp()
+        self.catalog.images.extend([
+            image('juju-trusty-20150301', 'built-2', False, '2015-03-01'),
+            image('juju-trusty-20150101', 'built-1', False, '2015-01-01'),
+            image('juju-unknown-20150101', 'built-3', False, '2015-01-01'),
+            image('my-trusty', 'private-1', False, '2015-04-01')])
+
+    def test_newest_prebuilt(self):
+        self.assertEqual(
+            self.get_images(), {'trusty': 'built-2', 'utopic': 'utopic-1'})
+
+    def test_stock(self):
+        self.assertEqual(
+            constraints.get_images(self.catalog, self.cache, prebuilt=False),
+            {'trusty': 'trusty-1', 'utopic': 'utopic-1'})
+        # From the cache as well.
+        self.cache.ttl = 3600
+        self.assertEqual(
+            constraints.get_images(self.catalog, self.cache, prebuilt=False),
+            {'trusty': 'trusty-1', 'utopic': 'utopic-1'})
+        self.assertEqual(self.get_images()['trusty'], 'built-2')
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+import yaml
+
+from juju_scaleway import jujuapi
+from juju_scaleway.exceptions import JujuAPIError
+from juju_scaleway.jujuapi import APIClient, status_dict
+
+
+class FakeConnection(object):
+    """Answers each request with the next of ``responses``, a response
+    dict or an error string.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent = []
+        self.replies = []
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def send(self, data):
+        message = json.loads(data)
+        self.sent.append(message)
+        response = self.responses.pop(0)
+        reply = {'RequestId': message['RequestId']}
+        if isinstance(response, str):
+            reply['Error'] = response
+        else:
+            reply['Response'] = response
+        # A stale reply first, to be skipped.
+        self.replies.append(json.dumps({'RequestId': 0, 'Response': {}}))
+        self.replies.append(json.dumps(reply))
+
+    def recv(self):
+        if not self.replies:
+            raise IOError("connection reset")
+        return self.replies.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class APIClientTest(unittest.TestCase):
+
+    def connect(self, *responses):
+        conn = FakeConnection(({},) + responses)
+        websocket = mock.Mock()
+        websocket.create_connection.return_value = conn
+        client = APIClient(['10.0.0.1:17070'], 'admin', 'secret')
+        with mock.patch.object(jujuapi, 'websocket', websocket):
+            client.connect()
+        return client, conn, websocket
+
+    def test_login(self):
+        _, conn, websocket = self.connect()
+        url = websocket.create_connection.call_args[0][0]
+        self.assertEqual(url, 'wss://10.0.0.1:17070/')
+        self.assertEqual(conn.sent[0]['Request'], 'Login')
+        self.assertEqual(conn.sent[0]['Params']['AuthTag'], 'user-admin')
+        self.assertEqual(conn.sent[0]['Params']['Password'], 'secret')
+
+    def test_connect_errors(self):
+        websocket = mock.Mock()
+        websocket.create_connection.side_effect = IOError("refused")
+        client = APIClient(['10.0.0.1:17070', '10.0.0.2:17070'], 'admin', 'x')
+        with mock.patch.object(jujuapi, 'websocket', websocket):
+            with self.assertRaises(JujuAPIError):
+                client.connect()
+        self.assertEqual(websocket.create_connection.call_count, 2)
+
+    def test_add_machines(self):
+        client, conn, _ = self.connect({'Machines': [
+            {'Machine': '4', 'Error': None},
+            {'Machine': '', 'Error': {'Message': 'bad', 'Code': 'x'}},
+        ]})
+        first, second = client.add_machines([{}, {}])
+        self.assertEqual(first, '4')
+        self.assertIsInstance(second, JujuAPIError)
+        self.assertEqual(second.code, 'x')
+        self.assertEqual(conn.sent[1]['Request'], 'AddMachines')
+
+    def test_call_error(self):
+        client, _, _ = self.connect("permission denied")
+        with self.assertRaises(JujuAPIError):
+            client.destroy_machines(['1'])
+        # Still connected.
+        self.assertIsNotNone(client.conn)
+
+    def test_lost_connection(self):
+        client, conn, _ = self.connect()
+        conn.recv = mock.Mock(side_effect=IOError("connection reset"))
+        with self.assertRaises(JujuAPIError):
+            client.full_status()
+        self.assertTrue(conn.closed)
+        self.assertIsNone(client.conn)
+        with self.assertRaises(JujuAPIError):
+            client.full_status()
+
+    def test_provisioning_script(self):
+        client, conn, _ = self.connect({'Script': 'echo hi\n'})
+        self.assertEqual(
+            client.provisioning_script('3', 'manual:nonce'), 'echo hi\n')
+        self.assertEqual(conn.sent[1]['Params']['MachineId'], '3')
+
+
+class FromJenvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'env.jenv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data):
+        with open(self.path, 'w') as handle:
+            yaml.safe_dump(data, handle)
+
+    def test_state_servers(self):
+        self.write({
+            'user': 'admin', 'password': 'secret', 'ca-cert': 'CERT',
+            'state-servers': ['10.0.0.1:17070'], 'environ-uuid': 'abc'})
+        client = APIClient.from_jenv(self.path)
+        self.assertEqual(client.addresses, ['10.0.0.1:17070'])
+        self.assertEqual(client.ca_cert, 'CERT')
+        self.assertEqual(client.env_uuid, 'abc')
+
+    def test_bootstrap_host(self):
+        self.write({
+            'password': 'secret',
+            'bootstrap-config': {'bootstrap-host': '10.0.0.2'}})
+        client = APIClient.from_jenv(self.path)
+        self.assertEqual(client.addresses, ['10.0.0.2:17070'])
+        self.assertEqual(client.user, 'admin')
+
+    def test_incomplete(self):
+        self.write({'state-servers': ['10.0.0.1:17070']})
+        self.assertIsNone(APIClient.from_jenv(self.path))
+        self.assertIsNone(APIClient.from_jenv(self.path + '.missing'))
+
+
+class StatusDictTest(unittest.TestCase):
+
+    def test_machines(self):
+        status = status_dict({
+            'EnvironmentName': 'bench',
+            'Machines': {'0': {
+                'AgentState': 'started', 'DNSName': '10.0.0.1',
+                'InstanceId': 'manual:10.0.0.1', 'Series': 'trusty'}},
+            'Services': {'mysql': {}}})
+        self.assertEqual(status['environment'], 'bench')
+        self.assertEqual(status['machines']['0']['dns-name'], '10.0.0.1')
+        self.assertEqual(status['machines']['0']['agent-state'], 'started')
+        self.assertEqual(status['services'], {'mysql': {}})
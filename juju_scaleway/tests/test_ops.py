@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import subprocess
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway import ops
+from juju_scaleway.exceptions import (
+    JujuAPIError, ProviderAPIError, TimeoutError)
+from juju_scaleway.polling import PollPolicy
+from juju_scaleway.retry import RetryPolicy
+
+
+def api_error(status):
+    return ProviderAPIError(mock.Mock(status_code=status), "error")
+
+
+def machine(address, **values):
+    data = {'dns-name': address, 'agent-state': 'started'}
+    data.update(values)
+    return data
+
+
+class MachineRegisterRecoverTest(unittest.TestCase):
+
+    def recover(self, machines):
+        env = mock.Mock()
+        env.machines.return_value = machines
+        server = mock.Mock(id='server-1')
+        server.public_ip = {'address': '10.0.0.1'}
+        operation = ops.MachineRegister(
+            mock.Mock(), env, {'name': 'bench-1'}, server=server)
+        operation.recover('register')
+        return operation.machine_id
+
+    def test_adopt(self):
+        self.assertEqual(self.recover({
+            '3': machine('10.0.0.1'), '4': machine('10.0.0.2')}), '3')
+
+    def test_nothing_to_adopt(self):
+        self.assertIsNone(self.recover({'4': machine('10.0.0.2')}))
+
+    def test_skip_leaving_and_failed(self):
+        self.assertIsNone(self.recover({
+            '3': machine('10.0.0.1', life='dying'),
+            '4': machine('10.0.0.1', life='dead'),
+            '5': machine('10.0.0.1', **{'agent-state': 'error'})}))
+
+    def test_latest(self):
+        self.assertEqual(self.recover({
+            '9': machine('10.0.0.1'), '12': machine('10.0.0.1'),
+            '13': machine('10.0.0.1', life='dying')}), '12')
+
+
+class MachineDestroyTest(unittest.TestCase):
+
+    def destroy(self, provider=None, env=None, **options):
+        operation = ops.MachineDestroy(
+            provider or mock.Mock(), env or mock.Mock(),
+            {'machine_id': '3', 'server_id': 'server-1'},
+            retry=RetryPolicy(backoff=PollPolicy(initial=0)), **options)
+        operation.run()
+        return operation
+
+    def test_retry_terminate(self):
+        provider = mock.Mock()
+        provider.terminate_server.side_effect = [api_error(503), None]
+        self.destroy(provider)
+        self.assertEqual(provider.terminate_server.call_count, 2)
+
+    def test_terminated_before_error(self):
+        provider = mock.Mock()
+        provider.terminate_server.side_effect = api_error(503)
+        provider.get_server.side_effect = api_error(404)
+        self.destroy(provider)
+        self.assertEqual(provider.terminate_server.call_count, 1)
+
+    def test_removed_before_error(self):
+        env = mock.Mock()
+        env.terminate_machines.side_effect = JujuAPIError("Lost connection")
+        env.machines.return_value = {}
+        provider = mock.Mock()
+        self.destroy(provider, env)
+        self.assertEqual(env.terminate_machines.call_count, 1)
+        provider.terminate_server.assert_called_once_with('server-1')
+
+    def test_permanent_error(self):
+        env = mock.Mock()
+        env.terminate_machines.side_effect = JujuAPIError(
+            "machine 3 not found", 'not found')
+        provider = mock.Mock()
+        self.assertRaises(JujuAPIError, self.destroy, provider, env)
+        self.assertEqual(env.terminate_machines.call_count, 1)
+        self.assertFalse(provider.terminate_server.called)
+
+    def test_only(self):
+        env, provider = mock.Mock(), mock.Mock()
+        self.destroy(provider, env, iaas_only=True)
+        self.assertFalse(env.terminate_machines.called)
+        self.destroy(provider, env, env_only=True)
+        self.assertEqual(provider.terminate_server.call_count, 1)
+        self.assertEqual(env.terminate_machines.call_count, 1)
+
+
+class VerifySshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.provider = mock.Mock(ssh_masters=None)
+        self.provider.history.expected.return_value = 5.0
+        self.server = mock.Mock(id='server-1')
+        self.server.name = 'env-1'
+        self.server.public_ip = {'address': '10.0.0.1'}
+        self.operation = ops.MachineAdd(self.provider, None, {})
+        self.operation.policy = dict(initial=0.01, max_delay=0.01)
+
+    def refused(self, output="ssh: connect: Connection refused"):
+        return subprocess.CalledProcessError(255, 'ssh', output=output)
+
+    def verify(self, *results):
+        with mock.patch.object(
+                ops.ssh, 'check_ssh', side_effect=results) as check:
+            self.operation.verify_ssh(self.server)
+        return check
+
+    def test_polls_until_ready(self):
+        check = self.verify(self.refused(), self.refused(), True)
+        self.assertEqual(check.call_count, 3)
+        # The probe waits after the learned ssh delay, which is updated.
+        self.assertEqual(
+            self.provider.ssh_probe.wait.call_args[1]['expected'], 5.0)
+        kind, _ = self.provider.history.record.call_args[0]
+        self.assertEqual(kind, 'ssh')
+
+    def test_no_banner(self):
+        self.provider.ssh_probe.wait.return_value = False
+        self.assertRaises(TimeoutError, self.verify)
+        self.assertFalse(self.provider.history.record.called)
+
+    def test_timeout(self):
+        self.operation.timeout = 0.05
+        with mock.patch.object(
+                ops.ssh, 'check_ssh', side_effect=self.refused()):
+            self.assertRaises(
+                TimeoutError, self.operation.verify_ssh, self.server)
+        self.assertFalse(self.provider.history.record.called)
+
+    def test_other_error(self):
+        self.assertRaises(
+            subprocess.CalledProcessError, self.verify,
+            self.refused("Permission denied (publickey)."))
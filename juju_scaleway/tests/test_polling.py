@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from juju_scaleway import cancel
+from juju_scaleway.exceptions import OpCancelled
+from juju_scaleway.polling import PollPolicy, WaitHistory
+
+
+class PollerTest(unittest.TestCase):
+
+    def test_backoff(self):
+        poller = PollPolicy(
+            initial=1.0, factor=2.0, max_delay=5.0, jitter=0).start()
+        self.assertEqual(
+            [poller.next_delay() for _ in range(5)],
+            [1.0, 2.0, 4.0, 5.0, 5.0])
+
+    def test_jitter(self):
+        poller = PollPolicy(initial=10.0, factor=1.0, jitter=0.2).start()
+        for _ in range(50):
+            self.assertTrue(8.0 <= poller.next_delay() <= 12.0)
+
+    def test_expected(self):
+        poller = PollPolicy(initial=1.0, jitter=0, expected=20.0).start()
+        self.assertAlmostEqual(poller.next_delay(), 15.0, places=1)
+        self.assertEqual(poller.next_delay(), 1.5)
+
+    def test_deadline(self):
+        poller = PollPolicy(initial=5.0, jitter=0, timeout=1.0).start()
+        self.assertLessEqual(poller.next_delay(), 1.0)
+        poller.started -= 2
+        self.assertIsNone(poller.next_delay())
+        self.assertFalse(poller.sleep())
+        self.assertEqual(poller.remaining, 0)
+
+    def test_no_timeout(self):
+        self.assertIsNone(PollPolicy().start().remaining)
+
+
+class WaitHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = WaitHistory(os.path.join(self.directory, 'waits.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_median(self):
+        self.assertIsNone(self.history.expected('boot'))
+        for duration in (30, 10, 20):
+            self.history.record('boot', duration)
+        self.assertEqual(self.history.expected('boot'), 20)
+        self.assertIsNone(self.history.expected('ssh'))
+
+    def test_recent_samples(self):
+        for duration in range(WaitHistory.SAMPLES + 10):
+            self.history.record('boot', 100 + duration)
+        self.assertEqual(
+            self.history.expected('boot'), 110 + WaitHistory.SAMPLES // 2)
+
+
+class SleepTest(unittest.TestCase):
+
+    def test_cancel_wakes(self):
+        scope = cancel.Scope('op')
+        poller = PollPolicy(initial=30.0, jitter=0).start()
+        threading.Timer(0.1, scope.cancel).start()
+        start = time.time()
+        with scope.active():
+            self.assertRaises(OpCancelled, poller.sleep)
+        self.assertLess(time.time() - start, 1)
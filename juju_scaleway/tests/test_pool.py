@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway import pool
+from juju_scaleway.client import CreateResult, Server
+from juju_scaleway.exceptions import ProviderAPIError
+
+
+def server(server_id, name, tags=(), state='running'):
+    return Server.from_dict(
+        {'id': server_id, 'name': name, 'tags': list(tags), 'state': state})
+
+
+class PoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.provider = mock.Mock()
+        self.provider.iter_servers.return_value = []
+        self.pool = pool.Pool(self.provider, 'env', self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class FillTest(PoolTestCase):
+
+    def test_reports_failed_launches(self):
+        self.pool.set_target('trusty', 3)
+        spec = {'name': 'env-pool-trusty-1'}
+        self.provider.launch_servers.return_value = [
+            CreateResult(spec, None, ProviderAPIError(None, "quota")),
+            CreateResult(spec, server('id-2', 'env-pool-trusty-2'),
+                         ProviderAPIError(None, "poweron failed")),
+            CreateResult(spec, server('id-3', 'env-pool-trusty-3'), None)]
+        self.provider.wait_many.return_value = ([], [])
+
+        with mock.patch.object(pool, 'logger') as logger:
+            self.assertEqual(self.pool.fill('trusty', 'image'), 0)
+        self.assertEqual(logger.error.call_count, 2)
+        self.provider.terminate_server.assert_called_once_with('id-2')
+        waited = self.provider.wait_many.call_args[0][0]
+        self.assertEqual([member.id for member in waited], ['id-3'])
+
+
+class ClaimTest(PoolTestCase):
+
+    def setUp(self):
+        super(ClaimTest, self).setUp()
+        self.provider.iter_servers.return_value = [
+            server('id-1', 'env-pool-trusty-1', [pool.BOOTING_TAG]),
+            server('id-2', 'env-pool-trusty-2', [pool.READY_TAG],
+                   state='stopped'),
+            server('id-3', 'env-pool-trusty-3', [pool.READY_TAG]),
+            server('id-4', 'env-pool-trusty-4', [pool.READY_TAG]),
+            server('id-5', 'env-pool-trusty-5', [pool.READY_TAG])]
+        self.provider.update_server.side_effect = (
+            lambda server_id, **fields: server(server_id, fields['name']))
+
+    def test_ready_members(self):
+        claimed = self.pool.claim('trusty', 2)
+
+        self.assertEqual([member.id for member in claimed], ['id-3', 'id-4'])
+        self.provider.iter_servers.assert_called_once_with(
+            name_prefix='env-pool-trusty-')
+        for member in claimed:
+            self.assertTrue(member.name.startswith('env-'))
+            self.assertFalse(member.name.startswith('env-pool-'))
+        self.assertEqual(
+            [call[1]['tags'] for call in
+             self.provider.update_server.call_args_list], [[], []])
+
+    def test_failed_rename(self):
+        self.provider.update_server.side_effect = [
+            ProviderAPIError(mock.Mock(status_code=409), "conflict"),
+            server('id-4', 'env-4')]
+        claimed = self.pool.claim('trusty', 3)
+        self.assertEqual([member.id for member in claimed], ['id-4'])
+
+    def test_nothing_to_claim(self):
+        self.assertEqual(self.pool.claim('trusty', 0), [])
+        self.assertFalse(self.provider.iter_servers.called)
+
+
+class RefillTest(PoolTestCase):
+
+    def test_missing(self):
+        self.pool.set_target('trusty', 2)
+        self.provider.iter_servers.return_value = [
+            server('id-1', 'env-pool-trusty-1', [pool.READY_TAG])]
+        self.provider.launch_servers.return_value = []
+        self.provider.wait_many.return_value = ([], [])
+        self.pool.fill('trusty', 'image')
+
+        specs = self.provider.launch_servers.call_args[0][0]
+        self.assertEqual(len(specs), 1)
+        self.assertTrue(specs[0]['name'].startswith('env-pool-trusty-'))
+        self.assertEqual(
+            specs[0]['tags'], [pool.BOOTING_TAG, 'series:trusty'])
+
+    def test_full(self):
+        self.pool.set_target('trusty', 1)
+        self.provider.iter_servers.return_value = [
+            server('id-1', 'env-pool-trusty-1', [pool.BOOTING_TAG])]
+        self.assertEqual(self.pool.fill('trusty', 'image'), 0)
+        self.assertFalse(self.provider.launch_servers.called)
+
+    def test_in_background(self):
+        with mock.patch.object(pool.subprocess, 'Popen') as popen:
+            self.pool.refill_in_background('trusty')
+        args = popen.call_args[0][0]
+        self.assertEqual(
+            args[-5:], ['pool', '-e', 'env', '--series', 'trusty'])
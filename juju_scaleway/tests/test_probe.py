@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import socket
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway import probe
+from juju_scaleway.polling import PollPolicy
+
+
+def closed_port():
+    """Port nothing listens on, connections get refused.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class BannerProbeTest(unittest.TestCase):
+
+    def test_banner(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def answer():
+            conn, _ = server.accept()
+            conn.sendall(b'SSH-2.0-OpenSSH_6.6\r\n')
+            conn.close()
+
+        thread = threading.Thread(target=answer)
+        thread.start()
+        probes = probe.BannerProbe(port=server.getsockname()[1])
+        try:
+            self.assertTrue(probes.wait('127.0.0.1', 5))
+        finally:
+            thread.join()
+            server.close()
+
+    def attempts(self, timeout, expected=None):
+        probes = probe.BannerProbe(
+            port=closed_port(),
+            policy=PollPolicy(initial=0.2, factor=1.0, jitter=0))
+        with mock.patch.object(probe.stats, 'record_probe') as record:
+            self.assertFalse(
+                probes.wait('127.0.0.1', timeout, expected=expected))
+        return record.call_count
+
+    def test_backoff(self):
+        self.assertGreater(self.attempts(1.0), 2)
+
+    def test_expected(self):
+        # Refused once, then waits for most of the expected time.
+        self.assertEqual(self.attempts(1.0, expected=10), 1)
+
+
+class SelectBannerProbeTest(BannerProbeTest):
+    """Same probes on the ``select.select`` fallback of Python 2.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(probe, 'selectors', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
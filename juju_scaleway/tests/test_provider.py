@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway.client import Server
+from juju_scaleway.exceptions import ProviderAPIError
+from juju_scaleway.polling import NullHistory, PollPolicy
+from juju_scaleway.provider import Scaleway, ServerWatcher, StateCache
+
+
+class SlowLoader(object):
+    """Counts its calls, each blocking until ``release`` is set.
+    """
+
+    def __init__(self, value='value', error=None):
+        self.value = value
+        self.error = error
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(2)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class StateCacheTest(unittest.TestCase):
+
+    def gather(self, cache, key, loader, count=5):
+        """Results of ``count`` threads reading ``key`` at once.
+        """
+        results = []
+
+        def read():
+            try:
+                results.append(cache.get(key, loader))
+            except Exception as exc:
+                results.append(exc)
+
+        threads = [threading.Thread(target=read) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        loader.release.set()
+        for thread in threads:
+            thread.join(2)
+        return results
+
+    def test_single_flight(self):
+        cache = StateCache()
+        loader = SlowLoader()
+        self.assertEqual(self.gather(cache, 'key', loader), ['value'] * 5)
+        self.assertEqual(loader.calls, 1)
+
+    def test_shared_error(self):
+        cache = StateCache()
+        error = ValueError("boom")
+        loader = SlowLoader(error=error)
+        self.assertEqual(self.gather(cache, 'key', loader), [error] * 5)
+        self.assertEqual(loader.calls, 1)
+        # Errors are not cached.
+        loader.error = None
+        self.assertEqual(cache.get('key', loader), 'value')
+
+    def test_ttl(self):
+        cache = StateCache(ttl=0.1)
+        loader = SlowLoader()
+        loader.release.set()
+        cache.get('key', loader)
+        cache.get('key', loader)
+        self.assertEqual(loader.calls, 1)
+        time.sleep(0.15)
+        cache.get('key', loader)
+        self.assertEqual(loader.calls, 2)
+
+    def test_invalidate(self):
+        cache = StateCache(ttl=60)
+        loader = SlowLoader()
+        loader.release.set()
+        cache.get(('server', 'a'), loader)
+        cache.get(('server', 'b'), loader)
+        cache.get(('servers', None, None), loader)
+        cache.invalidate('a')
+        self.assertEqual(list(cache.entries), [('server', 'b')])
+        cache.invalidate()
+        self.assertEqual(cache.entries, {})
+
+    def test_load_overlapping_write(self):
+        cache = StateCache(ttl=60)
+        loader = SlowLoader()
+        thread = threading.Thread(target=cache.get, args=('key', loader))
+        thread.start()
+        time.sleep(0.05)
+        cache.invalidate()
+        loader.release.set()
+        thread.join(2)
+        self.assertNotIn('key', cache.entries)
+
+    def test_put(self):
+        cache = StateCache(ttl=60)
+        generation = cache.generation
+        cache.put(('server', 'a'), 'old', generation)
+        self.assertIn(('server', 'a'), cache.entries)
+        cache.invalidate()
+        cache.put(('server', 'a'), 'stale', generation)
+        self.assertNotIn(('server', 'a'), cache.entries)
+
+
+class IterServersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.iter_servers.return_value = iter([
+            Server.from_dict(
+                {'id': '1', 'name': 'env-1', 'state': 'running'}),
+            Server.from_dict(
+                {'id': '2', 'name': 'other-env-2', 'state': 'running'}),
+            Server.from_dict(
+                {'id': '3', 'name': 'env-3', 'state': 'stopped'})])
+        self.provider = Scaleway({}, client=self.client)
+
+    def test_name_prefix(self):
+        servers = self.provider.iter_servers(name_prefix='env-')
+        self.assertEqual([server.id for server in servers], ['1', '3'])
+        self.client.iter_servers.assert_called_once_with(
+            name='env-', state=None)
+
+    def test_state(self):
+        servers = self.provider.iter_servers(
+            name_prefix='env-', state='running')
+        self.assertEqual([server.id for server in servers], ['1'])
+        self.client.iter_servers.assert_called_once_with(
+            name='env-', state='running')
+
+    def test_unfiltered(self):
+        servers = self.provider.iter_servers()
+        self.assertEqual(len(list(servers)), 3)
+        self.client.iter_servers.assert_called_once_with(
+            name=None, state=None)
+
+
+class FakeProvider(object):
+    """Servers are running after ``boot_polls`` reads of them.
+    """
+
+    history = NullHistory()
+
+    def __init__(self, names, boot_polls=2):
+        self.servers = dict(('id-%s' % name, name) for name in names)
+        self.boot_polls = boot_polls
+        self.polls = {}
+        self.calls = []
+        self.errors = []
+
+    def server(self, server_id):
+        self.polls[server_id] = self.polls.get(server_id, 0) + 1
+        state = 'starting'
+        if self.polls[server_id] >= self.boot_polls:
+            state = 'running'
+        return Server.from_dict({
+            'id': server_id, 'name': self.servers[server_id],
+            'state': state})
+
+    def get_server(self, server_id):
+        self.calls.append(('get_server', server_id))
+        return self.server(server_id)
+
+    def get_servers(self, name_prefix=None):
+        self.calls.append(('get_servers', name_prefix))
+        if self.errors:
+            raise self.errors.pop(0)
+        return [self.server(server_id) for server_id in sorted(self.servers)]
+
+
+class ServerWatcherTest(unittest.TestCase):
+
+    def wait_many(self, provider, names, timeout=5):
+        watcher = ServerWatcher(
+            provider, PollPolicy(initial=0.01, max_delay=0.01, jitter=0))
+        return watcher.wait_many(
+            [Server.from_dict({'id': 'id-%s' % name, 'name': name})
+             for name in names], timeout)
+
+    def test_one_listing_per_tick(self):
+        provider = FakeProvider(['env-1', 'env-2', 'env-3'])
+        ready, stuck = self.wait_many(provider, ['env-1', 'env-2', 'env-3'])
+        self.assertEqual(
+            sorted(server.id for server in ready),
+            ['id-env-1', 'id-env-2', 'id-env-3'])
+        self.assertEqual(stuck, [])
+        self.assertTrue(all(server.state == 'running' for server in ready))
+        self.assertEqual(provider.calls, [('get_servers', 'env-')] * 2)
+
+    def test_single_server(self):
+        provider = FakeProvider(['env-1'])
+        ready, _ = self.wait_many(provider, ['env-1'])
+        self.assertEqual([server.id for server in ready], ['id-env-1'])
+        self.assertEqual(provider.calls, [('get_server', 'id-env-1')] * 2)
+
+    def test_timeout(self):
+        provider = FakeProvider(['env-1', 'env-2'], boot_polls=1000)
+        ready, stuck = self.wait_many(provider, ['env-1', 'env-2'], 0.05)
+        self.assertEqual(ready, [])
+        self.assertEqual(
+            [(server.id, server.state) for server in stuck],
+            [('id-env-1', 'starting'), ('id-env-2', 'starting')])
+
+    def test_boot_history(self):
+        provider = FakeProvider(['env-1', 'env-2'])
+        provider.history = mock.Mock()
+        provider.history.expected.return_value = 0.02
+        watcher = ServerWatcher(
+            provider, PollPolicy(initial=0.01, max_delay=0.01, jitter=0))
+        watcher.wait_many(
+            [Server.from_dict({'id': 'id-env-1', 'name': 'env-1'}),
+             Server.from_dict({'id': 'id-env-2', 'name': 'env-2'})], 5)
+        # First listing pushed back to the learned boot time.
+        self.assertEqual(watcher.policy.expected, 0.02)
+        self.assertEqual(
+            [call[0][0] for call in provider.history.record.call_args_list],
+            ['boot', 'boot'])
+
+    def test_refresh_error(self):
+        provider = FakeProvider(['env-1', 'env-2'], boot_polls=1)
+        provider.errors.append(
+            ProviderAPIError(mock.Mock(status_code=503), "unavailable"))
+        ready, _ = self.wait_many(provider, ['env-1', 'env-2'])
+        self.assertEqual(len(ready), 2)
+        self.assertEqual(len(provider.calls), 2)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import email.utils
+import threading
+import time
+import unittest
+
+from juju_scaleway.ratelimit import HIGH, LOW, RateLimiter, parse_retry_after
+
+
+class ReserveTest(unittest.TestCase):
+
+    def test_takes_tokens(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertGreater(limiter.reserve(), 0)
+
+    def test_backoff(self):
+        limiter = RateLimiter(rate=10, burst=10)
+        limiter.backoff(5)
+        self.assertGreater(limiter.reserve(HIGH), 4)
+
+    def test_blocked_threads_first(self):
+        limiter = RateLimiter(rate=10, burst=10)
+        limiter._waiters.append((HIGH, 0))
+        self.assertGreater(limiter.reserve(LOW), 0)
+
+
+class AcquireTest(unittest.TestCase):
+
+    def test_burst(self):
+        limiter = RateLimiter(rate=1, burst=3)
+        start = time.time()
+        for _ in range(3):
+            limiter.acquire()
+        self.assertLess(time.time() - start, 0.1)
+
+    def test_waits_for_refill(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        limiter.acquire()
+        start = time.time()
+        limiter.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+    def test_priority(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        limiter.backoff(0.2)
+        served = []
+
+        def acquire(name, priority):
+            limiter.acquire(priority)
+            served.append(name)
+
+        threads = [threading.Thread(target=acquire, args=('low', LOW))]
+        threads[0].start()
+        time.sleep(0.05)
+        threads.append(threading.Thread(target=acquire, args=('high', HIGH)))
+        threads[1].start()
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(served, ['high', 'low'])
+
+    def test_update_blocks_until_reset(self):
+        limiter = RateLimiter(rate=20, burst=20)
+        limiter.update(
+            {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '0.2'})
+        start = time.time()
+        limiter.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.15)
+
+    def test_update_ignores_garbage(self):
+        limiter = RateLimiter(rate=20, burst=20)
+        limiter.update({'X-RateLimit-Remaining': 'many'})
+        limiter.update({})
+        self.assertEqual(limiter.reserve(), 0)
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('3'), 3.0)
+        self.assertEqual(parse_retry_after('-1'), 0.0)
+
+    def test_date(self):
+        delay = parse_retry_after(
+            email.utils.formatdate(time.time() + 60, usegmt=True))
+        self.assertTrue(55 < delay <= 60)
+
+    def test_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import itertools
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway import cancel
+from juju_scaleway import registrar
+from juju_scaleway.exceptions import JujuAPIError, OpCancelled
+from juju_scaleway.registrar import Registrar
+
+
+class FakeAPI(object):
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.batches = []
+        self.errors = {}
+
+    def add_machines(self, machine_params):
+        self.batches.append(machine_params)
+        results = []
+        for params in machine_params:
+            host = params['Addrs'][0]['Value']
+            if host in self.errors:
+                results.append(JujuAPIError(self.errors[host]))
+            else:
+                results.append(str(next(self.ids)))
+        return results
+
+    def provisioning_script(self, machine_id, nonce):
+        return "echo %s\n" % machine_id
+
+
+class FakeEnv(object):
+
+    def __init__(self, api=None):
+        self.client = api
+        self.added = []
+        self.removed = []
+
+    def api(self):
+        return self.client
+
+    def api_failed(self, exc):
+        self.client = None
+
+    def add_machine(self, location, key=None):
+        self.added.append(location)
+        return location.split('@', 1)[-1]
+
+    def terminate_machines(self, machine_ids):
+        self.removed.extend(machine_ids)
+
+    def authorized_keys(self):
+        return "ssh-rsa AAAA juju"
+
+
+def sleep_process(*args, **kwargs):
+    cancel.run(['sleep', '10'])
+
+
+class Waiter(threading.Thread):
+    """Registers a host within the scope of an op, like MachineRegister.
+    """
+
+    def __init__(self, hosts, host, time_limit=None):
+        super(Waiter, self).__init__()
+        self.daemon = True
+        self.hosts = hosts
+        self.host = host
+        self.scope = cancel.Scope(host, time_limit)
+        self.result = self.error = None
+
+    def run(self):
+        try:
+            with self.scope.active():
+                self.result = self.hosts.register(self.host, 'trusty')
+        except Exception as exc:
+            self.error = exc
+
+
+@mock.patch.object(registrar.ssh, 'detect_hardware', return_value={})
+class RegistrarTest(unittest.TestCase):
+
+    def register(self, hosts, addresses):
+        waiters = [Waiter(hosts, address) for address in addresses]
+        for waiter in waiters:
+            waiter.start()
+        for waiter in waiters:
+            waiter.join(10)
+        return waiters
+
+    @mock.patch.object(registrar.ssh, 'provision_machine')
+    def test_batch(self, provision, _):
+        api = FakeAPI()
+        hosts = Registrar(FakeEnv(api), workers=2)
+        waiters = self.register(
+            hosts, ['10.0.0.%d' % index for index in range(5)])
+        hosts.close()
+        self.assertEqual(
+            sorted(waiter.result for waiter in waiters),
+            ['1', '2', '3', '4', '5'])
+        self.assertEqual([len(batch) for batch in api.batches], [5])
+        self.assertEqual(provision.call_count, 5)
+
+    def test_cli(self, _):
+        env = FakeEnv()
+        hosts = Registrar(env, workers=2)
+        waiter, = self.register(hosts, ['10.0.0.1'])
+        hosts.close()
+        self.assertEqual(waiter.result, '10.0.0.1')
+        self.assertEqual(env.added, ['ssh:root@10.0.0.1'])
+
+    @mock.patch.object(registrar.ssh, 'provision_machine')
+    def test_machine_errors(self, provision, _):
+        api = FakeAPI()
+        api.errors['10.0.0.2'] = "no such series"
+        env = FakeEnv(api)
+        hosts = Registrar(env, workers=2)
+        waiters = self.register(hosts, ['10.0.0.1', '10.0.0.2'])
+        hosts.close()
+        results = dict((waiter.host, waiter) for waiter in waiters)
+        self.assertIsNone(results['10.0.0.1'].error)
+        self.assertIsInstance(results['10.0.0.2'].error, JujuAPIError)
+        self.assertEqual(provision.call_count, 1)
+        self.assertEqual(env.removed, [])
+
+    @mock.patch.object(registrar.ssh, 'provision_machine')
+    def test_lost_connection(self, provision, _):
+        api = FakeAPI()
+        api.add_machines = mock.Mock(
+            side_effect=JujuAPIError("Lost the juju API connection"))
+        env = FakeEnv(api)
+        hosts = Registrar(env, workers=2)
+        waiters = self.register(hosts, ['10.0.0.1', '10.0.0.2'])
+        hosts.close()
+        # Through the juju CLI.
+        self.assertEqual(
+            sorted(waiter.result for waiter in waiters),
+            ['10.0.0.1', '10.0.0.2'])
+        self.assertIsNone(env.client)
+        self.assertEqual(provision.call_count, 0)
+
+    @mock.patch.object(registrar.ssh, 'provision_machine', sleep_process)
+    def test_cancel_kills_provisioning(self, _):
+        env = FakeEnv(FakeAPI())
+        hosts = Registrar(env, workers=1)
+        waiter = Waiter(hosts, '10.0.0.1')
+        waiter.start()
+        time.sleep(Registrar.WINDOW + 0.5)
+        start = time.time()
+        waiter.scope.cancel()
+        waiter.join(5)
+        hosts.close()
+        self.assertLess(time.time() - start, 5)
+        self.assertIsInstance(waiter.error, OpCancelled)
+        # Recorded before the op gave up.
+        self.assertEqual(env.removed, ['1'])
+
+    @mock.patch.object(registrar.ssh, 'provision_machine', sleep_process)
+    def test_time_limit_kills_provisioning(self, _):
+        env = FakeEnv(FakeAPI())
+        hosts = Registrar(env, workers=1)
+        waiter = Waiter(hosts, '10.0.0.1', time_limit=1)
+        waiter.start()
+        time.sleep(Registrar.WINDOW + 1.5)
+        # What the runner tick does.
+        self.assertTrue(waiter.scope.expired())
+        waiter.scope.cancel(cancel.Scope.TIMEOUT)
+        waiter.join(5)
+        hosts.close()
+        self.assertEqual(env.removed, ['1'])
+
+    @mock.patch.object(registrar.ssh, 'provision_machine')
+    def test_cancelled_before_recorded(self, provision, _):
+        api = FakeAPI()
+        env = FakeEnv(api)
+        hosts = Registrar(env, workers=1)
+        waiter = Waiter(hosts, '10.0.0.1')
+        waiter.start()
+        # Within the batch window.
+        time.sleep(Registrar.WINDOW / 5)
+        waiter.scope.cancel()
+        waiter.join(5)
+        time.sleep(Registrar.WINDOW)
+        hosts.close()
+        self.assertIsInstance(waiter.error, OpCancelled)
+        self.assertEqual(api.batches, [])
+        self.assertEqual(provision.call_count, 0)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import subprocess
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+import requests
+
+from juju_scaleway import cancel
+from juju_scaleway import retry
+from juju_scaleway.exceptions import (
+    JujuAPIError, OpCancelled, ProviderAPIError, TimeoutError)
+from juju_scaleway.polling import PollPolicy
+
+
+def api_error(status):
+    return ProviderAPIError(mock.Mock(status_code=status), "error")
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def test_api(self):
+        self.assertEqual(retry.classify(api_error(503)), retry.API)
+        self.assertEqual(retry.classify(api_error(429)), retry.API)
+        self.assertEqual(retry.classify(api_error(None)), retry.API)
+        self.assertIsNone(retry.classify(api_error(400)))
+        self.assertEqual(
+            retry.classify(requests.ConnectionError()), retry.API)
+
+    def test_subprocess(self):
+        self.assertEqual(
+            retry.classify(subprocess.CalledProcessError(
+                1, ['/usr/bin/juju', 'add-machine'])),
+            retry.JUJU)
+        self.assertEqual(
+            retry.classify(subprocess.CalledProcessError(
+                255, ['/usr/bin/ssh', 'root@10.0.0.1'])),
+            retry.SSH)
+        self.assertEqual(retry.classify(TimeoutError("ssh")), retry.SSH)
+
+    def test_juju_api(self):
+        self.assertEqual(
+            retry.classify(JujuAPIError("Lost the juju API connection")),
+            retry.JUJU)
+        self.assertEqual(
+            retry.classify(JujuAPIError("state changing", 'try again')),
+            retry.JUJU)
+        self.assertEqual(
+            retry.classify(JujuAPIError("cannot add a new machine")),
+            retry.JUJU)
+
+    def test_juju_api_permanent(self):
+        self.assertIsNone(
+            retry.classify(JujuAPIError("machine 3 not found", 'not found')))
+        self.assertIsNone(
+            retry.classify(JujuAPIError("bad login", 'unauthorized access')))
+        self.assertIsNone(retry.classify(JujuAPIError(
+            'Client.AddMachines: no such series "vivid"')))
+
+    def test_other(self):
+        self.assertIsNone(retry.classify(ValueError()))
+        self.assertIsNone(retry.classify(OpCancelled()))
+
+    def test_cancelled_scope(self):
+        scope = cancel.Scope('op', 10)
+        with scope.active():
+            scope.cancel(cancel.Scope.TIMEOUT)
+            self.assertIsNone(retry.classify(api_error(503)))
+
+
+class RetriesTest(unittest.TestCase):
+
+    def test_limits(self):
+        policy = retry.RetryPolicy(
+            api=2, ssh=0, juju=1, backoff=PollPolicy(initial=0))
+        retries = policy.start()
+        error = api_error(502)
+        self.assertEqual(retries.allow(error), retry.API)
+        self.assertEqual(retries.allow(error), retry.API)
+        self.assertIsNone(retries.allow(error))
+        self.assertIsNone(retries.allow(TimeoutError("ssh")))
+        self.assertEqual(retries.allow(JujuAPIError("lost")), retry.JUJU)
+        self.assertIsNone(retries.allow(JujuAPIError("lost")))
+
+    def test_uniform(self):
+        policy = retry.RetryPolicy.uniform(3)
+        self.assertEqual(
+            policy.limits, {retry.API: 3, retry.SSH: 3, retry.JUJU: 3})
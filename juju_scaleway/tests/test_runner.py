@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import io
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway import cancel
+from juju_scaleway import runner
+from juju_scaleway.runner import OpResult, Pipeline, Progress, Runner
+
+
+class SleepOp(object):
+    """Waits, checking for cancellation, and records the workers running.
+    """
+
+    def __init__(self, seconds, time_limit=None, workers=None):
+        self.seconds = seconds
+        self.time_limit = time_limit
+        self.workers = workers
+        self.seen = 0
+
+    def run(self):
+        if self.workers is not None:
+            self.seen = len(self.workers.threads)
+        deadline = time.time() + self.seconds
+        while time.time() < deadline:
+            cancel.check()
+            time.sleep(0.02)
+        return self.seconds
+
+
+class RunnerTest(unittest.TestCase):
+
+    def test_results(self):
+        tasks = Runner(workers=2)
+        for seconds in (0.01, 0.02, 0.03):
+            tasks.queue_op(SleepOp(seconds))
+        results = list(tasks.iter_results())
+        self.assertEqual(
+            sorted(result.value for result in results), [0.01, 0.02, 0.03])
+        self.assertTrue(all(result.ok for result in results))
+
+    def test_failure(self):
+        operation = mock.Mock(time_limit=None)
+        operation.run.side_effect = ValueError("boom")
+        tasks = Runner(workers=1)
+        tasks.queue_op(operation)
+        result, = list(tasks.iter_results())
+        self.assertEqual(result.status, OpResult.FAILED)
+        self.assertIsInstance(result.error, ValueError)
+
+    @mock.patch.object(runner, 'cpu_load', return_value=0)
+    @mock.patch.object(runner.Autoscaler, 'INTERVAL', 0.2)
+    def test_autoscale_with_steady_results(self, _):
+        # Results keep coming faster than the tick interval.
+        tasks = Runner(workers='auto')
+        operations = [
+            SleepOp(0.3, workers=tasks.workers) for _ in range(60)]
+        for operation in operations:
+            tasks.queue_op(operation)
+        self.assertTrue(all(result.ok for result in tasks.iter_results()))
+        self.assertGreater(
+            max(operation.seen for operation in operations),
+            Runner.DEFAULT_NUM_RUNNER)
+
+    def test_time_limit_with_steady_results(self):
+        tasks = Runner(workers=2)
+        slow = SleepOp(10, time_limit=1)
+        tasks.queue_op(slow)
+        for _ in range(40):
+            tasks.queue_op(SleepOp(0.1))
+        results = dict(
+            (result.op, result) for result in tasks.iter_results())
+        self.assertEqual(results[slow].status, OpResult.TIMEOUT)
+        self.assertLess(results[slow].duration, 2.5)
+
+    def test_cancel_drops_queued_ops(self):
+        tasks = Runner(workers=1)
+        operations = [SleepOp(5) for _ in range(3)]
+        for operation in operations:
+            tasks.queue_op(operation)
+        timer = threading.Timer(0.3, tasks.cancel)
+        timer.start()
+        statuses = [result.status for result in tasks.iter_results()]
+        timer.join()
+        self.assertEqual(statuses, [OpResult.CANCELLED] * 3)
+
+
+class StagedOp(object):
+    """Records its stages, failing ``fail`` and blocking in ``block``
+    until ``release`` is set.
+    """
+
+    stages = ('first', 'second')
+    time_limit = None
+
+    def __init__(self, fail=None, block=None, release=None):
+        self.fail = fail
+        self.block = block
+        self.release = release
+        self.ran = []
+        self.aborted = False
+
+    def run_stage(self, name):
+        if name == self.block:
+            self.release.wait()
+        if name == self.fail:
+            raise ValueError(name)
+        self.ran.append(name)
+
+    def finish(self):
+        return self.ran
+
+    def abort(self):
+        self.aborted = True
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_stages(self):
+        tasks = Pipeline([('first', 2), ('second', 1)])
+        operations = [StagedOp() for _ in range(5)]
+        for operation in operations:
+            tasks.queue_op(operation)
+        results = list(tasks.iter_results())
+        self.assertEqual(
+            [result.value for result in results],
+            [['first', 'second']] * 5)
+
+    def test_failed_stage_aborts(self):
+        tasks = Pipeline([('first', 1), ('second', 1)])
+        operation = StagedOp(fail='second')
+        tasks.queue_op(operation)
+        result, = list(tasks.iter_results())
+        self.assertEqual(result.status, OpResult.FAILED)
+        self.assertEqual(operation.ran, ['first'])
+        self.assertTrue(operation.aborted)
+
+    def test_depths(self):
+        release = threading.Event()
+        tasks = Pipeline([('first', 1), ('second', 1)])
+        for _ in range(3):
+            tasks.queue_op(StagedOp(block='first', release=release))
+        tasks.start()
+        try:
+            time.sleep(0.2)
+            # One op blocks the only first stage worker.
+            self.assertEqual(tasks.depths(), [('first', 2), ('second', 0)])
+        finally:
+            release.set()
+        self.assertEqual(len(list(tasks.iter_results())), 3)
+        tasks.stop()
+
+
+class ProgressTest(unittest.TestCase):
+
+    def test_line(self):
+        progress = Progress("machines", 10, stream=io.StringIO())
+        progress.update(2, 1, 3)
+        self.assertTrue(progress.line().startswith(
+            "machines: 2/10 done, 3 running, 1 failed, ETA "))
+
+    def test_line_with_depths(self):
+        progress = Progress("machines", 10, stream=io.StringIO())
+        progress.update(2, 1, 3, [('launch', 4), ('wait', 0)])
+        self.assertTrue(progress.line().endswith(
+            ", queued launch:4 wait:0"))
+
+
+class WorkersTest(unittest.TestCase):
+
+    def test_resize(self):
+        jobs = runner.Queue()
+        handled = []
+        workers = runner.Workers(jobs, handled.append)
+        workers.resize(3)
+        self.assertEqual(len(workers.threads), 3)
+        for index in range(5):
+            jobs.put(index)
+        workers.resize(1)
+        time.sleep(runner.Workers.IDLE_CHECK * 3)
+        self.assertEqual(len(workers.threads), 1)
+        workers.stop()
+        self.assertEqual(sorted(handled), list(range(5)))
+        self.assertEqual(workers.threads, [])
+
+
+class AutoscalerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.autoscaler = runner.Autoscaler(8)
+        # Not the process wide counters, other tests bump them.
+        self.autoscaler.last = self.snapshot()
+        self.autoscaler.checked = 0
+
+    def snapshot(self, **values):
+        data = {
+            'throttles': 0, 'requests': 0, 'request_time': 0.0,
+            'subprocesses': 0, 'subprocess_time': 0.0}
+        data.update(values)
+        return data
+
+    @mock.patch.object(runner, 'cpu_load', return_value=0)
+    def test_grow_on_backlog(self, _):
+        with mock.patch.object(
+                runner.stats, 'snapshot', return_value=self.snapshot()):
+            self.assertEqual(self.autoscaler.adjust(4, backlog=3), 5)
+            # Rate limited.
+            self.assertEqual(self.autoscaler.adjust(5, backlog=3), 5)
+
+    @mock.patch.object(runner, 'cpu_load', return_value=0)
+    def test_shrink_on_throttle(self, _):
+        with mock.patch.object(
+                runner.stats, 'snapshot',
+                return_value=self.snapshot(throttles=1)):
+            self.assertEqual(self.autoscaler.adjust(4, backlog=3), 2)
+
+    @mock.patch.object(runner, 'cpu_load', return_value=0)
+    def test_shrink_on_slowdown(self, _):
+        snapshots = [
+            self.snapshot(requests=10, request_time=1.0),
+            self.snapshot(requests=20, request_time=6.0)]
+        with mock.patch.object(
+                runner.stats, 'snapshot', side_effect=snapshots):
+            self.assertEqual(self.autoscaler.adjust(4, backlog=3), 5)
+            self.autoscaler.checked = 0
+            self.assertEqual(self.autoscaler.adjust(5, backlog=3), 2)
+
+    @mock.patch.object(runner, 'cpu_load', return_value=3)
+    def test_shrink_on_load(self, _):
+        with mock.patch.object(
+                runner.stats, 'snapshot', return_value=self.snapshot()):
+            self.assertEqual(self.autoscaler.adjust(4, backlog=3), 2)
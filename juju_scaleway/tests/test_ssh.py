@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python2
+    import mock
+
+from juju_scaleway import ssh
+
+
+class ControlMastersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.masters = ssh.ControlMasters(os.path.join(self.directory, 'ssh'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_options(self):
+        path = os.path.join(self.directory, 'ssh', 'root@10.0.0.1')
+        self.assertEqual(self.masters.options('10.0.0.1'), [
+            '-o', 'ControlPath=%s' % path, '-o', 'ControlMaster=auto',
+            '-o', 'ControlPersist=%d' % ssh.ControlMasters.PERSIST])
+        self.assertEqual(self.masters.options('10.0.0.1', master=False), [
+            '-o', 'ControlPath=%s' % path, '-o', 'ControlMaster=no'])
+        self.assertTrue(os.path.isdir(self.masters.directory))
+
+    def test_long_path(self):
+        masters = ssh.ControlMasters(os.path.join(self.directory, 'x' * 100))
+        self.assertFalse(masters.enabled)
+        self.assertEqual(masters.options('10.0.0.1'), [])
+        self.assertEqual(masters.environ({'PATH': '/bin'}), {'PATH': '/bin'})
+
+    def test_environ(self):
+        env = self.masters.environ({'PATH': '/bin', 'HOME': '/root'})
+        self.assertEqual(
+            env['PATH'], os.pathsep.join([self.masters.bin_dir, '/bin']))
+        self.assertEqual(env['HOME'], '/root')
+
+        wrapper = os.path.join(self.masters.bin_dir, 'ssh')
+        self.assertTrue(os.access(wrapper, os.X_OK))
+        with open(wrapper) as handle:
+            content = handle.read()
+        self.assertIn('ControlMaster=auto', content)
+        self.assertIn(os.path.join(self.masters.directory, '%r@%h'), content)
+
+        # Left alone when up to date.
+        os.utime(wrapper, (1000, 1000))
+        self.masters.environ({})
+        self.assertEqual(os.stat(wrapper).st_mtime, 1000)
+
+    def test_close(self):
+        with mock.patch.object(ssh.subprocess, 'call') as call:
+            self.masters.close('10.0.0.1')
+            self.assertFalse(call.called)
+
+            os.makedirs(self.masters.directory)
+            open(self.masters.path('10.0.0.1'), 'w').close()
+            call.return_value = 0
+            self.masters.close('10.0.0.1')
+        cmd = call.call_args[0][0]
+        self.assertEqual(cmd[-3:], ['-O', 'exit', 'root@10.0.0.1'])
+
+
+class CheckSshTest(unittest.TestCase):
+
+    def test_master(self):
+        masters = mock.Mock()
+        masters.options.return_value = ['-o', 'ControlMaster=auto']
+        with mock.patch.object(ssh.cancel, 'call', return_value=0) as call:
+            self.assertTrue(ssh.check_ssh('10.0.0.1', masters=masters))
+        masters.options.assert_called_once_with('10.0.0.1', 'root', True)
+        cmd = call.call_args[0][0]
+        self.assertEqual(
+            cmd[-4:], ['-o', 'ControlMaster=auto', 'root@10.0.0.1', 'ls'])
+
+    def test_failure(self):
+        def call(cmd, stdout=None, stderr=None):
+            stdout.write(b"Connection refused")
+            return 255
+
+        with mock.patch.object(ssh.cancel, 'call', side_effect=call):
+            with self.assertRaises(subprocess.CalledProcessError) as raised:
+                ssh.check_ssh('10.0.0.1')
+        self.assertEqual(raised.exception.output, "Connection refused")
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import json
+import unittest
+
+from juju_scaleway.stats import Stats, Timing, endpoint
+
+
+class EndpointTest(unittest.TestCase):
+
+    def test_ids(self):
+        self.assertEqual(
+            endpoint('/servers/6bd0a6b0-2c4a-4b5e-9a8b-2f9e1f3c4d5e'),
+            '/servers/{id}')
+        self.assertEqual(
+            endpoint('/servers/6BD0A6B02C4A4B5E9A8B2F9E1F3C4D5E/action',
+                     'poweron'),
+            '/servers/{id}/action:poweron')
+
+    def test_query(self):
+        self.assertEqual(endpoint('/servers?page=2'), '/servers')
+
+
+class TimingTest(unittest.TestCase):
+
+    def test_add(self):
+        timing = Timing()
+        for elapsed in (0.01, 0.2, 0.3, 100):
+            timing.add(elapsed, error=elapsed > 1, retries=1, size=10)
+        data = timing.to_dict()
+        self.assertEqual(data['count'], 4)
+        self.assertEqual(data['errors'], 1)
+        self.assertEqual(data['retries'], 4)
+        self.assertEqual(data['bytes'], 40)
+        self.assertEqual(data['max'], 100)
+        self.assertEqual(data['histogram']['<=0.05'], 1)
+        self.assertEqual(data['histogram']['<=0.5'], 1)
+        self.assertEqual(data['histogram']['>60'], 1)
+
+    def test_percentile(self):
+        timing = Timing()
+        for _ in range(19):
+            timing.add(0.04)
+        timing.add(3)
+        self.assertEqual(timing.percentile(0.5), 0.05)
+        self.assertEqual(timing.percentile(0.95), 0.05)
+        self.assertEqual(timing.percentile(1), 5)
+
+    def test_empty(self):
+        data = Timing().to_dict()
+        self.assertEqual(data['mean'], 0)
+        self.assertEqual(data['p95'], 0)
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = Stats()
+
+    def test_requests(self):
+        self.stats.record_request('GET', '/servers', 0.1, status=200)
+        self.stats.record_request('GET', '/servers', 0.3, status=503,
+                                  retries=2)
+        self.stats.record_request('POST', '/servers', 0.2)
+        requests = self.stats.to_dict()['requests']
+        self.assertEqual(sorted(requests), ['GET /servers', 'POST /servers'])
+        self.assertEqual(requests['GET /servers']['count'], 2)
+        self.assertEqual(requests['GET /servers']['errors'], 1)
+        self.assertEqual(requests['GET /servers']['retries'], 2)
+        # No response at all counts as an error.
+        self.assertEqual(requests['POST /servers']['errors'], 1)
+
+    def test_timed_subprocess(self):
+        with self.stats.timed_subprocess('ssh'):
+            pass
+        try:
+            with self.stats.timed_subprocess('ssh'):
+                raise OSError()
+        except OSError:
+            pass
+        timing = self.stats.to_dict()['subprocesses']['ssh']
+        self.assertEqual((timing['count'], timing['errors']), (2, 1))
+
+    def test_snapshot(self):
+        self.stats.record_request('GET', '/servers', 0.5, status=200)
+        self.stats.record_subprocess('ssh', 1.5)
+        self.stats.record_throttle()
+        self.assertEqual(self.stats.snapshot(), {
+            'requests': 1, 'request_time': 0.5, 'subprocesses': 1,
+            'subprocess_time': 1.5, 'throttles': 1})
+
+    def test_formats(self):
+        self.stats.record_request('GET', '/servers', 0.1, status=200)
+        self.stats.record_probe('ssh banner', 0.01)
+        data = json.loads(self.stats.format_json())
+        self.assertEqual(data['requests']['GET /servers']['count'], 1)
+        table = self.stats.format_table().splitlines()
+        self.assertTrue(table[0].startswith('Call'))
+        self.assertTrue(table[1].startswith('GET /servers'))
+        self.assertTrue(table[2].startswith('ssh banner'))
+        self.assertEqual(table[-2], 'Throttled calls: 0')
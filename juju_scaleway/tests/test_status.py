@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014-2015 Online SAS and Contributors. All Rights Reserved.
+#
+# Licensed under the BSD 2-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the
+# License at http://opensource.org/licenses/BSD-2-Clause
+
+import io
+import unittest
+
+from juju_scaleway.status import json_member, load_yaml, status_machines
+
+
+class JsonMemberTest(unittest.TestCase):
+
+    def test_member(self):
+        text = '{"environment": "bench", "machines": {"0": {}}, "x": 1}'
+        self.assertEqual(json_member(text, 'machines'), {"0": {}})
+        self.assertEqual(json_member(text, 'x'), 1)
+
+    def test_whitespace(self):
+        text = ' \n{ "a" : [1, 2] ,\n\t"b" :{"c": "}"} }\n'
+        self.assertEqual(json_member(text, 'b'), {"c": "}"})
+
+    def test_missing(self):
+        self.assertIsNone(json_member('{"a": 1}', 'b'))
+        self.assertEqual(json_member('{}', 'b', default={}), {})
+
+    def test_stops_at_member(self):
+        # Members after the wanted one are not decoded.
+        self.assertEqual(json_member('{"a": 1, "b": nope', 'a'), 1)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, json_member, '[1, 2]', 'a')
+        self.assertRaises(ValueError, json_member, '{"a" 1}', 'a')
+        self.assertRaises(ValueError, json_member, '{"a": nope}', 'a')
+
+
+class StatusMachinesTest(unittest.TestCase):
+
+    def test_machines(self):
+        output = (b'{"environment": "bench", "machines": '
+                  b'{"1": {"dns-name": "10.0.0.1"}}, "services": {}}')
+        self.assertEqual(
+            status_machines(output), {"1": {"dns-name": "10.0.0.1"}})
+
+    def test_no_machines(self):
+        self.assertEqual(status_machines('{"machines": null}'), {})
+        self.assertEqual(status_machines('{"services": {}}'), {})
+
+
+class LoadYamlTest(unittest.TestCase):
+
+    def test_load(self):
+        self.assertEqual(
+            load_yaml(io.StringIO(u"a: 1\nb: [x, y]\n")),
+            {'a': 1, 'b': ['x', 'y']})
@@ -28,7 +28,9 @@ TEST_DEPENDENCIES = [
 ]
 
 EXTRA_DEPENDENCIES = {
-    'dev': ['PyYAML', 'requests', 'nose', 'mock']
+    'dev': ['PyYAML', 'requests', 'nose', 'mock'],
+    'async': ['aiohttp'],
+    'api': ['websocket-client'],
 }
 
 
@@ -64,6 +66,7 @@ setup(
     packages=find_packages(),
     install_requires=DEPENDENCIES,
     tests_require=DEPENDENCIES + TEST_DEPENDENCIES,
+    test_suite='juju_scaleway.tests',
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Environment :: Web Environment',